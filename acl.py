@@ -0,0 +1,184 @@
+"""Role-based access control for bot commands.
+
+Roles are held in hash sets, so a permission check is a constant-time lookup
+however many admins there are. Roles are ranked: an owner has every admin
+right and an admin every staff right. Moderators are granted per group and
+admins count as moderators everywhere.
+
+The roles live in a JSON file::
+
+    {"owner": [id, ...], "admin": [...], "staff": [...],
+     "moderator": {"<group id>": [id, ...]}}
+
+A plain list of ids (the old admins.json format) is read as admins. Changes
+are written atomically and the file is reloaded when its mtime changes
+(checked at most every ``check_interval`` seconds), so every bot process
+sees role changes made by another without a restart.
+"""
+
+import functools
+
+from storage import JsonFile
+
+OWNER = "owner"
+ADMIN = "admin"
+STAFF = "staff"
+MODERATOR = "moderator"
+RANKED_ROLES = (OWNER, ADMIN, STAFF)  # highest first
+ROLES = (*RANKED_ROLES, MODERATOR)
+
+
+class AccessControl:
+    """User roles loaded from (and saved to) a JSON file"""
+
+    def __init__(self, path, default_admins=(), check_interval=2.0):
+        self.file = JsonFile(path, check_interval)
+        # dicts used as insertion-ordered sets
+        self._roles = {role: {} for role in RANKED_ROLES}
+        self._moderators = {}  # chat_id -> {user_id: None}
+        if not self.reload_if_changed(force=True):
+            self._roles[ADMIN] = dict.fromkeys(default_admins)
+            if not self.file.exists():
+                self._save()
+
+    # Checks -----------------------------------------------------------------
+
+    def has_role(self, user_id, role, chat_id=None):
+        """Whether ``user_id`` holds ``role`` (or a higher one).
+
+        ``chat_id`` names the group for MODERATOR checks.
+        """
+        self.reload_if_changed()
+        if role == MODERATOR:
+            if user_id in self._roles[OWNER] or user_id in self._roles[ADMIN]:
+                return True
+            return user_id in self._moderators.get(chat_id, ())
+        for ranked in RANKED_ROLES:
+            if user_id in self._roles[ranked]:
+                return True
+            if ranked == role:
+                return False
+        raise ValueError(f"Unknown role: {role}")
+
+    def is_admin(self, user_id):
+        return self.has_role(user_id, ADMIN)
+
+    def is_staff(self, user_id):
+        return self.has_role(user_id, STAFF)
+
+    def members(self, role, chat_id=None):
+        """Ids granted exactly ``role``, in the order they were added"""
+        self.reload_if_changed()
+        if role == MODERATOR:
+            return list(self._moderators.get(chat_id, ()))
+        return list(self._roles[role])
+
+    def moderated_chats(self):
+        self.reload_if_changed()
+        return {chat_id: list(users) for chat_id, users in self._moderators.items()}
+
+    def first_admin(self):
+        """The longest-standing admin (or owner), or None"""
+        self.reload_if_changed()
+        for role in (ADMIN, OWNER):
+            for user_id in self._roles[role]:
+                return user_id
+        return None
+
+    # Changes ----------------------------------------------------------------
+
+    def grant(self, role, user_ids, chat_id=None):
+        """Give ``role`` to ``user_ids``; returns (added, already held)"""
+        return self._change(role, user_ids, chat_id, grant=True)
+
+    def revoke(self, role, user_ids, chat_id=None):
+        """Take ``role`` from ``user_ids``; returns (removed, not held)"""
+        return self._change(role, user_ids, chat_id, grant=False)
+
+    def _change(self, role, user_ids, chat_id, grant):
+        if role not in ROLES:
+            raise ValueError(f"Unknown role: {role}")
+        if role == MODERATOR and chat_id is None:
+            raise ValueError("Moderators are granted per group")
+        # Start from the file, so changes another process made are kept
+        self.reload_if_changed(force=True)
+        if role == MODERATOR:
+            members = self._moderators.setdefault(chat_id, {})
+        else:
+            members = self._roles[role]
+        changed, unchanged = [], []
+        for user_id in user_ids:
+            if (user_id in members) == grant:
+                unchanged.append(user_id)
+                continue
+            if grant:
+                members[user_id] = None
+            else:
+                del members[user_id]
+            changed.append(user_id)
+        if role == MODERATOR and not members:
+            del self._moderators[chat_id]
+        if changed:
+            self._save()
+        return changed, unchanged
+
+    # Persistence ------------------------------------------------------------
+
+    def _save(self):
+        data = {role: list(members) for role, members in self._roles.items()}
+        data[MODERATOR] = {
+            str(chat_id): list(users) for chat_id, users in self._moderators.items()
+        }
+        try:
+            self.file.write(data)
+        except OSError as e:
+            print(f"Error writing {self.file.path}: {e}")
+
+    def _load(self, data):
+        if isinstance(data, list):
+            data = {ADMIN: data}
+        if not isinstance(data, dict):
+            raise TypeError("expected a list or an object")
+        roles = {
+            role: dict.fromkeys(map(int, data.get(role, ()))) for role in RANKED_ROLES
+        }
+        moderators = {}
+        for chat_id, users in (data.get(MODERATOR) or {}).items():
+            if users:
+                moderators[int(chat_id)] = dict.fromkeys(map(int, users))
+        self._roles = roles
+        self._moderators = moderators
+
+    def reload_if_changed(self, force=False):
+        """Re-read the file if it changed; returns True on reload"""
+        if not self.file.changed(force):
+            return False
+        try:
+            self._load(self.file.read())
+        except (IOError, AttributeError, TypeError, ValueError) as e:
+            print(f"Keeping current roles, could not load {self.file.path}: {e}")
+            return False
+        return True
+
+    # Handlers ---------------------------------------------------------------
+
+    def require(self, role, on_denied):
+        """Decorator that runs a handler only for users holding ``role``.
+
+        Other users get ``await on_denied(update, context)`` instead. Group
+        handlers check MODERATOR against the update's chat.
+        """
+
+        def decorator(callback):
+            @functools.wraps(callback)
+            async def wrapper(update, context):
+                user = update.effective_user
+                chat = update.effective_chat
+                chat_id = chat.id if chat else None
+                if user is None or not self.has_role(user.id, role, chat_id):
+                    return await on_denied(update, context)
+                return await callback(update, context)
+
+            return wrapper
+
+        return decorator
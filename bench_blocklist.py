@@ -0,0 +1,92 @@
+"""Micro-benchmark for the perceptual-hash image blocklist.
+
+Times HammingIndex lookups against a linear scan over the same banned
+hashes, for unrelated images (misses) and near duplicates (hits), and
+checks that a resized, re-encoded copy of an image hashes close to it.
+
+    python bench_blocklist.py [banned hashes] [lookups]
+"""
+
+import random
+import sys
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from blocklist import HammingIndex
+from moderation import image_hash
+
+MAX_DISTANCE = 10
+
+
+def linear_nearest(hashes, value):
+    best = None
+    for candidate in hashes:
+        distance = (value ^ candidate).bit_count()
+        if distance <= MAX_DISTANCE and (best is None or distance < best[0]):
+            best = (distance, candidate)
+    return best
+
+
+def near(value, rng):
+    """``value`` with up to MAX_DISTANCE random bits flipped"""
+    for bit in rng.sample(range(64), rng.randint(0, MAX_DISTANCE)):
+        value ^= 1 << bit
+    return value
+
+
+def bench(name, lookup, queries):
+    start = time.perf_counter()
+    results = [lookup(query) for query in queries]
+    per_lookup = (time.perf_counter() - start) / len(queries) * 1e6
+    print(f"{name:<28} {per_lookup:10.1f} µs/lookup")
+    return results
+
+
+def jpeg(img, **kwargs):
+    bio = BytesIO()
+    img.save(bio, "JPEG", **kwargs)
+    return bio.getvalue()
+
+
+def check_reencoding():
+    """Hash distance between an image and a smaller, recompressed copy"""
+    noise = np.random.default_rng(1).integers(0, 255, (60, 80, 3), dtype=np.uint8)
+    img = Image.fromarray(noise).resize((800, 600), Image.Resampling.BICUBIC)
+    original = image_hash(jpeg(img, quality=90))
+    copy = image_hash(jpeg(img.resize((480, 360)), quality=60))
+    other = image_hash(jpeg(img.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    print(f"re-encoded copy distance      {(original ^ copy).bit_count():3d} bits")
+    print(f"mirrored image distance       {(original ^ other).bit_count():3d} bits")
+
+
+def main():
+    banned = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    rng = random.Random(1)
+
+    hashes = [rng.getrandbits(64) for _ in range(banned)]
+    index = HammingIndex(MAX_DISTANCE)
+    start = time.perf_counter()
+    for value in hashes:
+        index.add(value)
+    print(f"indexed {banned} hashes in {time.perf_counter() - start:.2f}s")
+
+    misses = [rng.getrandbits(64) for _ in range(lookups)]
+    hits = [near(rng.choice(hashes), rng) for _ in range(lookups)]
+    for label, queries in (("miss", misses), ("near duplicate", hits)):
+        fast = bench(f"index, {label}", index.nearest, queries)
+        slow = bench(
+            f"linear scan, {label}",
+            lambda value: linear_nearest(hashes, value),
+            queries[: max(1, lookups // 20)],
+        )
+        # Same distance as the scan (ties may pick a different hash)
+        assert [r and r[0] for r in fast[: len(slow)]] == [r and r[0] for r in slow]
+    check_reencoding()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Micro-benchmark for the prohibited-content text filter.
+
+Compares the compiled KeywordFilter with the previous per-call keyword scan
+on a mix of ordinary and spam messages.
+
+    python bench_filter.py [iterations]
+"""
+
+import re
+import sys
+import timeit
+
+from moderation import DEFAULT_KEYWORDS, KeywordFilter
+
+MESSAGES = [
+    "ABC-1234",
+    "Hello, is my car ready yet?",
+    "សួស្តី តើឡានរបស់ខ្ញុំរួចរាល់ហើយឬនៅ?",
+    "Thank you for the quick wash, see you next week!",
+    "🎰 Best online CASINO, claim free bonus now at www.example.com 🎰",
+    "Connect wallet to claim your airdrop before the snapshot!",
+    "ភ្នាល់ និង ល្បែង អនឡាញ ឥតគិតថ្លៃ",
+    "Can you also clean the seats and the trunk please? " * 5,
+]
+
+
+def legacy_is_prohibited(text):
+    """The original implementation: rebuild, recompile and scan per call"""
+    prohibited_keywords = [kw for words in DEFAULT_KEYWORDS.values() for kw in words]
+    url_pattern = re.compile(r"https?://\S+|www\.\S+")
+    has_url = bool(url_pattern.search(text.lower()))
+    text_lower = text.lower()
+    return any(keyword in text_lower for keyword in prohibited_keywords) or has_url
+
+
+def bench(name, check, iterations):
+    seconds = timeit.timeit(
+        lambda: [check(message) for message in MESSAGES], number=iterations
+    )
+    per_message = seconds / (iterations * len(MESSAGES)) * 1e6
+    print(f"{name:<16} {per_message:8.2f} µs/message")
+    return per_message
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    content_filter = KeywordFilter()
+
+    for message in MESSAGES:
+        assert legacy_is_prohibited(message) == (
+            content_filter.match(message) is not None
+        ), message
+
+    legacy = bench("legacy scan", legacy_is_prohibited, iterations)
+    compiled = bench("compiled regex", content_filter.match, iterations)
+    print(f"speed-up         {legacy / compiled:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
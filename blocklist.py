@@ -0,0 +1,142 @@
+"""Banned images, matched by perceptual hash.
+
+Images are reduced to a 64-bit difference hash (``moderation.dhash``), which
+survives re-encoding, resizing and small edits; two images are near
+duplicates when their hashes differ in at most ``max_distance`` bits.
+
+Hashes are indexed by multi-index hashing: each hash is split into four
+16-bit chunks, with one dict per chunk position. Two hashes within distance
+``d`` differ in at most ``d // 4`` bits in at least one chunk, so a lookup
+only probes the chunk values within that radius (137 per chunk for d < 12)
+and compares the few hashes stored there. That keeps lookups well under a
+millisecond with tens of thousands of banned images (see bench_blocklist.py).
+"""
+
+import threading
+from itertools import combinations
+
+from storage import JsonFile
+
+HASH_BITS = 64
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+
+def flip_masks(bits, radius):
+    """Every ``bits``-wide mask with at most ``radius`` bits set"""
+    masks = []
+    for count in range(radius + 1):
+        for positions in combinations(range(bits), count):
+            mask = 0
+            for position in positions:
+                mask |= 1 << position
+            masks.append(mask)
+    return masks
+
+
+class HammingIndex:
+    """Set of 64-bit hashes searchable by Hamming distance"""
+
+    def __init__(self, max_distance=10):
+        self.max_distance = max_distance
+        self._hashes = set()
+        self._tables = [{} for _ in range(CHUNKS)]  # chunk value -> [hash, ...]
+        self._masks = flip_masks(CHUNK_BITS, max_distance // CHUNKS)
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def __contains__(self, value):
+        return value in self._hashes
+
+    def __iter__(self):
+        return iter(self._hashes)
+
+    @staticmethod
+    def _chunks(value):
+        for i in range(CHUNKS):
+            yield i, (value >> (i * CHUNK_BITS)) & CHUNK_MASK
+
+    def add(self, value):
+        """Add ``value``; returns False if it was already present"""
+        if value in self._hashes:
+            return False
+        self._hashes.add(value)
+        for i, chunk in self._chunks(value):
+            self._tables[i].setdefault(chunk, []).append(value)
+        return True
+
+    def nearest(self, value):
+        """(distance, hash) of the closest hash within ``max_distance``, or None"""
+        if value in self._hashes:
+            return 0, value
+        best = None
+        limit = self.max_distance
+        for i, chunk in self._chunks(value):
+            table = self._tables[i]
+            for mask in self._masks:
+                for candidate in table.get(chunk ^ mask, ()):
+                    distance = (value ^ candidate).bit_count()
+                    if distance <= limit:
+                        best, limit = (distance, candidate), distance - 1
+        return best
+
+
+class ImageBlocklist:
+    """Banned image hashes, persisted to ``path`` as hex strings.
+
+    The file is reloaded when its mtime changes, so an image banned through
+    one worker process is blocked by all of them. Lookups may come from the
+    image screening threads.
+    """
+
+    def __init__(self, path, max_distance=10, check_interval=5.0):
+        self.file = JsonFile(path, check_interval)
+        self.max_distance = max_distance
+        self.generation = 0  # bumped whenever the banned set changes
+        self._index = HammingIndex(max_distance)
+        self._lock = threading.Lock()
+        self.reload_if_changed(force=True)
+
+    def __len__(self):
+        return len(self._index)
+
+    def match(self, value):
+        """(distance, banned hash) for a near duplicate of ``value``, or None"""
+        self.reload_if_changed()
+        with self._lock:
+            return self._index.nearest(value)
+
+    def ban(self, value):
+        """Add ``value`` to the blocklist; returns False if already banned"""
+        # Rebuilt only if another process banned something since
+        self.reload_if_changed(force=True)
+        with self._lock:
+            if not self._index.add(value):
+                return False
+            self.generation += 1
+            hashes = sorted(self._index)
+        try:
+            self.file.write({"hashes": [f"{value:016x}" for value in hashes]})
+        except OSError as e:
+            print(f"Error writing {self.file.path}: {e}")
+        return True
+
+    def reload_if_changed(self, force=False):
+        """Re-read the file if it changed; returns True on reload"""
+        if not self.file.changed(force):
+            return False
+        try:
+            data = self.file.read()
+            index = HammingIndex(self.max_distance)
+            for value in data.get("hashes", []):
+                index.add(int(value, 16))
+        except (IOError, AttributeError, TypeError, ValueError) as e:
+            print(f"Keeping current blocklist, could not load {self.file.path}: {e}")
+            return False
+        with self._lock:
+            self._index = index
+            self.generation += 1
+        print(f"Loaded {len(index)} banned image hashes from {self.file.path}")
+        return True
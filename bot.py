@@ -1,9 +1,8 @@
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-import qrcode
+from telegram import ChatPermissions, Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
+from telegram.helpers import escape_markdown
 from io import BytesIO
 import re
-from PIL import Image
-import numpy as np
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -12,330 +11,438 @@ from telegram.ext import (
     MessageHandler,
     filters,
     ConversationHandler,
+    ChatMemberHandler,
+    TypeHandler,
 )
-import re
-import json
+import asyncio
+import contextlib
 import os
+import secrets
 import time
-import threading
-from datetime import datetime, timedelta
+from datetime import datetime
 from dotenv import load_dotenv
+from acl import ADMIN, MODERATOR, OWNER, STAFF, AccessControl
+from registry import (
+    COLLECTED,
+    PENDING,
+    READY,
+    REGISTERED,
+    WAITING,
+    TicketRegistry,
+)
+from storage import QueueAllocator, open_ticket_store
+from ticket_qr import QRRenderer
+from blocklist import ImageBlocklist
+from broadcast import Broadcaster
+from config import ChatTarget, ConfigStore
+from outbox import Outbox
+from router import ChatOrderedUpdateProcessor, Router
+from metrics import REGISTRY, MetricsRequest, instrument_handlers, start_http_server
+from moderation import (
+    Coalescer,
+    FloodControl,
+    ImageScreener,
+    KeywordFilter,
+    MediaFetcher,
+    MediaTooLarge,
+    ModerationQueue,
+    VerdictCache,
+    moderation_image,
+    text_key,
+)
+from templates import LANGUAGES, LanguagePreferences, pick_language, render
 
 load_dotenv()  # Load environment variables from .env file if present
 TOKEN = os.getenv("TELEGRAM_TOKEN")
 # Constants
-ADMIN_FILE = "admins.json"  # File to store admin IDs
-GROUP_FILE = "group_ids.json"
+ADMIN_FILE = "admins.json"  # Roles: owner, admin, staff and group moderators
+GROUP_FILE = os.getenv("GROUP_FILE", "group_ids.json")  # Notification groups
+TICKET_STORE = os.getenv("TICKET_STORE", "sqlite")  # "sqlite" or "memory"
+TICKET_DB = os.getenv("TICKET_DB", "tickets.db")  # SQLite file for open tickets
+OUTBOX_DB = os.getenv("OUTBOX_DB", "outbox.db")  # SQLite file for queued notifications
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))  # Then dead-lettered
+BOT_PERMISSION_TTL = int(os.getenv("BOT_PERMISSION_TTL", "600"))  # Seconds
+QR_WORKERS = int(os.getenv("QR_WORKERS", "2"))  # Threads rendering QR codes
+QR_POOL_SIZE = int(os.getenv("QR_POOL_SIZE", "0"))  # Pre-rendered QR codes, 0 = off
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "8"))  # Parallel sends
+FILTER_FILE = os.getenv("FILTER_FILE", "prohibited_keywords.json")  # Optional override
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))  # Threads screening photos
+IMAGE_BACKLOG = int(os.getenv("IMAGE_BACKLOG", "8"))  # Photos in flight before shedding
+MEDIA_MAX_BYTES = int(os.getenv("MEDIA_MAX_BYTES", "524288"))  # Largest image screened
+MEDIA_TIMEOUT = float(os.getenv("MEDIA_TIMEOUT", "10"))  # Seconds per image download
+IMAGE_BLOCKLIST = os.getenv("IMAGE_BLOCKLIST", "banned_images.json")  # /banimage hashes
+IMAGE_HASH_DISTANCE = int(os.getenv("IMAGE_HASH_DISTANCE", "10"))  # Bits, of 64
+IMAGE_HEURISTICS = os.getenv("IMAGE_HEURISTICS", "1") == "1"  # Colour checks too
+VERDICT_CACHE_SIZE = int(os.getenv("VERDICT_CACHE_SIZE", "10000"))  # Verdicts, 0 = off
+VERDICT_CACHE_TTL = int(os.getenv("VERDICT_CACHE_TTL", "21600"))  # Seconds per verdict
+FLOOD_USER_RATE = float(os.getenv("FLOOD_USER_RATE", "0.5"))  # Messages/s per user
+FLOOD_USER_BURST = int(os.getenv("FLOOD_USER_BURST", "10"))
+FLOOD_CHAT_RATE = float(os.getenv("FLOOD_CHAT_RATE", "20"))  # Messages/s per chat
+FLOOD_CHAT_BURST = int(os.getenv("FLOOD_CHAT_BURST", "60"))
+FLOOD_ACTION = os.getenv("FLOOD_ACTION", "delete")  # ignore, delete or mute
+FLOOD_MUTE_SECONDS = int(os.getenv("FLOOD_MUTE_SECONDS", "600"))
+WARNING_WINDOW = float(os.getenv("WARNING_WINDOW", "5"))  # Seconds warnings coalesce
+MODERATION_CHATS = os.getenv("MODERATION_CHATS", "groups")  # "groups" or "all"
+MODERATION_CONCURRENCY = int(os.getenv("MODERATION_CONCURRENCY", "4"))  # Checks at once
+MODERATION_BACKLOG = int(os.getenv("MODERATION_BACKLOG", "500"))  # Queued, then shed
+TICKET_TTL = 7 * 24 * 60 * 60  # Tickets are kept for 7 days
+EXPIRY_INTERVAL = int(os.getenv("EXPIRY_INTERVAL", "60"))  # Seconds between expiry runs
+EXPIRY_BATCH = int(os.getenv("EXPIRY_BATCH", "500"))  # Max tickets expired per run
+QUEUE_BLOCK_SIZE = int(os.getenv("QUEUE_BLOCK_SIZE", "20"))  # Numbers reserved at once
+STATUS_PAGE_SIZE = 5  # Tickets per /status page, keeps pages under 4096 chars
+USERS_PAGE_SIZE = 30  # Lines per /users page
+READY_PAGE_SIZE = 8  # Customers per /ready picker page
+GROUP_LANGUAGE = os.getenv("GROUP_LANGUAGE", "both")  # km, en or both for groups
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE")  # e.g. a local Bot API stand-in
+# Public base URL for webhook mode (Render sets RENDER_EXTERNAL_URL); unset = polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL") or os.getenv("RENDER_EXTERNAL_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))  # 1-100
+PORT = int(os.getenv("PORT", "8443"))  # Port the webhook server listens on
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "1"))  # Updates in flight
+WORKERS = int(os.getenv("WORKERS", "1"))  # Worker processes; > 1 routes by chat
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8000"))  # Prometheus endpoint, 0 = off
+METRICS_ADDR = os.getenv("METRICS_ADDR", "127.0.0.1")
 DEFAULT_ADMINS = [5742761331]  # Your initial admin IDs 509847275
-DEFAULT_GROUPS = ["-1002210878700_33970"]  # Default group ID for notifications
+# Notifications go here until groups are added with /addgroups
+DEFAULT_GROUP_ID = os.getenv("DEFAULT_GROUP_ID", "-1002210878700")
+MESSAGE_THREAD_ID = os.getenv("MESSAGE_THREAD_ID", "33970")  # Forum topic, "" = none
 PLATE_REGEX = re.compile(r"^[A-Z0-9-]{3,10}$")
 # Conversation states
 WAITING_PLATE, WAITING_CUSTOMER = range(2)
+MODERATION_GROUP = 1  # Handler group for content moderation, after the commands
 
-customer_registry = {}  # Dictionary to store customer data
-queue_counter = 1  # Initialize queue counter
-
-
-def clean_old_entries():
-    """Remove entries older than 7 days"""
-    global customer_registry
-
-    current_time = datetime.now()
-    seven_days_ago = current_time - timedelta(days=7)
-
-    # Create list of keys to delete
-    to_delete = [
-        queue_num
-        for queue_num, data in customer_registry.items()
-        if datetime.strptime(data["timestamp"], "%Y-%m-%d %H:%M:%S") < seven_days_ago
-    ]
+ticket_store = open_ticket_store(TICKET_STORE, TICKET_DB, shared=WORKERS > 1)
+customer_registry = TicketRegistry(ticket_store)  # Indexed store of customer tickets
+queue_allocator = QueueAllocator(
+    ticket_store, block_size=QUEUE_BLOCK_SIZE, is_live=customer_registry.__contains__
+)
+qr_renderer = QRRenderer(workers=QR_WORKERS, pool_size=QR_POOL_SIZE)
+# Failed sends are not retried in place but rescheduled by the outbox
+broadcaster = Broadcaster(max_concurrency=BROADCAST_CONCURRENCY, max_retries=0)
+outbox = Outbox(
+    OUTBOX_DB,
+    broadcaster,
+    max_attempts=OUTBOX_MAX_ATTEMPTS,
+    on_dead=lambda key: reopen_undelivered(key),
+)
+content_filter = KeywordFilter(path=FILTER_FILE)
+media_fetcher = MediaFetcher(max_bytes=MEDIA_MAX_BYTES, timeout=MEDIA_TIMEOUT)
+image_blocklist = ImageBlocklist(IMAGE_BLOCKLIST, max_distance=IMAGE_HASH_DISTANCE)
+image_screener = ImageScreener(
+    workers=IMAGE_WORKERS,
+    max_pending=IMAGE_BACKLOG,
+    blocklist=image_blocklist,
+    heuristics=IMAGE_HEURISTICS,
+)
+verdict_cache = VerdictCache(max_size=VERDICT_CACHE_SIZE, ttl=VERDICT_CACHE_TTL)
+flood_control = FloodControl(
+    FLOOD_USER_RATE, FLOOD_USER_BURST, FLOOD_CHAT_RATE, FLOOD_CHAT_BURST
+)
+# Removals and warnings per chat: the first at once, the rest batched
+removals = Coalescer(lambda *args: remove_messages(*args), delay=WARNING_WINDOW)
+moderation = ModerationQueue(MODERATION_CONCURRENCY, max_backlog=MODERATION_BACKLOG)
+language_prefs = LanguagePreferences(ticket_store)
+acl = AccessControl(ADMIN_FILE, default_admins=DEFAULT_ADMINS)  # Who may do what
+config = ConfigStore(  # Notification groups
+    GROUP_FILE, default_groups=[f"{DEFAULT_GROUP_ID}_{MESSAGE_THREAD_ID}".rstrip("_")]
+)
 
-    # Delete old entries
-    for queue_num in to_delete:
-        del customer_registry[queue_num]
+qr_seconds = REGISTRY.histogram("bot_qr_render_seconds", "Time to get a ticket QR code")
+image_seconds = REGISTRY.histogram(
+    "bot_image_screen_seconds", "Time to download and screen a photo"
+)
 
-    if to_delete:
-        print(f"Cleaned up {len(to_delete)} old entries from customer registry")
+# Gauges are computed when scraped, from the objects above
+REGISTRY.gauge(
+    "bot_tickets",
+    "Tickets in the registry by status",
+    ["status"],
+    callback=customer_registry.count_by_status,
+)
+REGISTRY.gauge(
+    "bot_registry_tickets",
+    "Tickets held in the registry",
+    callback=customer_registry.__len__,
+)
+REGISTRY.gauge(
+    "bot_store_pending_writes",
+    "Ticket changes not yet written to the store",
+    callback=lambda: ticket_store.pending_writes,
+)
+REGISTRY.gauge(
+    "bot_outbox_messages",
+    "Notifications in the outbox by status (pending, sent or dead)",
+    ["status"],
+    callback=outbox.counts,
+)
+REGISTRY.counter(
+    "bot_outbox_sends_total",
+    "Outbox send attempts by this process, by outcome",
+    ["outcome"],
+    callback=lambda: dict(outbox.outcomes),
+)
+REGISTRY.gauge(
+    "bot_image_screen_pending",
+    "Photos being downloaded or screened",
+    callback=lambda: image_screener.pending,
+)
+REGISTRY.counter(
+    "bot_image_screen_shed_total",
+    "Photos skipped because the screening backlog was full",
+    callback=lambda: image_screener.shed,
+)
+REGISTRY.counter(
+    "bot_media_rejected_total",
+    "Images not screened because they were over MEDIA_MAX_BYTES",
+    callback=lambda: media_fetcher.rejected,
+)
+REGISTRY.gauge(
+    "bot_banned_images",
+    "Image hashes on the /banimage blocklist",
+    callback=image_blocklist.__len__,
+)
+REGISTRY.counter(
+    "bot_verdict_cache_hits_total",
+    "Moderation verdicts served from the cache, by kind",
+    ["kind"],
+    callback=lambda: dict(verdict_cache.hits),
+)
+REGISTRY.counter(
+    "bot_verdict_cache_misses_total",
+    "Moderation verdicts that had to be computed, by kind",
+    ["kind"],
+    callback=lambda: dict(verdict_cache.misses),
+)
+REGISTRY.counter(
+    "bot_verdict_cache_evictions_total",
+    "Verdicts dropped to keep the cache within VERDICT_CACHE_SIZE",
+    callback=lambda: verdict_cache.evictions,
+)
+REGISTRY.gauge(
+    "bot_verdict_cache_entries",
+    "Verdicts held in the cache",
+    callback=verdict_cache.__len__,
+)
+REGISTRY.counter(
+    "bot_flood_dropped_total",
+    "Messages not analysed because a user or chat was over its flood limit",
+    ["scope"],
+    callback=lambda: dict(flood_control.dropped),
+)
+REGISTRY.gauge(
+    "bot_moderation_backlog",
+    "Messages waiting for a moderation slot",
+    callback=lambda: moderation.backlog,
+)
+REGISTRY.gauge(
+    "bot_moderation_active",
+    "Messages being checked by moderation",
+    callback=lambda: moderation.active,
+)
+REGISTRY.counter(
+    "bot_moderation_shed_total",
+    "Messages not checked because the moderation backlog was full",
+    callback=lambda: moderation.shed,
+)
 
 
-def scheduled_cleanup():
-    """Run cleanup every 24 hours"""
-    while True:
-        clean_old_entries()
-        time.sleep(24 * 60 * 60)  # Sleep for 24 hours
+def clean_old_entries(limit=None):
+    """Remove entries older than 7 days, oldest first, at most ``limit`` at a time"""
+    seven_days_ago = time.time() - TICKET_TTL
+    removed = customer_registry.expire(seven_days_ago, limit)
+    if removed:
+        print(f"Cleaned up {removed} old entries from customer registry")
+    return removed
 
 
-# Start the cleanup thread when your application starts
-cleanup_thread = threading.Thread(target=scheduled_cleanup)
-cleanup_thread.daemon = True
-cleanup_thread.start()
+async def expire_old_tickets(context: ContextTypes.DEFAULT_TYPE):
+    """JobQueue callback that expires old tickets and delivered notifications"""
+    clean_old_entries(EXPIRY_BATCH)
+    outbox.purge(time.time() - TICKET_TTL)
 
 
-# Start the cleanup thread when your application starts
 def generate_queue_number():
     """Generate a unique queue number with date prefix"""
-    global queue_counter
-    today = datetime.now().strftime("%Y%m%d")
-    queue_number = f"{today}-{queue_counter:03d}"
-    queue_counter += 1
+    queue_number = queue_allocator.allocate()
 
     # Ensure timestamp is added to new entries
     customer_registry[queue_number] = {
-        **customer_registry.get(queue_number, {}),
         "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
     }
 
     return queue_number
 
 
-# Load admin IDs from file or create with default if not exists
-def load_admins():
-    """Load admin IDs from file or create with default if not exists"""
-    if os.path.exists(ADMIN_FILE):
-        try:
-            with open(ADMIN_FILE, "r", encoding="utf-8") as f:
-                content = f.read().strip()
-                if not content:
-                    raise ValueError("Admin file is empty")
-                data = json.loads(content)
-            if isinstance(data, list):
-                return data
-            else:
-                raise ValueError("Admin file is not a list")
-        except (json.JSONDecodeError, ValueError, IOError, TypeError):
-            try:
-                os.remove(ADMIN_FILE)
-            except Exception:
-                pass
-    try:
-        with open(ADMIN_FILE, "w", encoding="utf-8") as f:
-            json.dump(DEFAULT_ADMINS, f)
-    except Exception as e:
-        print(f"Error writing admin file: {e}")
-    return DEFAULT_ADMINS
+def deep_link_for(bot_username, queue_number):
+    """Deep link that registers a customer against a ticket"""
+    return f"https://t.me/{bot_username}?start={queue_number}"
 
 
-# Save admin IDs to file
-def save_admins(admin_list):
-    """Save admin IDs to file"""
-    with open(ADMIN_FILE, "w", encoding="utf-8") as f:
-        json.dump(admin_list, f)
+def prefill_qr_pool(bot_username):
+    """Pre-render QR codes for the next queue numbers, if the pool is enabled"""
+    if QR_POOL_SIZE:
+        qr_renderer.prefill(
+            deep_link_for(bot_username, qn)
+            for qn in queue_allocator.peek(QR_POOL_SIZE)
+        )
 
 
-# Admin management commands (unchanged from your original code)
-async def add_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Add one or multiple admins at once"""
-    if update.effective_user.id not in admins:
-        await update.message.reply_text("❌ You are not authorized!")
-        return
+ROLE_LABELS = {ADMIN: "admins", STAFF: "staff", MODERATOR: "moderators"}
+
+
+async def deny(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Turn away a user without the role a handler requires"""
+    text = render("not_authorized", user_language(update.effective_user))
+    if update.callback_query:
+        await update.callback_query.answer(text, show_alert=True)
+    elif update.effective_message:
+        await update.effective_message.reply_text(text)
+    return ConversationHandler.END
 
+
+def requires(role):
+    """Handler decorator: only users holding ``role`` get through"""
+    return acl.require(role, on_denied=deny)
+
+
+async def change_role(update, context, role, grant, chat_id=None):
+    """Grant or revoke ``role`` for the user ids in the command arguments"""
+    label = ROLE_LABELS[role]
+    command = update.message.text.split()[0]
     if not context.args:
         await update.message.reply_text(
             "Usage:\n"
-            "• Add single admin: `/addadmin 123456789`\n"
-            "• Add multiple admins: /addadmin 123456789 987654321 555555555"
+            f"• Single user: `{command} 123456789`\n"
+            f"• Multiple users: {command} 123456789 987654321 555555555"
         )
         return
 
-    new_admins = []
+    user_ids = []
     invalid_ids = []
-    already_admins = []
-
     for arg in context.args:
         try:
-            user_id = int(arg)
-            if user_id in admins:
-                already_admins.append(str(user_id))
-            else:
-                new_admins.append(user_id)
+            user_ids.append(int(arg))
         except ValueError:
             invalid_ids.append(arg)
 
-    if new_admins:
-        admins.extend(new_admins)
-        save_admins(admins)
-        new_admins_str = ", ".join(str(id) for id in new_admins)
-        response = f"✅ Added new admins: {new_admins_str}\n"
+    if grant:
+        changed, unchanged = acl.grant(role, user_ids, chat_id)
+        done, skipped = f"✅ Added new {label}", f"⚠️ Already {label}"
     else:
-        response = ""
+        changed, unchanged = acl.revoke(role, user_ids, chat_id)
+        done, skipped = f"✅ Removed {label}", f"⚠️ Not {label}"
 
+    response = ""
+    if changed:
+        response += f"{done}: {', '.join(map(str, changed))}\n"
     if invalid_ids:
-        invalid_str = ", ".join(invalid_ids)
-        response += f"❌ Invalid IDs (must be numbers): {invalid_str}\n"
+        response += f"❌ Invalid IDs (must be numbers): {', '.join(invalid_ids)}\n"
+    if unchanged:
+        response += f"{skipped}: {', '.join(map(str, unchanged))}"
 
-    if already_admins:
-        existing_str = ", ".join(already_admins)
-        response += f"⚠️ Already admins: {existing_str}"
+    await update.message.reply_text(response or "No valid user IDs provided.")
 
-    await update.message.reply_text(response or "No valid admin IDs provided.")
 
+@requires(ADMIN)
+async def add_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Add one or multiple admins at once"""
+    await change_role(update, context, ADMIN, grant=True)
 
-# Remove an admin
-async def remove_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Remove an admin"""
-    if update.effective_user.id not in admins:
-        await update.message.reply_text("❌ You are not authorized!")
-        return
 
-    if not context.args:
-        await update.message.reply_text("Usage: /removeadmin <user_id>")
-        return
-
-    removed_admins = []
-    invalid_ids = []
-    not_admins = []
+@requires(ADMIN)
+async def remove_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Remove one or more admins"""
+    await change_role(update, context, ADMIN, grant=False)
 
-    for arg in context.args:
-        try:
-            user_id = int(arg)
-            if user_id in admins:
-                admins.remove(user_id)
-                removed_admins.append(str(user_id))
-            else:
-                not_admins.append(str(user_id))
-        except ValueError:
-            invalid_ids.append(arg)
 
-    if removed_admins:
-        save_admins(admins)
-        response = f"✅ Removed admins: {', '.join(removed_admins)}\n"
-    else:
-        response = ""
+@requires(ADMIN)
+async def add_staff(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Let attendants register customers and send ready notifications"""
+    await change_role(update, context, STAFF, grant=True)
 
-    if invalid_ids:
-        response += f"❌ Invalid IDs (must be numbers): {', '.join(invalid_ids)}\n"
-    if not_admins:
-        response += f"⚠️ Not admins: {', '.join(not_admins)}"
 
-    await update.message.reply_text(response or "No valid admin IDs provided.")
+@requires(ADMIN)
+async def remove_staff(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await change_role(update, context, STAFF, grant=False)
 
 
-# List all admin user IDs
-async def list_admins(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """List all admin user IDs"""
-    if update.effective_user.id not in admins:
-        await update.message.reply_text("❌ You are not authorized!")
-        return
-    if not admins:
-        await update.message.reply_text("No admins are currently set.")
-    else:
+async def change_moderators(update, context, grant):
+    if update.effective_chat.type == "private":
         await update.message.reply_text(
-            "Current admins:\n" + "\n".join(f"• {admin_id}" for admin_id in admins)
+            "Send this command in the group the moderators should look after."
         )
+        return
+    await change_role(update, context, MODERATOR, grant, update.effective_chat.id)
 
 
-# Load group ID from file or return None if not set
-def load_group_id():
-    """Load group ID from file or return None if not set"""
-    try:
-        if os.path.exists(GROUP_FILE):
-            with open(GROUP_FILE, "r", encoding="utf-8") as f:
-                content = f.read().strip()
-                if not content:
-                    return None
-                try:
-                    data = json.loads(content)
-                except json.JSONDecodeError:
-                    return None
-                if isinstance(data, int):
-                    return data
-                elif isinstance(data, str):
-                    try:
-                        return int(data)
-                    except ValueError:
-                        return None
-                elif isinstance(data, dict) and "group_id" in data:
-                    try:
-                        return int(data["group_id"])
-                    except (ValueError, TypeError):
-                        return None
-                else:
-                    return None
-    except (json.JSONDecodeError, IOError):
-        pass
-    return None
-
-
-# Save group ID to file
-def save_group_id(group_id):
-    """Save group ID to file"""
-    with open(GROUP_FILE, "w", encoding="utf-8") as f:
-        json.dump(group_id, f)
+@requires(ADMIN)
+async def add_moderator(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Exempt users from the content filter in the current group"""
+    await change_moderators(update, context, grant=True)
 
 
-admins = load_admins()
-group_id = load_group_id() or DEFAULT_GROUPS[0]
+@requires(ADMIN)
+async def remove_moderator(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await change_moderators(update, context, grant=False)
 
 
-# List to store multiple group IDs, loaded from file
-def load_group_ids():
-    """Load group IDs from persistent storage"""
-    try:
-        if os.path.exists(GROUP_FILE):
-            with open(GROUP_FILE, "r", encoding="utf-8") as f:
-                content = f.read().strip()
-                if not content:
-                    return []
-                data = json.loads(content)
-                if isinstance(data, list):
-                    return data
-                elif isinstance(data, (int, str)):
-                    return [int(data)]
-                else:
-                    return []
-    except (json.JSONDecodeError, IOError, ValueError, TypeError):
-        pass
-    return []
+# List everyone holding a role
+@requires(ADMIN)
+async def list_admins(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """List owners, admins, staff and group moderators"""
+    lines = []
+    titles = ((OWNER, "Owners"), (ADMIN, "Current admins"), (STAFF, "Staff"))
+    for role, title in titles:
+        members = acl.members(role)
+        if members:
+            lines.append(f"{title}:\n" + "\n".join(f"• {uid}" for uid in members))
+    for chat_id, members in acl.moderated_chats().items():
+        lines.append(
+            f"Moderators of {chat_id}:\n" + "\n".join(f"• {uid}" for uid in members)
+        )
+    await update.message.reply_text(
+        "\n\n".join(lines) if lines else "No admins are currently set."
+    )
 
 
-group_ids = load_group_ids()  # List to store multiple group IDs, loaded from file
+def parse_targets(args):
+    """Split command arguments into (ChatTargets, invalid arguments)"""
+    targets, invalid = [], []
+    for arg in args:
+        try:
+            targets.append(ChatTarget.parse(arg))
+        except ValueError:
+            invalid.append(arg)
+    return targets, invalid
 
 
-# Define the main application
-def save_group_ids(group_ids):
-    """Save group IDs to persistent storage"""
-    with open(GROUP_FILE, "w", encoding="utf-8") as f:
-        json.dump(group_ids, f)
+def current_groups():
+    groups = config.groups
+    return ", ".join(map(str, groups)) if groups else "None"
 
 
+@requires(ADMIN)
 async def addgroups(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Add one or more notification group IDs"""
-    global group_ids
-
-    if update.effective_user.id not in admins:
-        await update.message.reply_text("❌ You are not authorized!")
-        return
-
+    """Add one or more notification groups (or forum topics)"""
     if not context.args:
         await update.message.reply_text(
             "Usage: /addgroups <group_id1> <group_id2> ...\n"
-            "Example: /addgroups -1001234567890 -1009876543210\n\n"
-            f"Current groups: {', '.join(map(str, group_ids)) if group_ids else 'None'}"
+            "Example: /addgroups -1001234567890 -1009876543210_33970\n"
+            "(append _<topic id> to post into a forum topic)\n\n"
+            f"Current groups: {current_groups()}"
         )
         return
 
-    added_groups = []
-    already_exists = []
-    invalid = []
-
-    for arg in context.args:
-        try:
-            new_group_id = int(arg)
-            if new_group_id in group_ids:
-                already_exists.append(str(new_group_id))
-            else:
-                group_ids.append(new_group_id)
-                added_groups.append(str(new_group_id))
-        except ValueError:
-            invalid.append(arg)
-
-    save_group_ids(group_ids)
+    targets, invalid = parse_targets(context.args)
+    added_groups, already_exists = config.add_groups(targets)
 
     response = []
     if added_groups:
-        response.append(f"✅ Added groups: {', '.join(added_groups)}")
+        response.append(f"✅ Added groups: {', '.join(map(str, added_groups))}")
     if already_exists:
-        response.append(f"ℹ️ Already exists: {', '.join(already_exists)}")
+        response.append(f"ℹ️ Already exists: {', '.join(map(str, already_exists))}")
     if invalid:
         response.append(f"❌ Invalid IDs (must be integers): {', '.join(invalid)}")
 
@@ -343,80 +450,113 @@ async def addgroups(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 # List all notification group IDs
+@requires(ADMIN)
 async def listgroups(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """List all notification group IDs"""
-    if update.effective_user.id not in admins:
-        await update.message.reply_text("❌ You are not authorized!")
-        return
-
-    if not group_ids:
-        await update.message.reply_text("No notification groups are currently set.")
+    """List all notification groups"""
+    groups = config.groups
+    if not groups:
+        defaults = ", ".join(map(str, config.default_groups)) or "none"
+        await update.message.reply_text(
+            f"No notification groups are currently set (default: {defaults})."
+        )
     else:
         await update.message.reply_text(
             "Current notification groups:\n"
-            + "\n".join(f"• {gid}" for gid in group_ids)
+            + "\n".join(f"• {group}" for group in groups)
         )
 
 
 # Remove a notification group ID
+@requires(ADMIN)
 async def removegroup(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Remove a notification group ID"""
-    global group_ids
-
-    if update.effective_user.id not in admins:
-        await update.message.reply_text("❌ You are not authorized!")
-        return
-
+    """Remove a notification group"""
     if not context.args:
         await update.message.reply_text(
             "Usage: /removegroup <group_id>\n"
             "Example: /removegroup -1001234567890\n\n"
-            f"Current groups: {', '.join(map(str, group_ids)) if group_ids else 'None'}"
+            f"Current groups: {current_groups()}"
         )
         return
 
     try:
-        group_to_remove = int(context.args[0])
-        if group_to_remove in group_ids:
-            group_ids.remove(group_to_remove)
-            save_group_ids(group_ids)
-            await update.message.reply_text(f"✅ Removed group: {group_to_remove}")
-        else:
-            await update.message.reply_text(
-                f"❌ Group ID {group_to_remove} not found in the list."
-            )
+        group_to_remove = ChatTarget.parse(context.args[0])
     except ValueError:
         await update.message.reply_text(
             "❌ Group ID must be an integer (include the - for supergroups)"
         )
+        return
+
+    if config.remove_group(group_to_remove):
+        await update.message.reply_text(f"✅ Removed group: {group_to_remove}")
+    else:
+        await update.message.reply_text(
+            f"❌ Group ID {group_to_remove} not found in the list."
+        )
+
+
+def notify(chat_ids, text, key, on_failure=None, on_sent=()):
+    """Queue a Markdown message in the outbox; ``key`` makes it send once"""
+    outbox.enqueue(chat_ids, text, key, on_failure, on_sent, parse_mode="Markdown")
+
+
+def staff_messages(ticket, name, group_name=None, **values):
+    """(targets, text, key, options) of a ticket update for its admin and groups"""
+    key = f"{values['queue_number']}:{name}"
+    options = {"parse_mode": "Markdown"}
+    messages = []
+    admin_chat = ticket.get("admin_chat")
+    if admin_chat:
+        text = render(name, ticket.get("admin_lang"), **values)
+        messages.append(([admin_chat], text, key, options))
+    text = render(group_name or name, GROUP_LANGUAGE, **values)
+    messages.append((config.notification_targets(), text, key, options))
+    return messages
+
 
+def notify_staff(ticket, name, group_name=None, **values):
+    """Queue a ticket update for its admin and all groups, each in their language"""
+    for targets, text, key, options in staff_messages(
+        ticket, name, group_name, **values
+    ):
+        outbox.enqueue(targets, text, key, **options)
 
-# Save group IDs to persistent storage
-def save_group_ids(group_ids):
-    """Save group IDs to persistent storage"""
-    with open(GROUP_FILE, "w", encoding="utf-8") as f:
-        json.dump(group_ids, f)
+
+async def reopen_undelivered(key):
+    """Outbox dead-letter hook: put a ready ticket back to waiting.
+
+    Its customer was never told, so it can be marked ready (and sent) again.
+    """
+    queue_number, _, rest = key.partition(":")
+    if rest.startswith("car_ready:"):
+        if await customer_registry.transition(queue_number, WAITING, expected=READY):
+            print(f"Customer of {queue_number} was not notified, back to waiting")
+
+
+def user_language(user):
+    """Language to address a user in: stored choice, client language or both"""
+    return pick_language(user.language_code, language_prefs.get(user.id))
+
+
+async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Store the user's preferred language (km, en or both)"""
+    user = update.effective_user
+    choice = context.args[0].lower() if context.args else None
+    if choice not in LANGUAGES:
+        await update.message.reply_text(render("language_usage", user_language(user)))
+        return
+
+    language_prefs.set(user.id, choice)
+    await update.message.reply_text(render("language_set", choice))
 
 
 # Start the bot and define command handlers
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    GROUP_CHAT_ID = (
-        group_ids[0] if group_ids else DEFAULT_GROUPS[0]
-    )  # Use group_ids if set, else fallback
+    language = user_language(update.effective_user)
 
-    if user_id in admins:
+    if acl.is_staff(user_id):
         await update.message.reply_text(
-            "👨‍🔧*Admin Panel - Speed Car Wash*\n\n"
-            "ពាក្យបញ្ជាដែលអាចប្រើបាន:\n"
-            "/register - ចុះឈ្មោះអតិថិជនថ្មី\n"
-            "/ready - ជូនដំណឹងទៅអតិថិជនថារថយន្តរួចរាល់\n"
-            "/cancel - បោះបង់ប្រតិបត្តិការបច្ចុប្បន្ន\n\n"
-            "Available commands :\n"
-            "/register - Register a new customer\n"
-            "/ready - Notify customer their car is ready\n"
-            "/cancel - Cancel the current operation",
-            parse_mode="Markdown",
+            render("admin_panel", language), parse_mode="Markdown"
         )
     else:
         # Try to extract argument from /start <queue_number> deep link
@@ -426,64 +566,51 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if len(parts) > 1:
                 queue_number = parts[1]
 
-        if queue_number and queue_number in customer_registry:
-            customer_chat = update.effective_chat.id
-            customer_registry[queue_number]["customer_chat"] = customer_chat
-            customer_registry[queue_number]["status"] = "waiting"
-
-            # Message to admin
-            admin_message = (
-                f"អតិថិជនបានចុះឈ្មោះតាមរយៈ QR Code ដោយជោគជ័យ\n\n"
-                f"🛂 លេខសំបុត្រ# : {queue_number}\n"
-                f"🚗 ផ្លាកលេខ : {customer_registry[queue_number].get('plate', 'មិនមាន')}\n"
-                f"👤 ឈ្មោះអតិថិជន : {update.effective_user.full_name}\n"
-                f"⏳ ស្ថានភាព៖ កំពុងរង់ចាំសេវាកម្ម\n\n"
-                f"Customer has successfully registered through QR Code\n\n"
-                f"🛂 Ticket number# : {queue_number}\n"
-                f"🚗 Plate : {customer_registry[queue_number].get('plate', 'Not provided')}\n"
-                f"👤 Customer Name : {update.effective_user.full_name}\n"
-                f"⏳ Status : Waiting for service"
+        customer_chat = update.effective_chat.id
+        ticket = None
+        if queue_number:
+            # Only the first scan of a registered ticket claims it
+            ticket = await customer_registry.transition(
+                queue_number,
+                WAITING,
+                expected=REGISTERED,
+                customer_chat=customer_chat,
+                customer_lang=language,
             )
 
-            await context.bot.send_message(
-                chat_id=customer_registry[queue_number]["admin_chat"],
-                text=admin_message,
-                parse_mode="Markdown",
-            )
+        if ticket is not None:
+            values = {
+                "queue_number": queue_number,
+                "plate": ticket.get("plate"),
+                "customer_name": update.effective_user.full_name,
+            }
 
-            # Send to all group_ids if available, else fallback to DEFAULT_GROUPS
-            target_groups = group_ids if group_ids else DEFAULT_GROUPS
-            for gid in target_groups:
-                try:
-                    await context.bot.send_message(
-                        chat_id=gid, text=admin_message, parse_mode="Markdown"
-                    )
-                except Exception as e:
-                    print(f"Failed to send message to group {gid}: {e}")
+            # Queued for the registering admin and all notification groups
+            notify_staff(ticket, "qr_registered", **values)
 
             await update.message.reply_text(
-                f"ការចុះឈ្មោះអតិថិជនបានដោយជោគជ័យ!\n\n"
-                f"🛂 លេខសំបុត្រ# : {queue_number}\n"
-                f"🚗 ផ្លាកលេខ : {customer_registry[queue_number].get('plate', 'មិនមាន')}\n"
-                f"👤 ឈ្មោះអតិថិជន : {update.effective_user.full_name}\n\n"
-                "អ្នកនឹងទទួលបានការជូនដំណឹងនៅពេលរថយន្តរបស់អ្នករួចរាល់។\n\n"
-                f"Successful customer registration completed!\n\n"
-                f"🛂 Titke Number : {queue_number}\n"
-                f"🚗 Plate : {customer_registry[queue_number].get('plate', 'Not provided')}\n"
-                f"👤 Customer Name : {update.effective_user.full_name}\n\n"
-                "You'll be notified when your car is ready.",
+                render("customer_registered", language, **values),
+                parse_mode="Markdown",
+            )
+            return ConversationHandler.END
+        elif queue_number and customer_registry.get(queue_number, {}).get(
+            "customer_chat"
+        ) == customer_chat:
+            # Scanned again by the same customer: show where the ticket is
+            await update.message.reply_text(
+                format_status(queue_number, customer_registry[queue_number], language),
                 parse_mode="Markdown",
             )
             return ConversationHandler.END
         else:
             queue_number = generate_queue_number()
-            customer_chat = update.effective_chat.id
 
             # Store minimal info until plate is provided
             customer_registry[queue_number] = {
                 "admin_chat": None,  # Will be set when admin completes registration
                 "customer_chat": customer_chat,
-                "status": "pending",
+                "customer_lang": language,
+                "status": PENDING,
                 "plate": None,
                 "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             }
@@ -491,235 +618,140 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             context.user_data["queue_number"] = queue_number
 
             await update.message.reply_text(
-                "🚗 *សូមស្វាគមន៍មកកាន់ Speed Car Wash!*\n\n"
-                "សូមផ្ញើផ្លាកលេខរថយន្តរបស់អ្នក។\n"
-                "ឧទាហរណ៍៖ ABC-1234\n\n"
-                "🚗 *Welcome to Speed Car Wash!*\n\n"
-                "Please send your vehicle plate number.\n"
-                "Example: ABC-1234",
-                parse_mode="Markdown",
+                render("welcome", language), parse_mode="Markdown"
             )
             return WAITING_PLATE
 
 
 # Register command handler
+@requires(STAFF)
 async def register(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_user.id not in admins:
-        await update.message.reply_text(
-            "❌ អ្នកមិនមានសិទ្ធិប្រើបញ្ជានេះទេ។\n"
-            "❌ You are not authorized to use this command."
-        )
-        return ConversationHandler.END
-
-    await update.message.reply_text(
-        "✅ សូមផ្ញើផ្លាកលេខរថយន្តរបស់អតិថិជន\n"
-        "✅ Please send the vehicle plate number\n\n"
-        "Type /cancel to abort."
-    )
+    language = user_language(update.effective_user)
+    await update.message.reply_text(render("ask_plate", language))
     return WAITING_PLATE
 
 
 # Register the conversation handler
 async def receive_plate(update: Update, context: ContextTypes.DEFAULT_TYPE):
     plate = update.message.text.strip().upper()
+    language = user_language(update.effective_user)
     if not PLATE_REGEX.match(plate):
         await update.message.reply_text(
-            "❌ ទម្រង់ផ្លាកលេខមិនត្រឹមត្រូវ។ សូមព្យាយាមម្តងទៀត។\n"
-            "❌ Invalid plate format. Please try again.\n\n"
-            "Type /cancel to abort.",
-            parse_mode="Markdown",
+            render("invalid_plate", language), parse_mode="Markdown"
         )
         return WAITING_PLATE
 
     # Check if plate exists in registry
-    for existing_data in customer_registry.values():
-        if existing_data.get("plate") == plate:
-            await update.message.reply_text(
-                "⚠️ ផ្លាកលេខនេះបានចុះឈ្មោះរួចហើយ។ សូមបញ្ចូលលេខផ្សេង។\n"
-                "⚠️ This plate number is already registered. Please send a different one.\n\n"
-                "Type /cancel to abort."
-            )
-            return WAITING_PLATE
+    if customer_registry.find_plate(plate):
+        await update.message.reply_text(render("duplicate_plate", language))
+        return WAITING_PLATE
 
-    if update.effective_user.id in admins:  # Admin registration flow
+    if acl.is_staff(update.effective_user.id):  # Staff registration flow
         queue_number = generate_queue_number()
         admin_chat = update.effective_chat.id
 
         customer_registry[queue_number] = {
             "admin_chat": admin_chat,
+            "admin_lang": language,
             "customer_chat": None,
-            "status": "registered",
+            "status": REGISTERED,
             "plate": plate,
             "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             "customer_name": update.effective_user.full_name,
         }
+        # The customer's deep link may reach another worker process before
+        # the next write-behind flush
+        await customer_registry.publish()
 
-        # Generate QR code
-        bot_username = (await context.bot.get_me()).username
-        deep_link = f"https://t.me/{bot_username}?start={queue_number}"
-
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(deep_link)
-        qr.make(fit=True)
+        # Generate QR code (bot identity is cached by Application.initialize)
+        bot_username = context.bot.username
+        deep_link = deep_link_for(bot_username, queue_number)
 
-        img = qr.make_image(fill_color="black", back_color="white")
-        bio = BytesIO()
+        # Rendered in a worker thread, or taken from the pre-rendered pool
+        with qr_seconds.time():
+            bio = BytesIO(await qr_renderer.render(deep_link))
         bio.name = "qr_code.png"
-        img.save(bio, "PNG")
-        bio.seek(0)
-
-        caption = (
-            "បានចុះឈ្មោះអតិថិជនថ្មីរួចរាល់ \n\n"
-            f"🛂 លេខសំបុត្រ# : {queue_number}\n"
-            f"🚗 ផ្លាកលេខ : {plate}\n\n"
-            "1. បង្ហាញកូដ QR នេះទៅអតិថិជន\n"
-            "2. អតិថិជនស្កែនវាតាមម៉ាស៊ីនថតទូរស័ព្ទ\n"
-            "3. ពួកគេនឹងត្រូវបានចុះឈ្មោះដោយស្វ័យប្រវត្តិ\n"
-            "ឬផ្ញើតំណផ្ទាល់នេះទៅពួកគេ:\n"
-            f"{deep_link}\n\n"
-            "New customer registration completed\n\n"
-            f"🛂 Ticket Number : {queue_number}\n"
-            f"🚗 Plate : {plate}\n\n"
-            "1. Show this QR code to the customer\n"
-            "2. They scan it with their phone camera\n"
-            "3. They'll be automatically registered\n"
-            "Or send them this direct link:\n"
-            f"{deep_link}"
-        )
+        prefill_qr_pool(bot_username)
 
-        # Define group_message before sending to groups
-        group_message = (
-            f"*អតិថិជនថ្មីត្រូវបានចុះឈ្មោះដោយបុគ្គលិក*\n\n"
-            f"🛂 លេខសំបុត្រ# : {queue_number}\n"
-            f"🚗 ផ្លាកលេខ : {plate}\n"
-            f"👤 ឈ្មោះអតិថិជន : {update.effective_user.full_name}\n"
-            f"⏳ ស្ថានភាព៖ កំពុងរង់ចាំអតិថិជនបញ្ចូលតាម QR\n\n"
-            f"*A new customer has been registered by staff*\n\n"
-            f"🛂 Ticket Number : {queue_number}\n"
-            f"🚗 Plate : {plate}\n"
-            f"👤 Customer Name : {update.effective_user.full_name}\n"
-            f"⏳ Status : Waiting for customer to scan QR\n\n"
+        values = {
+            "queue_number": queue_number,
+            "plate": plate,
+            "customer_name": update.effective_user.full_name,
+            "deep_link": deep_link,
+        }
+        await update.message.reply_photo(
+            photo=bio, caption=render("qr_caption", language, **values)
+        )
+        notify(
+            config.notification_targets(),
+            render("staff_registered", GROUP_LANGUAGE, **values),
+            f"{queue_number}:staff_registered",
         )
-
-        await update.message.reply_photo(photo=bio, caption=caption)
 
     else:  # Customer self-registration flow
         queue_number = context.user_data.get("queue_number")
-        customer_registry[queue_number].update(
-            {
-                "plate": plate,
-                "status": "waiting",
-                "customer_name": update.effective_user.full_name,
-                "customer_chat": update.effective_chat.id,
-            }
+        ticket = await customer_registry.transition(
+            queue_number,
+            WAITING,
+            expected=PENDING,
+            plate=plate,
+            customer_name=update.effective_user.full_name,
+            customer_chat=update.effective_chat.id,
+            customer_lang=language,
         )
+        if ticket is None:  # Expired, or the plate was already given
+            current = customer_registry.get(queue_number)
+            if current:
+                await update.message.reply_text(
+                    format_status(queue_number, current, language),
+                    parse_mode="Markdown",
+                )
+            return ConversationHandler.END
+        values = {
+            "queue_number": queue_number,
+            "plate": plate,
+            "customer_name": update.effective_user.full_name,
+        }
 
         # Notify customer
         await update.message.reply_text(
-            f"ការចុះឈ្មោះអតិថិជនបានដោយជោគជ័យ!\n\n"
-            f"🛂 លេខសំបុត្រ# : {queue_number}\n"
-            f"🚗 ផ្លាកលេខ : {plate}\n"
-            f"👤 ឈ្មោះអតិថិជន : {update.effective_user.full_name}\n\n"
-            "អ្នកនឹងទទួលបានការជូនដំណឹងនៅពេលរថយន្តរបស់អ្នករួចរាល់។\n\n"
-            f"Successful customer registration completed!\n\n"
-            f"🛂 Ticket Number : {queue_number}\n"
-            f"🚗 Plate : {plate}\n"
-            f"👤 Customer Name : {update.effective_user.full_name}\n\n"
-            "You'll be notified when your car is ready.",
+            render("customer_registered", language, **values),
             parse_mode="Markdown",
         )
 
-        # Send notification to admin
-        if admins:
-            admin_chat = customer_registry[queue_number]["admin_chat"]
-            if not admin_chat:
-                # If admin chat is not set, use the first admin
-                admin_chat = admins[0]
-                customer_registry[queue_number]["admin_chat"] = admin_chat
-        group_message = (
-            f"អតិថិជនបានចុះឈ្មោះដោយខ្លួនឯងដោយជោគជ័យ\n\n"
-            f"🛂 លេខសំបុត្រ# : {queue_number}\n"
-            f"🚗 ផ្លាកលេខ : {plate}\n"
-            f"👤 ឈ្មោះអតិថិជន : {update.effective_user.full_name}\n"
-            f"⏳ ស្ថានភាព៖ កំពុងរង់ចាំសេវាកម្ម\n\n"
-            f"*Customer has self-registered successfully*\n\n"
-            f"🛂 Ticket Number : {queue_number}\n"
-            f"🚗 Plate : {plate}\n"
-            f"👤 Customer Name : {update.effective_user.full_name}\n"
-            f"⏳ Status : Waiting for service\n\n"
-        )
-        # Notify Groups
-        if DEFAULT_GROUPS:
-            for group_id in DEFAULT_GROUPS:
-                try:
-                    await context.bot.send_message(
-                        chat_id=group_id, text=group_message, parse_mode="Markdown"
-                    )
-                except Exception as e:
-                    print(f"Failed to send message to group {group_id}: {e}")
-
-        # Send to admin if available, otherwise to all groups
-        if admins:
-            admin_chat_id = admins[0]  # Primary admin
-            customer_registry[queue_number]["admin_chat"] = admin_chat_id
-
-            try:
-                await context.bot.send_message(
-                    chat_id=admin_chat_id, text=group_message, parse_mode="Markdown"
-                )
-            except Exception as e:
-                print(f"Failed to notify admin {admin_chat_id}: {e}")
-
-                # Fallback to groups if admin notification fails
-                if DEFAULT_GROUPS:
-                    for group_id in DEFAULT_GROUPS:
-                        try:
-                            await context.bot.send_message(
-                                chat_id=group_id,
-                                text=group_message,
-                                parse_mode="Markdown",
-                            )
-                        except Exception as e:
-                            print(f"Failed to send message to group {group_id}: {e}")
-
-        elif DEFAULT_GROUPS:  # If no admins, send to all groups
-            for group_id in DEFAULT_GROUPS:
-                try:
-                    await context.bot.send_message(
-                        chat_id=group_id, text=group_message, parse_mode="Markdown"
-                    )
-                except Exception as e:
-                    print(f"Failed to send message to group {group_id}: {e}")
+        # Primary admin handles self-registered tickets
+        admin_chat = acl.first_admin()
+        if not ticket["admin_chat"] and admin_chat:
+            ticket = customer_registry.update_ticket(queue_number, admin_chat=admin_chat)
+
+        # Queued for the admin and all groups
+        notify_staff(ticket, "self_registered", **values)
 
     return ConversationHandler.END
 
 
 # Ready command handler
+@requires(STAFF)
 async def ready(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_user.id not in admins:
-        await update.message.reply_text(
-            "❌ អ្នកមិនមានសិទ្ធិប្រើបញ្ជានេះទេ។\n"
-            "❌ You are not authorized to use this command."
-        )
+    language = user_language(update.effective_user)
+    # /ready <plate-prefix> narrows the picker to matching plates
+    prefix = context.args[0].strip().upper() if context.args else ""
+    page = ready_page(prefix)
+
+    if page is None:
+        await update.message.reply_text(render("no_waiting", language))
         return
 
-    ready_customers = {
-        qn: data
-        for qn, data in customer_registry.items()
-        if data["customer_chat"] and data["status"] == "waiting"
-    }
+    await update.message.reply_text(render("pick_customer", language), reply_markup=page)
 
-    if not ready_customers:
-        await update.message.reply_text(
-            "🚫 គ្មានអតិថិជនណាកំពុងរង់ចាំការជូនដំណឹងទេ។\n"
-            "🚫 No customers currently waiting for notification."
-        )
-        return
+
+def ready_page(prefix="", after=None, before=None):
+    """Keyboard for one page of waiting customers, or None if there are none"""
+    items, has_prev, has_next = customer_registry.waiting_plates(
+        prefix, after=after, before=before, limit=READY_PAGE_SIZE
+    )
+    if not items:
+        return None
 
     buttons = [
         [
@@ -727,49 +759,78 @@ async def ready(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"{qn} ({data.get('plate', 'No plate')})", callback_data=f"ready_{qn}"
             )
         ]
-        for qn, data in ready_customers.items()
+        for qn, data in items
     ]
 
-    await update.message.reply_text(
-        "📢 ជ្រើសរើសអតិថិជនដើម្បីជូនដំណឹង (លេខសំបុត្រ# - ផ្លាកលេខ):\n"
-        "📢 Select customer to notify ( Ticket Number - Plate):",
-        reply_markup=InlineKeyboardMarkup(buttons),
-    )
+    # Page cursors are plates, carried along with the search prefix
+    nav = []
+    if has_prev:
+        nav.append(
+            InlineKeyboardButton(
+                "⬅️ Prev", callback_data=f"ready:p:{prefix}:{items[0][1]['plate']}"
+            )
+        )
+    if has_next:
+        nav.append(
+            InlineKeyboardButton(
+                "Next ➡️", callback_data=f"ready:n:{prefix}:{items[-1][1]['plate']}"
+            )
+        )
+    if nav:
+        buttons.append(nav)
+    return InlineKeyboardMarkup(buttons)
 
 
-# format_status
-def format_status(queue_number, data):
-    """Format status information for display"""
-    status_mapping = {
-        "pending": "⏳ Pending registration",
-        "waiting": "🛠 In progress (waiting)",
-        "ready": "✅ Ready for pickup",
-        "registered": "📝 Registered (waiting for customer)",
-    }
+@requires(STAFF)
+async def ready_page_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the previous or next page of the /ready picker"""
+    query = update.callback_query
+    _, direction, prefix, cursor = query.data.split(":", 3)
+    if direction == "n":
+        page = ready_page(prefix, after=cursor)
+    else:
+        page = ready_page(prefix, before=cursor)
 
-    status_text = status_mapping.get(
-        data.get("status", "pending"), data.get("status", "pending")
-    )
+    if page is None:
+        await query.answer("🚫 No customers currently waiting for notification.")
+        return
+
+    await query.answer()
+    await query.edit_message_reply_markup(reply_markup=page)
+
+
+STATUS_LABELS = {
+    PENDING: "⏳ Pending registration",
+    WAITING: "🛠 In progress (waiting)",
+    READY: "✅ Ready for pickup",
+    REGISTERED: "📝 Registered (waiting for customer)",
+    COLLECTED: "📦 Collected",
+}
 
-    message = (
-        f"👑 *Admin View - Ticket Status* 👑\n\n"
-        f"👤 *ឈ្មោះអតិថិជន*: {data.get('customer_name', 'មិនមាន')}\n"
-        f"🛂 *លេខសំបុត្រ*: `{queue_number}`\n"
-        f"🚗 *ផ្លាកលេខ*: {data.get('plate', 'មិនមាន')}\n"
-        f"📊 *ស្ថានភាព*: {status_text}\n"
-        f"🕒 *ពេលវេលាចុះឈ្មោះ*: {data.get('timestamp', 'មិនស្គាល់')}\n\n"
-        f"🛂 *Ticket Number*: `{queue_number}`\n"
-        f"🚗 *Plate*: {data.get('plate', 'Not provided')}\n"
-        f"📊 *Status*: {status_text}\n"
-        f"🕒 *Registered at*: {data.get('timestamp', 'Unknown')}\n\n"
+
+# format_status
+def format_status(queue_number, data, language="both"):
+    """Format status information for display"""
+    status = data.get("status", PENDING)
+    status_text = STATUS_LABELS.get(status, status)
+    unknown = "មិនមាន" if language == "km" else "Not provided"
+
+    return render(
+        "ticket_status",
+        language,
+        queue_number=queue_number,
+        customer_name=escape_markdown(str(data.get("customer_name", unknown))),
+        plate=data.get("plate", unknown),
+        status=status_text,
+        timestamp=data.get("timestamp", "Unknown"),
     )
-    return message
 
 
 # Check status command handler
 async def check_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Check the status of a car wash registration"""
     user_id = update.effective_user.id
+    language = user_language(update.effective_user)
 
     # Check if user provided a queue number
     if context.args:
@@ -778,357 +839,641 @@ async def check_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
             data = customer_registry[queue_number]
 
             # Check if user is authorized (either admin, or the customer who registered)
-            if user_id in admins or data.get("customer_chat") == user_id:
+            if acl.is_staff(user_id) or data.get("customer_chat") == user_id:
                 await update.message.reply_text(
-                    format_status(queue_number, data), parse_mode="Markdown"
+                    format_status(queue_number, data, language), parse_mode="Markdown"
                 )
             else:
-                await update.message.reply_text(
-                    "❌ You are not authorized to view this ticket.\n"
-                    "❌ អ្នកមិនមានសិទ្ធិមើលសំបុត្រនេះទេ។"
-                )
+                await update.message.reply_text(render("ticket_forbidden", language))
         else:
-            await update.message.reply_text(
-                "❌ Ticket number not found.\n" "❌ រកមិនឃើញលេខសំបុត្រនេះទេ។"
-            )
+            await update.message.reply_text(render("ticket_not_found", language))
         return
 
-    # If no queue number provided, show all relevant tickets
-    if user_id in admins:
-        # Admin sees all tickets
-        relevant_tickets = customer_registry.items()
-        message = "👑 *Admin View - All Tickets* 👑\n\n"
+    # If no queue number provided, show the first page of relevant tickets
+    page = status_page(user_id, language=language)
+    if page is None:
+        await update.message.reply_text(render("no_tickets", language))
+        return
+
+    text, markup = page
+    await update.message.reply_text(text, parse_mode="Markdown", reply_markup=markup)
+
+
+def page_buttons(view, items, has_prev, has_next):
+    """Prev/Next keyboard whose callback data carries the page cursors"""
+    row = []
+    if has_prev:
+        row.append(
+            InlineKeyboardButton("⬅️ Prev", callback_data=f"{view}:p:{items[0][0]}")
+        )
+    if has_next:
+        row.append(
+            InlineKeyboardButton("Next ➡️", callback_data=f"{view}:n:{items[-1][0]}")
+        )
+    return InlineKeyboardMarkup([row]) if row else None
+
+
+def status_page(user_id, after=None, before=None, language="both"):
+    """Render one /status page as (text, markup), or None if there are no tickets"""
+    if acl.is_staff(user_id):
+        # Staff see all tickets
+        customer_chat = None
+        header = "👑 *Admin View - All Tickets* 👑\n\n"
     else:
         # Customer sees only their tickets
-        relevant_tickets = [
-            (qn, data)
-            for qn, data in customer_registry.items()
-            if data.get("customer_chat") == user_id
-        ]
-        message = "🚗 *Your Car Wash Tickets* 🚗\n\n"
+        customer_chat = user_id
+        header = "🚗 *Your Car Wash Tickets* 🚗\n\n"
 
-    if not relevant_tickets:
-        await update.message.reply_text("ℹ️ No tickets found.\n" "ℹ️ មិនមានសំបុត្រណាមួយទេ។")
-        return
+    items, has_prev, has_next = customer_registry.page(
+        after=after, before=before, limit=STATUS_PAGE_SIZE, customer_chat=customer_chat
+    )
+    if not items:
+        return None
 
-    for queue_number, data in relevant_tickets:
-        message += format_status(queue_number, data) + "\n\n"
+    text = header + "\n\n".join(
+        format_status(qn, data, language) for qn, data in items
+    )
+    return text, page_buttons("status", items, has_prev, has_next)
 
-    # Split long messages to avoid Telegram's message length limit
-    if len(message) > 4000:
-        parts = [message[i : i + 4000] for i in range(0, len(message), 4000)]
-        for part in parts:
-            await update.message.reply_text(part, parse_mode="Markdown")
-    else:
-        await update.message.reply_text(message, parse_mode="Markdown")
 
+def users_page(after=None, before=None):
+    """Render one /users page as (text, markup), or None if there are no tickets"""
+    items, has_prev, has_next = customer_registry.page(
+        after=after, before=before, limit=USERS_PAGE_SIZE
+    )
+    if not items:
+        return None
 
-# Button handler for ready notification
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = "Registered Users:\n" + "\n".join(
+        f"🛂 {qn} - {data.get('customer_name', 'Unknown')} - {data.get('plate', 'No plate')}"
+        for qn, data in items
+    )
+    return text, page_buttons("users", items, has_prev, has_next)
+
+
+async def page_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the previous or next page of a /status or /users view"""
     query = update.callback_query
+    view, direction, cursor = query.data.split(":", 2)
+    after, before = (cursor, None) if direction == "n" else (None, cursor)
+
+    if view == "status":
+        page = status_page(
+            update.effective_user.id,
+            after=after,
+            before=before,
+            language=user_language(update.effective_user),
+        )
+        parse_mode = "Markdown"
+    elif acl.is_admin(update.effective_user.id):
+        page = users_page(after=after, before=before)
+        parse_mode = None
+    else:
+        await query.answer("❌ You are not authorized!")
+        return
+
+    if page is None:
+        await query.answer("ℹ️ No more tickets.")
+        return
+
     await query.answer()
+    text, markup = page
+    await query.edit_message_text(text, parse_mode=parse_mode, reply_markup=markup)
 
-    if query.data.startswith("ready_"):
-        queue_number = query.data[6:]
-        customer_data = customer_registry.get(queue_number)
-
-        if customer_data and customer_data["customer_chat"]:
-            plate = customer_data.get("plate", "unknown plate")
-            staff_name = update.effective_user.full_name
-
-            # Message to customer
-            await context.bot.send_message(
-                chat_id=customer_data["customer_chat"],
-                text=(
-                    f"✨ *ជំរាបសួរ! រថយន្តរបស់លោកអ្នកត្រូវបានលាងសំអាតរួចរាល់ហើយ។ !* ✨\n\n"
-                    f"🛂 លេខសំបុត្រ# : {queue_number}\n"
-                    f"🚗 ផ្លាកលេខ : {plate}\n"
-                    f"👤 ឈ្មោះបុគ្គលិក : {staff_name}\n\n"
-                    "សូមអរគុណសម្រាប់ការរង់ចាំ និងការជឿទុកចិត្តលើសេវាកម្មរបស់យើងខ្ញុំ។ 🚗✨\n\n"
-                    "✨ *Dear valued customer! Your car has been washed and is now ready.* ✨\n\n"
-                    f"🛂 Ticket Number : {queue_number}\n"
-                    f"🚗 Plate : {plate}\n"
-                    f"👤 Staff Name : {staff_name}\n\n"
-                    "Thank you for your patience and trust in our service."
-                ),
-                parse_mode="Markdown",
-            )
 
-            # Message to admin
-            await context.bot.send_message(
-                chat_id=customer_data["admin_chat"],
-                text=(
-                    f"📢 បានជូនដំណឹងអតិថិជនដោយជោគជ័យ\n\n"
-                    f"🛂 លេខសំបុត្រ# : {queue_number}\n"
-                    f"🚗 ផ្លាកលេខ : {plate}\n"
-                    f"👤 ឈ្មោះបុគ្គលិក : {staff_name}\n\n"
-                    f"📢 Successfully notified customer\n\n"
-                    f"🛂 Ticket Number : {queue_number}\n"
-                    f"🚗 Plate : {plate}\n"
-                    f"👤 Staff Name : {staff_name}\n\n"
-                ),
-                parse_mode="Markdown",
-            )
+class TicketLocks:
+    """asyncio locks per queue number, dropped once nobody holds or awaits one"""
+
+    def __init__(self):
+        self._locks = {}  # queue_number -> [lock, holders and waiters]
+
+    def locked(self, queue_number):
+        entry = self._locks.get(queue_number)
+        return entry is not None and entry[0].locked()
+
+    @contextlib.asynccontextmanager
+    async def hold(self, queue_number):
+        entry = self._locks.setdefault(queue_number, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[queue_number]
+
+
+ticket_locks = TicketLocks()
+
+
+def ticket_state(queue_number, language):
+    """Short answer describing where a ticket is now"""
+    data = customer_registry.get(queue_number)
+    if data is None:
+        return render("customer_not_found", language)
+    status = data.get("status", PENDING)
+    return render(
+        "ticket_state",
+        language,
+        queue_number=queue_number,
+        status=STATUS_LABELS.get(status, status),
+    )
 
-            # Message to all notification groups
-            if group_ids:
-                for gid in group_ids:
-                    try:
-                        await context.bot.send_message(
-                            chat_id=gid,
-                            text=(
-                                f"ការលាងសំអាតរថយន្តអតិថិជនត្រូវបានបញ្ចប់ដោយជោគជ័យ។\n\n"
-                                f"🛂 លេខសំបុត្រ# : {queue_number}\n"
-                                f"🚗 ផ្លាកលេខ : {plate}\n"
-                                f"👤 ឈ្មោះបុគ្គលិក : {staff_name}\n\n"
-                                f"The customer's car wash has been successfully completed.\n\n"
-                                f"🛂 Ticket # : {queue_number}\n"
-                                f"🚗 Plate : {plate}\n"
-                                f"👤 Staff Name : {staff_name}\n"
-                            ),
-                            parse_mode="Markdown",
-                        )
-                    except Exception as e:
-                        print(f"Failed to send message to group {gid}: {e}")
-
-            customer_registry[queue_number]["status"] = "ready"
 
+async def replace_button(query, button=None):
+    """Swap the pressed button's row for ``button``, or drop the row"""
+    markup = query.message.reply_markup if query.message else None
+    rows = []
+    for row in markup.inline_keyboard if markup else ():
+        if any(pressed.callback_data == query.data for pressed in row):
+            if button:
+                rows.append([button])
         else:
-            await query.edit_message_text(
-                "❌ រកមិនឃើញអតិថិជនទេ\n" "❌ Could not find customer."
-            )
+            rows.append(list(row))
+    try:
+        await query.edit_message_reply_markup(
+            reply_markup=InlineKeyboardMarkup(rows) if rows else None
+        )
+    except BadRequest as e:  # e.g. the message is too old to edit
+        print(f"Could not update buttons for {query.data}: {e}")
+
+
+async def mark_ready(update, query, queue_number, language):
+    """waiting -> ready: queue the customer and staff notifications"""
+    ticket = await customer_registry.transition(queue_number, READY, expected=WAITING)
+    if ticket is None:
+        await query.answer(ticket_state(queue_number, language))
+        return
+
+    values = {
+        "queue_number": queue_number,
+        "plate": ticket.get("plate", "unknown plate"),
+        "staff_name": update.effective_user.full_name,
+    }
+    # The outbox sends (and retries) this after the handler returns. Staff
+    # and groups are told once the customer has been; if the customer cannot
+    # be reached the attendant is told and the ticket goes back to waiting
+    notify(
+        [ticket["customer_chat"]],
+        render("car_ready", ticket.get("customer_lang"), **values),
+        f"{queue_number}:car_ready",
+        on_failure=(query.message.chat_id, render("notify_failed", language, **values)),
+        on_sent=staff_messages(
+            ticket, "customer_notified", group_name="wash_completed", **values
+        ),
+    )
+
+    await query.answer(render("marked_ready", language, **values))
+    await replace_button(
+        query,
+        InlineKeyboardButton(
+            f"📦 {queue_number} ({values['plate']}) collected",
+            callback_data=f"collected_{queue_number}",
+        ),
+    )
+
+
+async def mark_collected(query, queue_number, language):
+    """ready -> collected: the customer has picked the car up"""
+    ticket = await customer_registry.transition(queue_number, COLLECTED, expected=READY)
+    if ticket is None:
+        await query.answer(ticket_state(queue_number, language))
+        return
+    await query.answer(render("marked_collected", language, queue_number=queue_number))
+    await replace_button(query)
+
+
+# Button handler for ready notification
+@requires(STAFF)
+async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """ready_<queue> and collected_<queue> buttons.
+
+    Each tap is a compare-and-set on the ticket's status, made under the
+    ticket's lock. A tap that loses (a double tap, or two attendants at once)
+    is answered from the ticket's current state and sends nothing else.
+    """
+    query = update.callback_query
+    action, _, queue_number = query.data.partition("_")
+    language = user_language(update.effective_user)
+
+    if ticket_locks.locked(queue_number):
+        await query.answer(ticket_state(queue_number, language))
+        return
+
+    async with ticket_locks.hold(queue_number):
+        data = customer_registry.get(queue_number)
+        if not data or not data.get("customer_chat"):
+            await query.answer()
+            await query.edit_message_text(render("customer_not_found", language))
+        elif action == "ready":
+            await mark_ready(update, query, queue_number, language)
+        else:
+            await mark_collected(query, queue_number, language)
 
 
 # Cancel command handler
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("ប្រតិបត្តិការត្រូវបានបោះបង់។\n" "Operation cancelled.")
+    await update.message.reply_text(
+        render("cancelled", user_language(update.effective_user))
+    )
     return ConversationHandler.END
 
 
 # Help command handler
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    if user_id in admins:
-        help_text = (
-            "🛠 *Speed Car Wash Bot Help* 🛠\n\n"
-            "*Admin Commands:*\n"
-            "/register - Register a new customer\n"
-            "/ready - Notify customer their car is ready\n"
-            "/cancel - Cancel current operation\n"
-            "/status - Check your wash status\n\n"
-            "*Customer Commands:*\n"
-            "/start - Begin registration process\n\n"
-            "*General Commands:*\n"
-            "/help - Show this help message\n\n"
-            "ជំនួយសម្រាប់ប្រព័ន្ធលាងរថយន្ត Speed Car Wash\n"
-            "ពាក្យបញ្ជាសម្រាប់អ្នកគ្រប់គ្រង៖\n"
-            "/register - ចុះឈ្មោះអតិថិជនថ្មី\n"
-            "/ready - ជូនដំណឹងអតិថិជនថារថយន្តរួចរាល់\n"
-            "/cancel - បោះបង់ប្រតិបត្តិការបច្ចុប្បន្ន\n"
-            "/status - ពិនិត្យស្ថានភាព\n\n"
-            "ពាក្យបញ្ជាសម្រាប់អតិថិជន៖\n"
-            "/start - ចាប់ផ្តើមដំណើរការចុះឈ្មោះ"
-        )
-    else:
-        help_text = (
-            "🚗 *Speed Car Wash Customer Help* 🚗\n\n"
-            "To register for car wash notifications:\n"
-            "1. Send /start command\n"
-            "2. Provide your vehicle plate number when asked\n"
-            "3. You'll be notified when your car is ready\n\n"
-            "សូមអរគុណសម្រាប់ការប្រើប្រាស់សេវាកម្មរបស់យើង។\n"
-            "ដើម្បីចុះឈ្មោះទទួលការជូនដំណឹង៖\n"
-            "1. បញ្ជូនពាក្យបញ្ជា /start\n"
-            "2. ផ្ញើផ្លាកលេខរថយន្តរបស់អ្នកនៅពេលស្នើសុំ\n"
-            "3. អ្នកនឹងទទួលបានការជូនដំណឹងនៅពេលរថយន្តរបស់អ្នករួចរាល់"
-        )
+    name = "admin_help" if acl.is_staff(user_id) else "customer_help"
+    help_text = render(name, user_language(update.effective_user))
 
     await update.message.reply_text(help_text, parse_mode="Markdown")
 
 
-# Protection function game to ensure only admins can access certain commands
-
-
-def is_prohibited_message(text: str) -> bool:
-    """Check if message contains game/gambling/crypto scam/airdrop keywords"""
-    prohibited_keywords = [
-        # Game/Gambling keywords
-        "game",
-        "gamble",
-        "bet",
-        "casino",
-        "lottery",
-        "slot",
-        "poker",
-        "baccarat",
-        "roulette",
-        "ភ្នាល់",
-        "ល្បែង",
-        "ស្លត់",
-        "បាការ៉ាត់",
-        "ឡូតេ",
-        # Crypto scam/airdrop keywords
-        "airdrop",
-        "token",
-        "claim free",
-        "crypto",
-        "web3",
-        "defi",
-        "wallet connect",
-        "connect wallet",
-        "snapshot",
-        "presale",
-        "whitelist",
-        "fomo",
-        "hurry",
-        "limited offer",
-        "first come",
-        "$FRIEND",
-        "socialfi",
-        "meme coin",
-        "nft giveaway",
-        "អាកាសយាន",
-        "ថេរូវ",
-        "គ្រាប់បរិច្ចាគ",
-        "ឥតគិតថ្លៃ",
-    ]
+class ChatPermissionCache:
+    """TTL cache of whether the bot may delete messages in each chat"""
 
-    # Check for URL patterns
-    url_pattern = re.compile(r"https?://\S+|www\.\S+")
-    has_url = bool(url_pattern.search(text.lower()))
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}  # chat_id -> (can_delete, expires_at)
 
-    text_lower = text.lower()
-    return any(keyword in text_lower for keyword in prohibited_keywords) or has_url
+    def get(self, chat_id):
+        entry = self._entries.get(chat_id)
+        if entry is None or entry[1] < time.monotonic():
+            return None
+        return entry[0]
 
+    def set(self, chat_id, can_delete):
+        self._entries[chat_id] = (can_delete, time.monotonic() + self.ttl)
 
-async def is_prohibited_image(image_file: BytesIO) -> bool:
-    """Check if image contains gambling/crypto scam characteristics"""
-    try:
-        with Image.open(image_file) as img:
-            # Convert to numpy array for analysis
-            img_array = np.array(img)
+    def forget(self, chat_id):
+        self._entries.pop(chat_id, None)
 
-            # Example checks (customize these thresholds based on your needs):
-            # 1. Check if image is mostly red (common in gambling/casino ads)
-            red_dominant = np.mean(img_array[:, :, 0]) > 180  # High red channel
 
-            # 2. Check for bright/neon colors (common in scam ads)
-            brightness = np.mean(img_array) > 200  # High brightness
+bot_permissions = ChatPermissionCache(BOT_PERMISSION_TTL)
 
-            # 3. Check if image contains QR codes (common in crypto scams)
-            # (Would need additional QR detection library)
 
-            return red_dominant or brightness
+def member_can_delete(chat_member) -> bool:
+    """Whether a ChatMember is allowed to delete other users' messages"""
+    return bool(getattr(chat_member, "can_delete_messages", False))
 
-    except Exception as e:
-        print(f"Image analysis error: {e}")
+
+async def bot_can_delete(context: ContextTypes.DEFAULT_TYPE, chat) -> bool:
+    """Check the bot's delete permission, hitting the API only on a cache miss"""
+    if chat.type not in ["group", "supergroup"]:
         return False
 
+    can_delete = bot_permissions.get(chat.id)
+    if can_delete is None:
+        chat_member = await context.bot.get_chat_member(chat.id, context.bot.id)
+        can_delete = member_can_delete(chat_member)
+        bot_permissions.set(chat.id, can_delete)
+    return can_delete
 
-async def all_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """List all users registered in the bot"""
-    if update.effective_user.id not in admins:
-        await update.message.reply_text("❌ You are not authorized!")
+
+async def track_bot_membership(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Refresh the permission cache when the bot's rights in a chat change"""
+    member_update = update.my_chat_member
+    bot_permissions.set(
+        member_update.chat.id, member_can_delete(member_update.new_chat_member)
+    )
+
+
+@requires(ADMIN)
+async def reload_filter(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Reload the prohibited keyword list from FILTER_FILE"""
+    if content_filter.reload_if_changed(force=True):
+        await update.message.reply_text(
+            f"✅ Reloaded {content_filter.keyword_count} keywords from {FILTER_FILE}"
+        )
+    else:
+        await update.message.reply_text(
+            f"⚠️ Could not load {FILTER_FILE}, "
+            f"still using {content_filter.keyword_count} keywords."
+        )
+
+
+@requires(ADMIN)
+async def ban_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Reply /banimage to a photo, GIF or video to block it and near duplicates"""
+    target = update.message.reply_to_message
+    found = target and moderation_image(target)
+    if not found:
+        await update.message.reply_text("Reply /banimage to the photo to block.")
+        return
+
+    try:
+        image_id = await image_screener.hash(await media_fetcher.fetch(found[1]))
+    except Exception as e:
+        await update.message.reply_text(f"❌ Could not read that image: {e}")
         return
 
-    if not customer_registry:
+    if image_blocklist.ban(image_id):
+        total = len(image_blocklist)
+        response = f"✅ Image banned ({image_id:016x}), {total} in total."
+    else:
+        response = f"ℹ️ Image already banned ({image_id:016x})."
+
+    chat = update.effective_chat
+    if chat.type != "private" and await bot_can_delete(context, chat):
+        try:
+            await target.delete()
+        except Exception as e:
+            print(f"Couldn't delete banned image: {e}")
+    await update.message.reply_text(response)
+
+
+@requires(ADMIN)
+async def all_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """List all users registered in the bot, one page at a time"""
+    page = users_page()
+    if page is None:
         await update.message.reply_text("No users registered yet.")
         return
 
-    user_list = "\n".join(
-        f"🛂 {qn} - {data.get('customer_name', 'Unknown')} - {data.get('plate', 'No plate')}"
-        for qn, data in customer_registry.items()
-    )
+    text, markup = page
+    await update.message.reply_text(text, reply_markup=markup)
 
-    await update.message.reply_text(f"Registered Users:\n{user_list}")
 
+def caption_match(caption):
+    """content_filter.match for a caption, cached by a hash of its text"""
+    content_filter.reload_if_changed()
+    # Verdicts of an older keyword list are never looked up again
+    key = ("caption", content_filter.generation, text_key(caption))
+    match = verdict_cache.get(key)
+    if match is None:
+        match = content_filter.match(caption) or False
+        verdict_cache.put(key, match)
+    return match or None
 
-async def filter_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Filter out prohibited content in text, images, and documents"""
-    if not update.message:
+
+async def moderate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Moderation entry point: exemptions and flood control, then the filters"""
+    message = update.message
+    user = update.effective_user
+    if not message or not user:
+        return
+    # Moderators (and admins) of a group may post anything there
+    chat_id = update.effective_chat.id
+    if acl.has_role(user.id, MODERATOR, chat_id):
         return
 
+    # Messages over the flood limits are never sent for image analysis
+    flooded = flood_control.check(chat_id, user.id)
+    if flooded == "user" and FLOOD_ACTION != "ignore":
+        removals.add(chat_id, (context, message, "flood"))
+    elif flooded == "chat":
+        # A raid spreads over many accounts, so nobody is muted for it, but
+        # whatever the cheap checks catch is still removed
+        content = cached_match(message)
+        if content:
+            removals.add(chat_id, (context, message, content))
+    if flooded:
+        return
+    await filter_messages(update, context)
+
+
+def cached_match(message):
+    """The prohibited content type of ``message``, judged without downloads.
+
+    Text and captions go through the keyword list; an image only counts if
+    an earlier screening of the same file is still in the verdict cache.
+    """
+    if message.text and content_filter.match(message.text):
+        return "text"
+    if message.caption and caption_match(message.caption):
+        return "image caption"
+    found = moderation_image(message)
+    if found:
+        kind, image = found
+        image_blocklist.reload_if_changed()
+        key = ("photo", image_blocklist.generation, image.file_unique_id)
+        if verdict_cache.get(key):
+            return f"{kind} content"
+    return None
+
+
+@moderation.limit
+async def filter_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Filter out prohibited content in text, images, and documents"""
     # Check text messages
-    if update.message.text and is_prohibited_message(update.message.text):
+    match = update.message.text and content_filter.match(update.message.text)
+    if match:
+        print(f"Text matched {match.rule} rule: {match.keyword!r}")
         await handle_prohibited_content(update, context, "text")
         return
 
-    # Check image captions
-    if update.message.caption and is_prohibited_message(update.message.caption):
+    # Check image captions; forwarded spam repeats them, so verdicts are cached
+    match = update.message.caption and caption_match(update.message.caption)
+    if match:
+        print(f"Caption matched {match.rule} rule: {match.keyword!r}")
         await handle_prohibited_content(update, context, "image caption")
         return
 
-    # Check images (photos)
-    if update.message.photo:
-        try:
-            # Get the highest resolution photo
-            photo_file = await update.message.photo[-1].get_file()
-            image_data = BytesIO()
-            await photo_file.download_to_memory(image_data)
+    # Check images: photos, and the thumbnails of documents, GIFs, videos and
+    # stickers, so only small files are ever downloaded
+    found = moderation_image(update.message)
+    if found:
+        kind, image = found
 
-            if await is_prohibited_image(image_data):
-                await handle_prohibited_content(update, context, "image content")
-                return
+        async def screen():
+            with image_seconds.time():
+                return await image_screener.screen(lambda: media_fetcher.fetch(image))
 
+        # A repeat of an image already judged costs no download or decode;
+        # verdicts from before the latest /banimage are not reused
+        image_blocklist.reload_if_changed()
+        key = ("photo", image_blocklist.generation, image.file_unique_id)
+        try:
+            verdict = await verdict_cache.get_or_compute(key, screen)
+        except MediaTooLarge as e:
+            print(f"Skipped {kind} from {update.effective_user.id}: {e}")
+            return
         except Exception as e:
             print(f"Image processing error: {e}")
+            return
+
+        if verdict is None:
+            print(
+                f"Image screening backlog full, skipped {kind} from {update.effective_user.id}"
+            )
+        elif verdict:
+            await handle_prohibited_content(update, context, f"{kind} content")
+
+
+PROHIBITED_WARNING = (
+    "⚠️ *WARNING* ⚠️\n\n"
+    "Prohibited {content} detected!\n"
+    "This bot does not allow:\n"
+    "- Games/Gambling content\n"
+    "- Crypto Scams\n"
+    "- Suspicious images\n\n"
+    "ការប្រកាសមាតិកាដែលមិនត្រូវបានអនុញ្ញាត៖\n"
+    "- ល្បែង/ភ្នាល់\n"
+    "- ការបោកប្រាស់គ្រីបតូ\n"
+    "- រូបភាពសង្ស័យ"
+)
 
 
 async def handle_prohibited_content(
     update: Update, context: ContextTypes.DEFAULT_TYPE, content_type: str
 ):
-    """Handle the deletion and warning for prohibited content"""
-    user = update.effective_user
-    warning_msg = (
-        "⚠️ *WARNING* ⚠️\n\n"
-        f"Prohibited {content_type} detected!\n"
-        "This bot does not allow:\n"
-        "- Games/Gambling content\n"
-        "- Crypto Scams\n"
-        "- Suspicious images\n\n"
-        "ការប្រកាសមាតិកាដែលមិនត្រូវបានអនុញ្ញាត៖\n"
-        "- ល្បែង/ភ្នាល់\n"
-        "- ការបោកប្រាស់គ្រីបតូ\n"
-        "- រូបភាពសង្ស័យ"
-    )
-
+    """Queue a prohibited message for deletion and a warning"""
+    removals.add(update.effective_chat.id, (context, update.message, content_type))
+
+
+def removal_warning(content_types, flooders, muted, total, deleted=True):
+    """One warning covering every message removed in a burst"""
+    parts = []
+    if content_types:
+        parts.append(PROHIBITED_WARNING.format(content=", ".join(content_types)))
+    if flooders:
+        names = ", ".join(escape_markdown(user.full_name) for user in flooders)
+        line = f"⚠️ *Flood protection*: too many messages from {names}"
+        if muted:
+            line += f", muted for {FLOOD_MUTE_SECONDS // 60} min"
+        parts.append(line + "\n⚠️ សារច្រើនពេក សូមរង់ចាំបន្តិច។")
+    if total > 1:
+        parts.append(f"({total} messages{' removed' if deleted else ''})")
+    return "\n\n".join(parts)
+
+
+async def remove_messages(chat_id, events, total):
+    """Delete a burst of prohibited or flooding messages and warn once.
+
+    ``events`` are (context, message, reason) tuples collected by
+    ``removals``; a flood of any size costs a few API calls per window.
+    """
+    context, first, _ = events[0]
+    chat = first.chat
+    message_ids = [message.message_id for _, message, _ in events]
     try:
         # Only try to delete if in a group/supergroup and bot has permission
-        chat = update.effective_chat
-        bot_user = await context.bot.get_me()
-        chat_member = await context.bot.get_chat_member(chat.id, bot_user.id)
-        can_delete = (
-            chat.type in ["group", "supergroup"]
-            and hasattr(chat_member, "can_delete_messages")
-            and getattr(chat_member, "can_delete_messages", False)
-        )
-        if can_delete:
-            await update.message.delete()
-            deleted = True
-        else:
+        deleted = await bot_can_delete(context, chat)
+        if not deleted:
             print(
-                "Bot cannot delete messages in this chat (insufficient permissions, not a group, or attribute missing)."
+                "Bot cannot delete messages in this chat (insufficient permissions or not a group)."
             )
-            deleted = False
+        elif len(message_ids) == 1:
+            await context.bot.delete_message(chat_id, message_ids[0])
+        else:
+            for start in range(0, len(message_ids), 100):
+                await context.bot.delete_messages(
+                    chat_id, message_ids[start : start + 100]
+                )
     except Exception as e:
-        # Telegram may raise "Message can't be deleted for everyone"
+        # Telegram may raise "Message can't be deleted for everyone";
+        # re-check permissions next time instead of trusting the cache
         print(f"Couldn't delete prohibited message: {e}")
+        bot_permissions.forget(chat_id)
         deleted = False
 
+    flooders = {
+        message.from_user.id: message.from_user
+        for _, message, reason in events
+        if reason == "flood"
+    }
+    muted = FLOOD_ACTION == "mute" and bool(flooders)
+    for user_id in flooders if muted else ():
+        try:
+            await context.bot.restrict_chat_member(
+                chat_id,
+                user_id,
+                ChatPermissions.no_permissions(),
+                until_date=int(time.time()) + FLOOD_MUTE_SECONDS,
+            )
+        except Exception as e:
+            print(f"Couldn't mute {user_id} in {chat_id}: {e}")
+            muted = False
+
+    content_types = sorted({reason for _, _, reason in events if reason != "flood"})
     await context.bot.send_message(
-        chat_id=update.effective_chat.id,
-        text=warning_msg,
+        chat_id=chat_id,
+        text=removal_warning(content_types, flooders.values(), muted, total, deleted),
         parse_mode="Markdown",
     )
 
     # Log the violation
+    user = first.from_user
+    reasons = ", ".join(content_types or ["flood"])
     print(
-        f"Blocked prohibited {content_type} from {user.id} ({user.username}) (deleted: {deleted})"
+        f"Blocked {total} message(s) in {chat_id} ({reasons}), "
+        f"first from {user.id} ({user.username}) (deleted: {deleted})"
     )
 
 
-def main():
-    app = ApplicationBuilder().token(TOKEN).build()
+def start_metrics(application):
+    """Serve Prometheus metrics; each worker process uses the next port"""
+    if not METRICS_PORT:
+        return
+    REGISTRY.gauge(
+        "bot_update_queue_depth",
+        "Updates received but not yet picked up",
+        callback=application.update_queue.qsize,
+    )
+    REGISTRY.gauge(
+        "bot_updates_in_progress",
+        "Updates being handled right now",
+        callback=lambda: application.update_processor.current_concurrent_updates,
+    )
+    port = METRICS_PORT + int(os.getenv("WORKER_INDEX", "0"))
+    try:
+        start_http_server(port, METRICS_ADDR)
+    except OSError as e:
+        print(f"Metrics endpoint disabled, could not listen on port {port}: {e}")
+        return
+    print(f"Serving metrics on http://{METRICS_ADDR}:{port}/metrics")
+
+
+async def warm_up(application):
+    """Prepare caches and purge expired tickets once the bot is initialized"""
+    prefill_qr_pool(application.bot.username)
+    start_metrics(application)
+    outbox.start(application.bot)  # Resumes anything queued before a restart
+
+    # Expired closed tickets are only in the store, never in memory
+    cutoff = datetime.fromtimestamp(time.time() - TICKET_TTL)
+    purged = ticket_store.purge(cutoff.strftime("%Y-%m-%d %H:%M:%S"))
+    if purged:
+        print(f"Purged {purged} expired tickets from the ticket store")
+
+
+async def sync_tickets(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Load ticket changes made by other worker processes before handling"""
+    customer_registry.refresh()
+
+
+async def stop_senders(application):
+    """Flush pending removals and stop the outbox while the bot can still send"""
+    await removals.close()
+    await outbox.stop()
+
+
+async def release_resources(application):
+    """Stop worker pools and flush pending ticket writes before exit"""
+    qr_renderer.shutdown()
+    image_screener.shutdown()
+    await media_fetcher.close()
+    ticket_store.close()
+    outbox.close()
+
+
+def build_application():
+    """Create the Application with every handler and job registered"""
+    builder = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .concurrent_updates(ChatOrderedUpdateProcessor(CONCURRENT_UPDATES))
+        # Same pool sizes as PTB's defaults, plus per-method API metrics
+        .request(MetricsRequest(connection_pool_size=256))
+        .get_updates_request(MetricsRequest())
+        .post_init(warm_up)
+        .post_stop(stop_senders)
+        .post_shutdown(release_resources)
+    )
+    if TELEGRAM_API_BASE:
+        builder.base_url(f"{TELEGRAM_API_BASE}/bot")
+        builder.base_file_url(f"{TELEGRAM_API_BASE}/file/bot")
+    app = builder.build()
 
     reg_conv_handler = ConversationHandler(
         entry_points=[CommandHandler("register", register)],
@@ -1152,27 +1497,85 @@ def main():
 
     # Register handlers
 
+    # Tickets are shared with other workers through the store; the check is a
+    # single PRAGMA when nothing changed
+    app.add_handler(TypeHandler(Update, sync_tickets), group=-1)
     app.add_handler(reg_conv_handler)
     app.add_handler(customer_conv_handler)
-    app.add_handler(MessageHandler(filters.PHOTO & ~filters.COMMAND, filter_messages))
+
+    # Moderation runs in its own group and off the update slots (block=False),
+    # so a spam burst in a group never delays registrations in private chats
+    chats = filters.ChatType.GROUPS if MODERATION_CHATS == "groups" else filters.ALL
+    media = (
+        filters.PHOTO
+        | filters.Document.ALL
+        | filters.ANIMATION
+        | filters.VIDEO
+        | filters.VIDEO_NOTE
+        | filters.Sticker.ALL
+    )
+    content = media | filters.CAPTION | filters.TEXT
     app.add_handler(
         MessageHandler(
-            (filters.CAPTION | filters.TEXT) & ~filters.COMMAND, filter_messages
-        )
+            chats & content & ~filters.COMMAND,
+            moderate,
+            block=False,
+        ),
+        group=MODERATION_GROUP,
     )
 
     app.add_handler(CommandHandler("ready", ready))
-    app.add_handler(CallbackQueryHandler(button_handler))
+    app.add_handler(
+        CallbackQueryHandler(button_handler, pattern=r"^(ready|collected)_")
+    )
+    app.add_handler(CallbackQueryHandler(page_handler, pattern=r"^(status|users):"))
+    app.add_handler(CallbackQueryHandler(ready_page_handler, pattern=r"^ready:"))
     app.add_handler(CommandHandler("help", help_command))
     app.add_handler(CommandHandler("addadmin", add_admin))
     app.add_handler(CommandHandler("removeadmin", remove_admin))
     app.add_handler(CommandHandler("status", check_status))
+    app.add_handler(CommandHandler("users", all_users))
     app.add_handler(CommandHandler("listadmins", list_admins))
+    app.add_handler(CommandHandler("addstaff", add_staff))
+    app.add_handler(CommandHandler("removestaff", remove_staff))
+    app.add_handler(CommandHandler("addgroups", addgroups))
+    app.add_handler(CommandHandler("listgroups", listgroups))
+    app.add_handler(CommandHandler("removegroup", removegroup))
+    app.add_handler(CommandHandler("addmod", add_moderator))
+    app.add_handler(CommandHandler("removemod", remove_moderator))
     app.add_handler(CommandHandler("cancel", cancel))
+    app.add_handler(CommandHandler("language", set_language))
+    app.add_handler(CommandHandler("reloadfilter", reload_filter))
+    app.add_handler(CommandHandler("banimage", ban_image))
+    app.add_handler(
+        ChatMemberHandler(track_bot_membership, ChatMemberHandler.MY_CHAT_MEMBER)
+    )
 
-    # Webhook setup for Render
+    # Expire old tickets a batch at a time on the event loop
+    app.job_queue.run_repeating(expire_old_tickets, interval=EXPIRY_INTERVAL, first=0)
 
-    app.run_polling()
+    instrument_handlers(app)
+    return app
+
+
+def main():
+    # With several workers the front process only receives updates and routes
+    # each chat to a fixed worker; otherwise this process handles everything
+    app = Router(build_application, WORKERS) if WORKERS > 1 else build_application()
+
+    # Webhook setup for Render: Telegram pushes updates to PTB's built-in
+    # server and only requests carrying the secret token are accepted
+    if WEBHOOK_URL:
+        app.run_webhook(
+            listen="0.0.0.0",
+            port=PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+    else:
+        app.run_polling()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,132 @@
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import NamedTuple, Optional
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+
+# Telegram Bot API flood limits
+GLOBAL_RATE = 30  # messages per second across all chats
+GROUP_RATE = 20 / 60  # messages per second into one group
+PRIVATE_RATE = 1  # messages per second into one private chat
+
+
+class BroadcastResult(NamedTuple):
+    chat_id: object
+    ok: bool
+    attempts: int
+    error: Optional[str] = None
+    # Seconds to wait before trying again; None if retrying cannot help
+    retry_after: Optional[float] = None
+
+
+class TokenBucket:
+    """Async token bucket: ``rate`` tokens per second, up to ``capacity``"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        """Take a token if one is available; never waits"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def _seconds(value):
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+class Broadcaster:
+    """Send one message to many chats concurrently within Telegram's limits.
+
+    At most ``max_concurrency`` sends are in flight. Every send waits for
+    the global bucket and for its chat's bucket, honours ``RetryAfter`` and
+    retries network errors with exponential backoff. Errors that retrying
+    cannot fix (bad request, bot blocked, ...) fail the target at once.
+    """
+
+    def __init__(
+        self,
+        max_concurrency=8,
+        max_retries=3,
+        backoff=1.0,
+        max_chat_buckets=10000,
+    ):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_chat_buckets = max_chat_buckets
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._global = TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+        self._chats = OrderedDict()  # chat_id -> TokenBucket, least recent first
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if str(chat_id).startswith("-"):
+                bucket = TokenBucket(GROUP_RATE, 20)
+            else:
+                bucket = TokenBucket(PRIVATE_RATE, 1)
+            self._chats[chat_id] = bucket
+            if len(self._chats) > self.max_chat_buckets:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def send(self, bot, chat_ids, text, **kwargs):
+        """Send ``text`` to every chat; returns one BroadcastResult per chat"""
+        return await asyncio.gather(
+            *(self.send_one(bot, chat_id, text, **kwargs) for chat_id in chat_ids)
+        )
+
+    async def send_one(self, bot, target, text, **kwargs):
+        """Send to a chat id, or to a ChatTarget (which may name a forum topic)"""
+        chat_id = getattr(target, "chat_id", target)
+        if getattr(target, "thread_id", None):
+            kwargs["message_thread_id"] = target.thread_id
+        attempt = 0
+        async with self._semaphore:
+            while True:
+                attempt += 1
+                # Topics share their group's flood limit
+                await self._chat_bucket(chat_id).acquire()
+                await self._global.acquire()
+                try:
+                    await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                    return BroadcastResult(target, True, attempt)
+                except RetryAfter as e:
+                    delay = _seconds(e.retry_after)
+                    if attempt > self.max_retries:
+                        return BroadcastResult(target, False, attempt, str(e), delay)
+                    await asyncio.sleep(delay)
+                except BadRequest as e:
+                    return BroadcastResult(target, False, attempt, str(e))
+                except NetworkError as e:
+                    delay = self.backoff * 2 ** (attempt - 1)
+                    if attempt > self.max_retries:
+                        return BroadcastResult(target, False, attempt, str(e), delay)
+                    await asyncio.sleep(delay)
+                except TelegramError as e:
+                    return BroadcastResult(target, False, attempt, str(e))
@@ -0,0 +1,112 @@
+"""Notification group settings, kept in one JSON file.
+
+Groups are ChatTargets: a chat id plus, for forum supergroups, the topic
+(message thread) the bot posts into. They are written ``-100123`` or
+``-100123_456`` (chat id, underscore, topic id) in commands and in the
+file::
+
+    {"groups": ["-1001234567890", "-1009876543210_33970"]}
+
+The file is read once at startup and then only when its mtime changes, so
+lookups are served from memory; every change is written atomically.
+"""
+
+from typing import NamedTuple, Optional
+
+from storage import JsonFile
+
+
+class ChatTarget(NamedTuple):
+    """A chat to send to, optionally a topic of a forum supergroup"""
+
+    chat_id: int
+    thread_id: Optional[int] = None
+
+    @classmethod
+    def parse(cls, value):
+        """Build a target from ``-100123``, ``"-100123_456"`` or a ChatTarget.
+
+        Raises ValueError for anything else.
+        """
+        if isinstance(value, cls):
+            return value
+        if isinstance(value, bool):
+            raise ValueError(f"Not a chat id: {value!r}")
+        if isinstance(value, int):
+            return cls(value)
+        chat, _, thread = str(value).strip().partition("_")
+        return cls(int(chat), int(thread) if thread else None)
+
+    def __str__(self):
+        if self.thread_id:
+            return f"{self.chat_id}_{self.thread_id}"
+        return str(self.chat_id)
+
+
+class ConfigStore:
+    """Notification groups, cached in memory and saved to ``path``.
+
+    ``default_groups`` are used while no group has been added.
+    """
+
+    def __init__(self, path, default_groups=(), check_interval=2.0):
+        self.file = JsonFile(path, check_interval)
+        self.default_groups = tuple(map(ChatTarget.parse, default_groups))
+        self._groups = ()
+        self.reload_if_changed(force=True)
+
+    @property
+    def groups(self):
+        """Groups added with ``add_groups``, in the order they were added"""
+        self.reload_if_changed()
+        return self._groups
+
+    def notification_targets(self):
+        """Where ticket notifications go: the added groups, else the defaults"""
+        return list(self.groups or self.default_groups)
+
+    def add_groups(self, targets):
+        """Add ``targets``; returns (added, already present)"""
+        # Re-read only if another process changed the file since
+        self.reload_if_changed(force=True)
+        groups = list(self._groups)
+        added, existing = [], []
+        for target in map(ChatTarget.parse, targets):
+            if target in groups:
+                existing.append(target)
+            else:
+                groups.append(target)
+                added.append(target)
+        if added:
+            self._save(groups)
+        return added, existing
+
+    def remove_group(self, target):
+        """Remove ``target``; returns False if it was not configured"""
+        self.reload_if_changed(force=True)
+        target = ChatTarget.parse(target)
+        if target not in self._groups:
+            return False
+        self._save([group for group in self._groups if group != target])
+        return True
+
+    def _save(self, groups):
+        self._groups = tuple(groups)
+        self.file.write({"groups": [str(group) for group in groups]})
+
+    def reload_if_changed(self, force=False):
+        """Re-read the file if it changed; returns True on reload"""
+        if not self.file.changed(force):
+            return False
+        try:
+            data = self.file.read()
+            # Older versions stored a bare list (or a single id)
+            if isinstance(data, dict):
+                data = data.get("groups", [])
+            elif not isinstance(data, list):
+                data = [data]
+            self._groups = tuple(dict.fromkeys(map(ChatTarget.parse, data)))
+        except (IOError, TypeError, ValueError) as e:
+            print(f"Keeping current groups, could not load {self.file.path}: {e}")
+            return False
+        return True
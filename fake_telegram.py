@@ -0,0 +1,284 @@
+"""Local stand-in for the Telegram Bot API, for offline testing.
+
+Serves ``/bot<token>/<method>`` on localhost with canned successful replies
+and records every call, so the bot can be run end to end without network
+access. Point the bot at it with ``TELEGRAM_API_BASE=http://127.0.0.1:<port>``.
+
+Updates queued with ``push_update`` are handed out through long-polling
+``getUpdates``; in webhook mode they are posted to the bot instead (see
+webhook_harness.py).
+
+For load tests every call except getUpdates can be delayed by ``latency``
+(plus up to ``jitter``) seconds, and sendMessage/sendPhoto fail with 429
+Too Many Requests at ``error_rate``. Files registered with ``add_file`` are
+served through getFile and ``/file/bot<token>/<path>``.
+"""
+
+import json
+import random
+import re
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import NamedTuple
+from urllib.parse import parse_qsl
+
+MULTIPART_FIELD = re.compile(rb'name="(\w+)"\r\n\r\n([^\r]*)\r\n')
+
+THROTTLED_METHODS = ("sendMessage", "sendPhoto")
+
+BOT_USER = {
+    "id": 100000001,
+    "is_bot": True,
+    "first_name": "Speed Car Wash",
+    "username": "speed_car_wash_test_bot",
+    "can_join_groups": True,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": False,
+}
+
+
+class ApiCall(NamedTuple):
+    method: str
+    params: dict
+    at: float  # time.monotonic() when the call arrived
+    status: int = 200  # HTTP status the fake answered with
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # The bot hanging up mid-reply (e.g. on shutdown) is not an error here
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeTelegram:
+    """Threaded HTTP server answering Bot API calls from memory"""
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        retry_after=1,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.calls = []
+        self._files = {}  # file_id -> bytes
+        self._waiters = []  # (predicate, Future) resolved by a later call
+        self._updates = []
+        self._next_update_id = 1
+        self._message_id = 0
+        self._cond = threading.Condition()
+        self._server = _Server((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="fake-telegram", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def push_update(self, update):
+        """Queue an update for getUpdates, assigning an update_id if missing"""
+        with self._cond:
+            update = dict(update)
+            update.setdefault("update_id", self._next_update_id)
+            self._next_update_id = max(self._next_update_id, update["update_id"]) + 1
+            self._updates.append(update)
+            self._cond.notify_all()
+        return update
+
+    def wait_for(self, predicate, timeout=10.0):
+        """Block until ``predicate(calls)`` is true; returns False on timeout"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not predicate(self.calls):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def calls_to(self, method):
+        with self._cond:
+            return [call for call in self.calls if call.method == method]
+
+    def expect(self, predicate):
+        """Future resolved with the next successful ApiCall matching ``predicate``.
+
+        Register the expectation before sending the update it answers.
+        """
+        future = Future()
+        with self._cond:
+            self._waiters.append((predicate, future))
+        return future
+
+    def add_file(self, file_id, data):
+        """Make ``data`` downloadable as ``file_id``"""
+        self._files[file_id] = data
+
+    # Bot API methods -----------------------------------------------------
+
+    def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            # Everything before ``offset`` has been confirmed by the bot
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+            while not self._updates and time.monotonic() < deadline:
+                self._cond.wait(deadline - time.monotonic())
+            limit = int(params.get("limit") or 100)
+            return self._updates[:limit]
+
+    def _message(self, params):
+        with self._cond:
+            self._message_id += 1
+            message_id = self._message_id
+        chat_id = params.get("chat_id", 0)
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text") or params.get("caption") or "",
+        }
+
+    def _result(self, method, params):
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            return self._get_updates(params)
+        if method in ("sendMessage", "sendPhoto", "editMessageText"):
+            return self._message(params)
+        if method == "getFile":
+            file_id = params.get("file_id", "")
+            return {
+                "file_id": file_id,
+                "file_unique_id": file_id,
+                "file_size": len(self._files.get(file_id, b"")),
+                "file_path": f"files/{file_id}",
+            }
+        if method == "getChatMember":
+            if int(params.get("user_id") or 0) != BOT_USER["id"]:
+                user_id = int(params.get("user_id") or 0)
+                user = {"id": user_id, "is_bot": False, "first_name": "Member"}
+                return {"status": "member", "user": user}
+            return {
+                "status": "administrator",
+                "user": BOT_USER,
+                "can_be_edited": False,
+                "can_manage_chat": True,
+                "can_change_info": False,
+                "can_delete_messages": True,
+                "can_invite_users": True,
+                "can_restrict_members": True,
+                "can_pin_messages": True,
+                "can_promote_members": False,
+                "can_manage_video_chats": False,
+                "can_post_stories": False,
+                "can_edit_stories": False,
+                "can_delete_stories": False,
+                "is_anonymous": False,
+            }
+        if method == "getWebhookInfo":
+            return {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        # setWebhook, deleteWebhook, answerCallbackQuery, deleteMessage, ...
+        return True
+
+    def _handle(self, method, params):
+        """Return (HTTP status, response body) for one Bot API call"""
+        if method != "getUpdates" and (self.latency or self.jitter):
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+        throttled = method in THROTTLED_METHODS and random.random() < self.error_rate
+        status = 429 if throttled else 200
+
+        # Recorded before answering, so a long-polling getUpdates shows up
+        call = ApiCall(method, params, time.monotonic(), status)
+        with self._cond:
+            self.calls.append(call)
+            if not throttled and self._waiters:
+                waiting = []
+                for predicate, future in self._waiters:
+                    if future.cancelled():
+                        continue
+                    if predicate(call):
+                        # False if the waiter gave up in the meantime
+                        if future.set_running_or_notify_cancel():
+                            future.set_result(call)
+                    else:
+                        waiting.append((predicate, future))
+                self._waiters = waiting
+            self._cond.notify_all()
+
+        if throttled:
+            return status, {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }
+        return status, {"ok": True, "result": self._result(method, params)}
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                if self.path.startswith("/file/"):
+                    file_id = self.path.rsplit("/", 1)[-1]
+                    self._reply(200, fake._files.get(file_id, b""), "image/jpeg")
+                    return
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length)
+                method = self.path.rstrip("/").rsplit("/", 1)[-1]
+                ctype = self.headers.get("Content-Type", "")
+                if ctype.startswith("application/json") and body:
+                    params = json.loads(body)
+                elif ctype.startswith("application/x-www-form-urlencoded"):
+                    params = dict(parse_qsl(body.decode()))
+                else:
+                    # multipart uploads (photos): keep the plain fields only
+                    params = {
+                        name.decode(): value.decode(errors="replace")
+                        for name, value in MULTIPART_FIELD.findall(body)
+                    }
+                status, reply = fake._handle(method, params)
+                self._reply(status, json.dumps(reply).encode(), "application/json")
+
+            do_GET = do_POST
+
+            def _reply(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
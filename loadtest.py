@@ -0,0 +1,481 @@
+"""Load test: drive the real bot with a synthetic traffic mix, offline.
+
+Runs bot.py (the Application built by ``build_application``) against the
+fake Bot API from fake_telegram.py, with configurable API latency and 429
+rate, and replays a mix of sessions:
+
+    qr    an admin sends /register and a plate (answered with the QR photo),
+          the customer opens the /start <ticket> deep link, then the admin
+          presses the ticket's ready button, and then presses it again
+    self  a customer sends /start, then their plate
+    spam  a red "casino" photo posted in a group, which must be deleted
+    fwd   one and the same spam photo forwarded to a new group each time
+    doc   a 20 MB "casino" video sent as a document, judged by its thumbnail
+    flood one user pasting 50 "casino" messages into a group at once
+
+Each step is timed from handing its update to the bot until the bot's
+answering API call. Throughput and p50/p99 latency are reported per flow,
+along with ticket messages the bot sent twice to the same chat.
+
+    python loadtest.py [--sessions N] [--rate R] [--mix qr=5,self=3,spam=2]
+                       [--latency S] [--jitter S] [--error-rate P]
+                       [--mode polling|webhook] [--workers N] [--concurrency N]
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import tempfile
+import time
+from collections import Counter, defaultdict
+from io import BytesIO
+
+import httpx
+from PIL import Image
+
+from fake_telegram import BOT_USER, FakeTelegram
+from webhook_harness import SECRET, free_port, start_bot, wait_until_ready
+
+FLOWS = (
+    "register",
+    "plate_qr",
+    "start_deep_link",
+    "ready_callback",
+    "ready_duplicate",
+    "start",
+    "plate_self",
+    "spam_photo",
+    "forwarded_photo",
+    "spam_document",
+    "flood_burst",
+    "flood_cleared",
+)
+QUEUE_NUMBER = re.compile(r"\d{8}-\d{3,}")
+ADMIN_BASE = 910000000
+USER_BASE = 920000000
+FLOOD_SIZE = 50
+GROUP_BASE = -1009300000000
+
+
+def red_jpeg(width=800, height=600):
+    """A mostly red image, which the image screen flags as gambling"""
+    bio = BytesIO()
+    Image.new("RGB", (width, height), (230, 30, 30)).save(bio, "JPEG", quality=80)
+    return bio.getvalue()
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - {"qr", "self", "spam", "fwd", "doc", "flood"}
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown session kinds: {', '.join(unknown)}")
+    return mix
+
+
+def sent_to(chat_id, *methods, containing=None):
+    """Predicate for a successful call of ``methods`` to ``chat_id``.
+
+    ``containing`` also requires that text in the message, for chats that get
+    notifications from other sessions too.
+    """
+    chat_id = str(chat_id)
+
+    def predicate(call):
+        if call.method not in methods or str(call.params.get("chat_id")) != chat_id:
+            return False
+        return containing is None or containing in call.params.get("text", "")
+
+    return predicate
+
+
+def answered(update):
+    """Predicate for the answer to a callback query ``update``"""
+    query_id = update["callback_query"]["id"]
+
+    def predicate(call):
+        return (
+            call.method == "answerCallbackQuery"
+            and call.params.get("callback_query_id") == query_id
+        )
+
+    return predicate
+
+
+class Traffic:
+    """Builds synthetic updates and times the bot's answers to them"""
+
+    def __init__(self, fake, deliver, admins, timeout):
+        self.fake = fake
+        self.deliver = deliver
+        self.timeout = timeout
+        self.admins = asyncio.Queue()
+        for admin in admins:
+            self.admins.put_nowait(admin)
+        self.latencies = defaultdict(list)
+        self.failures = Counter()
+        self._ids = itertools.count(1)
+        self._photo = red_jpeg()
+        self._thumb = red_jpeg(320, 240)
+        self._forwarded = None  # photo sizes shared by every forward
+
+    # Updates ----------------------------------------------------------------
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"Load{user_id}"}
+
+    def message(self, chat_id, user_id, text=None, **fields):
+        chat_type = "supergroup" if chat_id < 0 else "private"
+        message = {
+            "message_id": next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": chat_type},
+            "from": self._user(user_id),
+            **fields,
+        }
+        if text is not None:
+            message["text"] = text
+            if text.startswith("/"):
+                command = text.split()[0]
+                message["entities"] = [
+                    {"type": "bot_command", "offset": 0, "length": len(command)}
+                ]
+        return {"update_id": next(self._ids), "message": message}
+
+    def callback(self, chat_id, user_id, data):
+        return {
+            "update_id": next(self._ids),
+            "callback_query": {
+                "id": str(next(self._ids)),
+                "from": self._user(user_id),
+                "chat_instance": str(chat_id),
+                "data": data,
+                "message": {
+                    "message_id": next(self._ids),
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "from": BOT_USER,
+                    "text": "ready",
+                },
+            },
+        }
+
+    def photo(self, chat_id, user_id, forwarded=False):
+        if forwarded and self._forwarded:
+            return self.message(chat_id, user_id, photo=self._forwarded)
+        sizes = []
+        for width, height in ((90, 68), (320, 240), (800, 600)):
+            file_id = f"photo{next(self._ids)}"
+            self.fake.add_file(file_id, self._photo)
+            sizes.append(
+                {
+                    "file_id": file_id,
+                    "file_unique_id": file_id,
+                    "width": width,
+                    "height": height,
+                    "file_size": len(self._photo),
+                }
+            )
+        if forwarded:
+            self._forwarded = sizes
+        return self.message(chat_id, user_id, photo=sizes)
+
+    def document(self, chat_id, user_id):
+        """A large video file with a small spam thumbnail"""
+        thumb_id = f"thumb{next(self._ids)}"
+        self.fake.add_file(thumb_id, self._thumb)
+        document = {
+            "file_id": f"doc{next(self._ids)}",
+            "file_unique_id": f"doc{next(self._ids)}",
+            "file_name": "bonus.mp4",
+            "mime_type": "video/mp4",
+            "file_size": 20 * 1024 * 1024,
+            "thumbnail": {
+                "file_id": thumb_id,
+                "file_unique_id": thumb_id,
+                "width": 320,
+                "height": 240,
+                "file_size": len(self._thumb),
+            },
+        }
+        return self.message(chat_id, user_id, document=document)
+
+    def plate(self):
+        return f"LT-{next(self._ids) % 100000:05d}"
+
+    # Steps ------------------------------------------------------------------
+
+    async def step(self, flow, update, predicate):
+        """Send ``update`` and wait for the matching API call; None on timeout"""
+        future = asyncio.wrap_future(self.fake.expect(predicate))
+        start = time.monotonic()
+        await self.deliver(update)
+        try:
+            call = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self.failures[flow] += 1
+            return None
+        self.latencies[flow].append(call.at - start)
+        return call
+
+    async def reset(self, chat_id):
+        """Leave any conversation a failed step left the chat in"""
+        future = asyncio.wrap_future(
+            self.fake.expect(sent_to(chat_id, "sendMessage", containing="cancel"))
+        )
+        await self.deliver(self.message(chat_id, chat_id, "/cancel"))
+        try:
+            await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def qr_session(self):
+        admin = await self.admins.get()
+        try:
+            if not await self.step(
+                "register",
+                self.message(admin, admin, "/register"),
+                sent_to(admin, "sendMessage", containing="/cancel"),
+            ):
+                await self.reset(admin)
+                return
+            call = await self.step(
+                "plate_qr",
+                self.message(admin, admin, self.plate()),
+                sent_to(admin, "sendPhoto"),
+            )
+            if not call:
+                await self.reset(admin)
+                return
+        finally:
+            self.admins.put_nowait(admin)
+
+        found = QUEUE_NUMBER.search(call.params.get("caption", ""))
+        if not found:
+            self.failures["plate_qr"] += 1
+            return
+        queue_number = found.group(0)
+
+        customer = USER_BASE + next(self._ids)
+        if not await self.step(
+            "start_deep_link",
+            self.message(customer, customer, f"/start {queue_number}"),
+            sent_to(customer, "sendMessage"),
+        ):
+            return
+        if not await self.step(
+            "ready_callback",
+            self.callback(admin, admin, f"ready_{queue_number}"),
+            sent_to(customer, "sendMessage"),
+        ):
+            return
+        # A double tap is answered from the ticket's state, with no new sends
+        tap = self.callback(admin, admin, f"ready_{queue_number}")
+        await self.step("ready_duplicate", tap, answered(tap))
+
+    async def self_session(self):
+        customer = USER_BASE + next(self._ids)
+        if not await self.step(
+            "start",
+            self.message(customer, customer, "/start"),
+            sent_to(customer, "sendMessage"),
+        ):
+            await self.reset(customer)
+            return
+        if not await self.step(
+            "plate_self",
+            self.message(customer, customer, self.plate()),
+            sent_to(customer, "sendMessage"),
+        ):
+            await self.reset(customer)
+
+    async def spam_session(self):
+        group = GROUP_BASE - next(self._ids)
+        await self.step(
+            "spam_photo",
+            self.photo(group, USER_BASE + next(self._ids)),
+            sent_to(group, "deleteMessage"),
+        )
+
+    async def document_session(self):
+        group = GROUP_BASE - next(self._ids)
+        await self.step(
+            "spam_document",
+            self.document(group, USER_BASE + next(self._ids)),
+            sent_to(group, "deleteMessage"),
+        )
+
+    async def flood_session(self):
+        """Timed until the first removal, then until the batched rest"""
+        group = GROUP_BASE - next(self._ids)
+        user = USER_BASE + next(self._ids)
+        first = asyncio.wrap_future(
+            self.fake.expect(sent_to(group, "deleteMessage"))
+        )
+        rest = asyncio.wrap_future(self.fake.expect(sent_to(group, "deleteMessages")))
+        start = time.monotonic()
+        for i in range(FLOOD_SIZE):
+            await self.deliver(self.message(group, user, f"casino bonus {i}"))
+        for flow, future in (("flood_burst", first), ("flood_cleared", rest)):
+            try:
+                call = await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError:
+                self.failures[flow] += 1
+                continue
+            self.latencies[flow].append(call.at - start)
+
+    async def forward_session(self):
+        group = GROUP_BASE - next(self._ids)
+        await self.step(
+            "forwarded_photo",
+            self.photo(group, USER_BASE + next(self._ids), forwarded=True),
+            sent_to(group, "deleteMessage"),
+        )
+
+
+async def generate(traffic, sessions, rate, mix, seed):
+    """Start ``sessions`` sessions as a Poisson process of ``rate`` per second"""
+    rng = random.Random(seed)
+    kinds, weights = zip(*mix.items())
+    runners = {
+        "qr": traffic.qr_session,
+        "self": traffic.self_session,
+        "spam": traffic.spam_session,
+        "fwd": traffic.forward_session,
+        "doc": traffic.document_session,
+        "flood": traffic.flood_session,
+    }
+    tasks = []
+    for _ in range(sessions):
+        kind = rng.choices(kinds, weights)[0]
+        tasks.append(asyncio.create_task(runners[kind]()))
+        if rate:
+            await asyncio.sleep(rng.expovariate(rate))
+    await asyncio.gather(*tasks)
+
+
+def report(traffic, elapsed, fake):
+    print(
+        f"{'flow':<16} {'ok':>6} {'failed':>6} {'per s':>8} {'p50 ms':>8} {'p99 ms':>8}"
+    )
+    for flow in FLOWS:
+        values = sorted(traffic.latencies.get(flow, ()))
+        failed = traffic.failures.get(flow, 0)
+        if not values and not failed:
+            continue
+        p50 = f"{percentile(values, 0.5) * 1000:8.1f}" if values else f"{'-':>8}"
+        p99 = f"{percentile(values, 0.99) * 1000:8.1f}" if values else f"{'-':>8}"
+        print(
+            f"{flow:<16} {len(values):>6} {failed:>6} "
+            f"{len(values) / elapsed:>8.1f} {p50} {p99}"
+        )
+    throttled = sum(1 for call in fake.calls if call.status == 429)
+    sent = Counter(
+        (str(call.params.get("chat_id")), call.params.get("text"))
+        for call in fake.calls
+        if call.method == "sendMessage"
+        and call.status == 200
+        and QUEUE_NUMBER.search(call.params.get("text", ""))
+    )
+    duplicates = sum(count - 1 for count in sent.values())
+    print(
+        f"\n{len(fake.calls)} Bot API calls in {elapsed:.2f}s, "
+        f"{throttled} answered with 429, {duplicates} duplicate message(s)"
+    )
+
+
+async def run_traffic(args, fake, port, admins):
+    async with httpx.AsyncClient(timeout=30) as client:
+        if args.mode == "webhook":
+            url = f"http://127.0.0.1:{port}/telegram"
+            headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+
+            async def deliver(update):
+                response = await client.post(url, json=update, headers=headers)
+                response.raise_for_status()
+
+        else:
+
+            async def deliver(update):
+                fake.push_update(update)
+
+        traffic = Traffic(fake, deliver, admins, args.timeout)
+        started = time.monotonic()
+        await generate(traffic, args.sessions, args.rate, args.mix, args.seed)
+        return traffic, time.monotonic() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=5.0, help="sessions/s, 0 = burst")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("qr=5,self=3,spam=2"))
+    parser.add_argument("--admins", type=int, default=8, help="concurrent attendants")
+    parser.add_argument("--latency", type=float, default=0.0, help="API latency, s")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random latency, s")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="429 probability")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--store", choices=("sqlite", "memory"), default="sqlite")
+    parser.add_argument("--timeout", type=float, default=15.0, help="per step, s")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    fake = FakeTelegram(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after,
+    ).start()
+    admins = [ADMIN_BASE + i for i in range(args.admins)]
+    port = free_port()
+
+    with tempfile.TemporaryDirectory(prefix="loadtest-") as workdir:
+        # The bot keeps admins.json, group ids and tickets.db in its cwd
+        with open(os.path.join(workdir, "admins.json"), "w", encoding="utf-8") as f:
+            json.dump(admins, f)
+        bot = start_bot(
+            fake,
+            args.mode,
+            port,
+            args.concurrency,
+            cwd=workdir,
+            TICKET_STORE=args.store,
+            WORKERS=str(args.workers),
+            METRICS_PORT=os.environ.get("METRICS_PORT", "0"),
+        )
+        try:
+            if not wait_until_ready(fake, bot, args.mode, port, timeout=60):
+                print("bot did not come up")
+                return
+            traffic, elapsed = asyncio.run(run_traffic(args, fake, port, admins))
+        finally:
+            # Handlers still waiting on rate limits can hold up a clean stop
+            bot.terminate()
+            try:
+                bot.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                bot.kill()
+                bot.wait()
+            fake.stop()
+
+    report(traffic, elapsed, fake)
+
+
+if __name__ == "__main__":
+    main()
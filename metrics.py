@@ -0,0 +1,300 @@
+"""Counters, gauges and histograms exposed in the Prometheus text format.
+
+Metrics live in a MetricsRegistry (``REGISTRY`` by default) and are served
+by ``start_http_server`` from a daemon thread. Gauges (and counters) may be
+given a ``callback`` instead of being updated, so values such as the number
+of open tickets are computed only when scraped.
+
+``instrument_handlers`` times every handler callback of an Application and
+``MetricsRequest`` counts Bot API calls by method and outcome.
+"""
+
+import bisect
+import functools
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram.ext import ConversationHandler
+from telegram.request import HTTPXRequest
+
+# Seconds; covers a fast handler up to a slow upload
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base class: a named family of samples keyed by label values"""
+
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        """(suffix, label values, extra labels, value) for the current state"""
+        if self.callback is not None:
+            values = self.callback()
+            if not isinstance(values, dict):
+                values = {(): values}
+            return [
+                ("", key if isinstance(key, tuple) else (key,), (), value)
+                for key, value in values.items()
+            ]
+        with self._lock:
+            return [("", key, (), value) for key, value in self._values.items()]
+
+    def collect(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for suffix, key, extra, value in self._samples():
+            labels = _labels(self.labelnames, key, extra)
+            lines.append(f"{self.name}{suffix}{labels} {_number(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    """Cumulative-bucket histogram; ``buckets`` are upper bounds in seconds"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # per-bucket counts (last one is +Inf), then sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+
+    def time(self, **labels):
+        """Context manager observing the duration of its body"""
+        return _Timer(self, labels)
+
+    def _samples(self):
+        with self._lock:
+            snapshot = [
+                (key, list(counts), total)
+                for key, (counts, total) in self._values.items()
+            ]
+        samples = []
+        for key, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                samples.append(("_bucket", key, (("le", _number(bound)),), cumulative))
+            samples.append(("_sum", key, (), total))
+            samples.append(("_count", key, (), cumulative))
+        return samples
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class MetricsRegistry:
+    """A set of metrics rendered together on one endpoint"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=(), callback=None):
+        return self._add(Counter(name, documentation, labelnames, callback))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None):
+        return self._add(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.collect())
+            except Exception as e:
+                print(f"Failed to collect metric {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+HANDLER_SECONDS = REGISTRY.histogram(
+    "bot_handler_seconds", "Time spent in each update handler", ["handler"]
+)
+HANDLER_ERRORS = REGISTRY.counter(
+    "bot_handler_errors_total", "Handler calls that raised", ["handler"]
+)
+API_SECONDS = REGISTRY.histogram(
+    "telegram_api_request_seconds", "Bot API round-trip time", ["method"]
+)
+API_REQUESTS = REGISTRY.counter(
+    "telegram_api_requests_total",
+    "Bot API calls by method and outcome",
+    ["method", "outcome"],
+)
+
+
+def start_http_server(port, addr="127.0.0.1", registry=REGISTRY):
+    """Serve ``registry`` on http://addr:port/metrics from a daemon thread"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(HTTPStatus.NOT_FOUND)
+                return
+            body = registry.render().encode()
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((addr, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, name="metrics-http", daemon=True
+    ).start()
+    return server
+
+
+def _timed(callback):
+    name = getattr(callback, "__name__", type(callback).__name__)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - start, handler=name)
+
+    wrapper.timed = True
+    return wrapper
+
+
+def _instrument(handler):
+    if isinstance(handler, ConversationHandler):
+        for child in handler.entry_points + handler.fallbacks:
+            _instrument(child)
+        for children in handler.states.values():
+            for child in children:
+                _instrument(child)
+    elif not getattr(handler.callback, "timed", False):
+        handler.callback = _timed(handler.callback)
+
+
+def instrument_handlers(application):
+    """Record the latency of every handler registered on ``application``"""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            _instrument(handler)
+
+
+class MetricsRequest(HTTPXRequest):
+    """HTTPXRequest that times and counts every Bot API call.
+
+    The outcome is ``ok``, ``retry_after`` (flood control), ``bad_request``,
+    ``forbidden``, ``http_<code>`` for other statuses, or ``network_error``
+    when no response arrived.
+    """
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        api_method = url.rstrip("/").rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        try:
+            code, _ = result = await super().do_request(
+                url, method, request_data, **kwargs
+            )
+        except Exception:
+            API_REQUESTS.inc(method=api_method, outcome="network_error")
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - start, method=api_method)
+        API_REQUESTS.inc(method=api_method, outcome=_outcome(code))
+        return result
+
+
+def _outcome(code):
+    if 200 <= code <= 299:
+        return "ok"
+    if code == HTTPStatus.TOO_MANY_REQUESTS:
+        return "retry_after"
+    if code == HTTPStatus.BAD_REQUEST:
+        return "bad_request"
+    if code == HTTPStatus.FORBIDDEN:
+        return "forbidden"
+    return f"http_{code}"
@@ -0,0 +1,600 @@
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import re
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import NamedTuple
+
+import httpx
+import numpy as np
+from PIL import Image
+
+from broadcast import TokenBucket
+
+# Default prohibited keywords, grouped by rule
+DEFAULT_KEYWORDS = {
+    "gambling": [
+        "game",
+        "gamble",
+        "bet",
+        "casino",
+        "lottery",
+        "slot",
+        "poker",
+        "baccarat",
+        "roulette",
+        "ភ្នាល់",
+        "ល្បែង",
+        "ស្លត់",
+        "បាការ៉ាត់",
+        "ឡូតេ",
+    ],
+    "crypto": [
+        "airdrop",
+        "token",
+        "claim free",
+        "crypto",
+        "web3",
+        "defi",
+        "wallet connect",
+        "connect wallet",
+        "snapshot",
+        "presale",
+        "whitelist",
+        "fomo",
+        "hurry",
+        "limited offer",
+        "first come",
+        "$FRIEND",
+        "socialfi",
+        "meme coin",
+        "nft giveaway",
+        "អាកាសយាន",
+        "ថេរូវ",
+        "គ្រាប់បរិច្ចាគ",
+        "ឥតគិតថ្លៃ",
+    ],
+}
+URL_RULE = "url"
+URL_PATTERN = re.compile(r"https?://\S+|www\.\S+")
+URL_PREFIXES = ("http://", "https://", "www.")
+SCREEN_SIZE = 320  # Longest side, in pixels, images are screened at
+
+
+class FilterMatch(NamedTuple):
+    rule: str
+    keyword: str
+
+
+def trie_pattern(words):
+    """Regex source matching any of ``words``, factored as a prefix trie.
+
+    Shared prefixes are only tried once, so the regex engine does a single
+    pass over the text rather than testing every word at every position.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def emit(node):
+        branches = [
+            re.escape(char) + emit(child)
+            for char, child in sorted(node.items())
+            if char
+        ]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        # Longer words are tried first, so the longest keyword wins
+        return f"(?:{body})?" if "" in node else body
+
+    return emit(trie)
+
+
+class KeywordFilter:
+    """Prohibited-content matcher compiled into a single trie-shaped regex.
+
+    All keywords plus the URL prefixes are compiled once into one pattern and
+    run over the case-folded text, so a message is scanned in one pass no
+    matter how many keywords there are. ``match`` reports which rule and
+    keyword fired.
+
+    If ``path`` is set, keywords are read from that JSON file, either
+    ``{"rule": ["keyword", ...]}`` or a flat list, and the file is reloaded
+    when its mtime changes (checked at most every ``check_interval`` seconds).
+    """
+
+    def __init__(self, keywords=None, path=None, check_interval=5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._mtime = None
+        self._next_check = 0.0
+        self.generation = 0  # bumped on every compile, for caches of verdicts
+        self.compile(keywords or DEFAULT_KEYWORDS)
+        if path:
+            self.reload_if_changed(force=True)
+
+    def compile(self, keywords):
+        """Build the combined pattern from ``{rule: [keyword, ...]}``"""
+        if isinstance(keywords, list):
+            keywords = {"keyword": keywords}
+
+        rules = {}
+        for rule, words in keywords.items():
+            for word in words:
+                word = word.strip().casefold()
+                if word:
+                    rules.setdefault(word, rule)
+
+        self._pattern = re.compile(trie_pattern([*rules, *URL_PREFIXES]))
+        self._rules = rules
+        self.generation += 1
+        return len(rules)
+
+    def match(self, text):
+        """Return the first FilterMatch in ``text``, or None"""
+        if self.path:
+            self.reload_if_changed()
+        text = text.casefold()
+        pos = 0
+        while True:
+            found = self._pattern.search(text, pos)
+            if found is None:
+                return None
+            keyword = found.group(0)
+            if keyword in self._rules:
+                return FilterMatch(self._rules[keyword], keyword)
+            # A URL prefix only counts when something follows it
+            url = URL_PATTERN.match(text, found.start())
+            if url:
+                return FilterMatch(URL_RULE, url.group(0))
+            pos = found.start() + 1
+
+    def reload_if_changed(self, force=False):
+        """Recompile from ``path`` if the file changed; returns True on reload"""
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return False
+        self._next_check = now + self.check_interval
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return False
+        if not force and mtime == self._mtime:
+            return False
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                keywords = json.load(f)
+            count = self.compile(keywords)
+        except (json.JSONDecodeError, IOError, AttributeError, TypeError) as e:
+            print(f"Keeping current filter, could not load {self.path}: {e}")
+            return False
+        self._mtime = mtime
+        print(f"Loaded {count} prohibited keywords from {self.path}")
+        return True
+
+    @property
+    def keyword_count(self):
+        return len(self._rules)
+
+
+class MediaTooLarge(Exception):
+    """A file is bigger than the download cap"""
+
+
+class MediaFetcher:
+    """Downloads images for moderation with a size cap and a time limit.
+
+    Files are streamed and abandoned as soon as they pass ``max_bytes``
+    (or announce a larger size up front), and a whole download, including
+    the getFile call, must finish within ``timeout`` seconds.
+    """
+
+    def __init__(self, max_bytes=512 * 1024, timeout=10.0):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.rejected = 0
+        self._client = None
+
+    def _check_size(self, size):
+        if size and size > self.max_bytes:
+            self.rejected += 1
+            raise MediaTooLarge(f"{size} bytes, limit is {self.max_bytes}")
+
+    async def fetch(self, media):
+        """Bytes of ``media`` (a PhotoSize, or any object with get_file)"""
+        self._check_size(media.file_size)
+        return await asyncio.wait_for(self._fetch(media), self.timeout)
+
+    async def _fetch(self, media):
+        bot_file = await media.get_file()
+        self._check_size(bot_file.file_size)
+        path = bot_file.file_path
+        if not path.startswith(("http://", "https://")):
+            # Local Bot API server: the file is already on disk
+            with open(path, "rb") as f:
+                data = f.read(self.max_bytes + 1)
+            self._check_size(len(data))
+            return data
+
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+        data = bytearray()
+        async with self._client.stream("GET", path) as response:
+            response.raise_for_status()
+            self._check_size(int(response.headers.get("Content-Length") or 0))
+            async for chunk in response.aiter_bytes():
+                data += chunk
+                self._check_size(len(data))
+        return bytes(data)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def moderation_image(message):
+    """(kind, PhotoSize) of the image to screen for ``message``, or None.
+
+    Photos are screened at a small size; documents, animations, videos and
+    stickers only through the thumbnail Telegram generated for them.
+    """
+    if message.photo:
+        return "image", pick_photo_size(message.photo)
+    for kind in ("animation", "video", "video_note", "sticker", "document"):
+        media = getattr(message, kind)
+        if media is not None and media.thumbnail is not None:
+            return kind.replace("_", " "), media.thumbnail
+    return None
+
+
+def pick_photo_size(photo_sizes, min_side=SCREEN_SIZE):
+    """Smallest PhotoSize whose longest side is at least ``min_side``.
+
+    Falls back to the largest size when every size is smaller.
+    """
+    by_area = sorted(photo_sizes, key=lambda size: size.width * size.height)
+    for size in by_area:
+        if max(size.width, size.height) >= min_side:
+            return size
+    return by_area[-1]
+
+
+def dhash(img, size=8):
+    """Difference hash of a PIL image: ``size * size`` bits, as an int.
+
+    Each bit says whether a pixel of a ``(size + 1) x size`` grayscale
+    thumbnail is brighter than its left neighbour, so the hash follows the
+    image's structure rather than its encoding, scale or colour balance.
+    """
+    gray = img.convert("L").resize((size + 1, size), Image.Resampling.BOX)
+    pixels = np.asarray(gray, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def load_thumbnail(data: bytes, max_side=SCREEN_SIZE):
+    """Decode ``data`` into an RGB image no larger than ``max_side``"""
+    with Image.open(BytesIO(data)) as img:
+        # Let the JPEG decoder scale down while decoding, then shrink the rest
+        img.draft("RGB", (max_side, max_side))
+        img = img.convert("RGB")
+        img.thumbnail((max_side, max_side))
+        return img
+
+
+def image_hash(data: bytes) -> int:
+    return dhash(load_thumbnail(data))
+
+
+def screen_image(
+    data: bytes, max_side=SCREEN_SIZE, blocklist=None, heuristics=True
+) -> bool:
+    """Check if image contains gambling/crypto scam characteristics"""
+    img = load_thumbnail(data, max_side)
+
+    # 1. Near duplicates of images an admin banned
+    if blocklist is not None and len(blocklist):
+        found = blocklist.match(dhash(img))
+        if found:
+            print(f"Image matches banned hash {found[1]:016x} (distance {found[0]})")
+            return True
+    if not heuristics:
+        return False
+
+    img_array = np.asarray(img)
+
+    # 2. Check if image is mostly red (common in gambling/casino ads)
+    red_dominant = img_array[:, :, 0].mean() > 180  # High red channel
+
+    # 3. Check for bright/neon colors (common in scam ads)
+    brightness = img_array.mean() > 200  # High brightness
+
+    return bool(red_dominant or brightness)
+
+
+class ImageScreener:
+    """Run image screening in a thread pool with a bounded backlog.
+
+    At most ``max_pending`` images are downloaded or analysed at once; any
+    image arriving while the backlog is full is shed (``screen`` returns
+    None) so a burst of photos can never stall the bot. Images are checked
+    against ``blocklist`` (an ImageBlocklist) first, then, if
+    ``heuristics`` is set, by their colours.
+    """
+
+    def __init__(self, workers=2, max_pending=8, blocklist=None, heuristics=True):
+        self.max_pending = max_pending
+        self.blocklist = blocklist
+        self.heuristics = heuristics
+        self.pending = 0
+        self.shed = 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="image-screen"
+        )
+
+    async def screen(self, fetch):
+        """Await ``fetch()`` for the image bytes and screen them off the loop"""
+        if self.pending >= self.max_pending:
+            self.shed += 1
+            return None
+        self.pending += 1
+        try:
+            data = await fetch()
+            return await asyncio.wrap_future(
+                self._executor.submit(
+                    screen_image,
+                    data,
+                    blocklist=self.blocklist,
+                    heuristics=self.heuristics,
+                )
+            )
+        finally:
+            self.pending -= 1
+
+    async def hash(self, data):
+        """Perceptual hash of image ``data``, computed off the loop"""
+        return await asyncio.wrap_future(self._executor.submit(image_hash, data))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ModerationQueue:
+    """Bounded concurrency for moderation handlers.
+
+    At most ``concurrency`` wrapped handlers run at once; later ones wait in
+    the backlog, and once ``max_backlog`` are waiting new ones are shed
+    (counted in ``shed``). Run the wrapped handlers with ``block=False`` so
+    the wait happens outside the update processor's slots.
+    """
+
+    def __init__(self, concurrency=4, max_backlog=500):
+        self.max_backlog = max_backlog
+        self.backlog = 0
+        self.active = 0
+        self.shed = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    def limit(self, callback):
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            if self.backlog >= self.max_backlog:
+                self.shed += 1
+                return None
+            self.backlog += 1
+            try:
+                await self._semaphore.acquire()
+            finally:
+                self.backlog -= 1
+            self.active += 1
+            try:
+                return await callback(update, context)
+            finally:
+                self.active -= 1
+                self._semaphore.release()
+
+        return wrapper
+
+
+def text_key(text):
+    """Compact cache key for a message text or caption"""
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+
+class VerdictCache:
+    """LRU cache of moderation verdicts, each kept for at most ``ttl`` seconds.
+
+    Keys are ``(kind, id)`` tuples, e.g. ``("photo", file_unique_id)``;
+    ``hits`` and ``misses`` are counted per kind. ``get_or_compute`` also
+    joins a computation already running for the same key, so an image
+    forwarded to many groups at once is downloaded and screened only once;
+    if that computation raises, everyone who joined it gets the exception.
+    Verdicts of None mean "unknown" and are never cached, nor are errors.
+    """
+
+    def __init__(self, max_size=10000, ttl=6 * 60 * 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = Counter()
+        self.misses = Counter()
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expires at, verdict), oldest first
+        self._inflight = {}  # key -> Future of a running computation
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, verdict = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return verdict
+
+    def get(self, key):
+        """The cached verdict for ``key``, or None"""
+        verdict = self._lookup(key)
+        if verdict is None:
+            self.misses[key[0]] += 1
+        else:
+            self.hits[key[0]] += 1
+        return verdict
+
+    def put(self, key, verdict):
+        if verdict is None or not self.max_size:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, verdict)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_compute(self, key, compute):
+        """The cached verdict, else ``await compute()`` (cached unless None)"""
+        verdict = self._lookup(key)
+        if verdict is not None:
+            self.hits[key[0]] += 1
+            return verdict
+        running = self._inflight.get(key)
+        if running is not None:
+            self.hits[key[0]] += 1
+            return await asyncio.shield(running)
+
+        self.misses[key[0]] += 1
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            verdict = await compute()
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # retrieved, even if nobody joined
+            raise
+        except BaseException:
+            # Cancelled: those who joined are told the verdict is unknown
+            future.set_result(None)
+            raise
+        else:
+            self.put(key, verdict)
+            future.set_result(verdict)
+            return verdict
+        finally:
+            del self._inflight[key]
+
+
+class FloodControl:
+    """Per-user and per-chat token buckets, checked before any analysis.
+
+    ``check`` costs two dict lookups, so messages over the limit can be
+    dropped before they reach the filters. At most ``max_buckets`` buckets
+    of each kind are kept, least recently used first out.
+    """
+
+    def __init__(
+        self, user_rate, user_burst, chat_rate, chat_burst, max_buckets=10000
+    ):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_buckets = max_buckets
+        self.dropped = Counter()  # "user" or "chat" -> messages over the limit
+        self._users = OrderedDict()  # (chat_id, user_id) -> TokenBucket
+        self._chats = OrderedDict()  # chat_id -> TokenBucket
+
+    def _bucket(self, buckets, key, rate, burst):
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(rate, burst)
+            if len(buckets) > self.max_buckets:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(key)
+        return bucket
+
+    def check(self, chat_id, user_id):
+        """None if the message may be analysed, else "user" or "chat" """
+        user = self._bucket(
+            self._users, (chat_id, user_id), self.user_rate, self.user_burst
+        )
+        if not user.try_acquire():
+            self.dropped["user"] += 1
+            return "user"
+        chat = self._bucket(self._chats, chat_id, self.chat_rate, self.chat_burst)
+        if not chat.try_acquire():
+            self.dropped["chat"] += 1
+            return "chat"
+        return None
+
+
+class Coalescer:
+    """Turns bursts of events per key into a bounded number of actions.
+
+    The first event for a key is flushed at once and opens a window of
+    ``delay`` seconds; events arriving in the window are collected and
+    flushed together when it closes (which opens the next window). A flood
+    therefore costs one ``await flush(key, events, total)`` per window. At
+    most ``max_events`` events are kept per window; ``total`` counts every
+    event that arrived.
+    """
+
+    def __init__(self, flush, delay=2.0, max_events=500):
+        self.flush = flush
+        self.delay = delay
+        self.max_events = max_events
+        self._windows = {}  # key -> [events, total count] for the open window
+        self._tasks = set()
+
+    def add(self, key, event):
+        window = self._windows.get(key)
+        if window is None:
+            self._windows[key] = [[], 0]
+            self._spawn(self._run(key, [event], 1))
+            return
+        if len(window[0]) < self.max_events:
+            window[0].append(event)
+        window[1] += 1
+
+    async def close(self):
+        """Flush every open window now, e.g. before shutting down"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        windows, self._windows = self._windows, {}
+        for key, (events, total) in windows.items():
+            if total:
+                try:
+                    await self.flush(key, events, total)
+                except Exception as e:
+                    print(f"Failed to flush {total} event(s) for {key}: {e}")
+
+    def _spawn(self, coroutine):
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key, events, total):
+        while True:
+            try:
+                await self.flush(key, events, total)
+            except Exception as e:
+                print(f"Failed to flush {total} event(s) for {key}: {e}")
+            await asyncio.sleep(self.delay)
+            events, total = self._windows[key]
+            if not total:
+                del self._windows[key]
+                return
+            self._windows[key] = [[], 0]
@@ -0,0 +1,329 @@
+"""Durable outbox for outgoing notifications.
+
+Handlers never send notifications themselves: ``enqueue`` writes them to a
+SQLite table and returns at once, and a background task on the event loop
+sends them through a Broadcaster (so Telegram's flood limits still apply).
+
+- A send that fails with a network error, a 429 or an unexpected exception
+  is retried with exponential backoff (or after the ``retry_after``
+  Telegram asks for).
+- A message that fails for good, or that is still failing after
+  ``max_attempts`` tries, is dead-lettered: it is kept with its last error,
+  its ``on_failure`` notice, if any, is enqueued in its place, and the
+  ``on_dead`` coroutine function is awaited with its key.
+- A message may carry ``on_sent`` follow-ups, which are only enqueued once
+  it has been delivered ("customer notified" after the customer was).
+- Every message may carry a dedupe ``key``. Enqueueing a key that is already
+  pending or sent does nothing, so a repeated button press or a handler that
+  runs twice cannot notify anyone twice. Dead messages give up their key, so
+  the same notification can be queued again later.
+
+Messages to one chat go out one at a time, in the order they were queued; a
+chat waiting out a backoff holds back only its own messages. The sender
+claims each message with a lease of ``lease`` seconds before sending, so
+several worker processes can drain one database, and messages that were
+claimed when a process died are picked up again once their lease runs out.
+Delivery is at least once: a crash between sending and recording the send
+repeats that one message after the restart.
+"""
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+from broadcast import BroadcastResult
+from config import ChatTarget
+
+PENDING = "pending"
+SENT = "sent"
+DEAD = "dead"
+
+
+class Outbox:
+    """Notifications persisted in ``path`` and sent by ``start``'s task"""
+
+    def __init__(
+        self,
+        path,
+        broadcaster,
+        batch_size=50,
+        max_attempts=8,
+        backoff=2.0,
+        max_backoff=600.0,
+        lease=60.0,
+        poll_interval=1.0,
+        on_dead=None,
+    ):
+        self.path = path
+        self.broadcaster = broadcaster
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.on_dead = on_dead  # awaited with the key of a dead-lettered message
+        self.outcomes = Counter()  # sent / retried / dead, by this process
+        self._sending = {}  # message id -> task
+        self._wakeup = None
+        self._task = None
+        self._running = False
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._init_schema()
+
+    def _init_schema(self):
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    key TEXT UNIQUE,
+                    target TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    options TEXT NOT NULL,
+                    on_failure TEXT,
+                    on_sent TEXT,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt REAL NOT NULL,
+                    claimed_until REAL NOT NULL DEFAULT 0,
+                    error TEXT,
+                    updated REAL NOT NULL
+                )
+                """
+            )
+            columns = [
+                row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")
+            ]
+            if "on_sent" not in columns:
+                self._conn.execute("ALTER TABLE outbox ADD COLUMN on_sent TEXT")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_outbox_pending "
+                "ON outbox(status, target, id)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_outbox_updated ON outbox(updated)"
+            )
+
+    # Queueing ---------------------------------------------------------------
+
+    def enqueue(self, targets, text, key=None, on_failure=None, on_sent=(), **options):
+        """Queue ``text`` for every target; returns the number newly queued.
+
+        ``key`` is suffixed with each target, so one key covers a message to
+        several chats. ``on_failure`` is a (target, text) notice queued if the
+        message is dead-lettered; ``on_sent`` are (targets, text, key,
+        options) messages queued once it is delivered. ``options`` are passed
+        to sendMessage.
+        """
+        now = time.time()
+        failure = None
+        if on_failure:
+            failure = json.dumps([str(on_failure[0]), on_failure[1]])
+        follow_ups = None
+        if on_sent:
+            follow_ups = json.dumps(
+                [
+                    [[str(target) for target in message_targets], *message]
+                    for message_targets, *message in on_sent
+                ]
+            )
+        rows = [
+            (
+                f"{key}:{target}" if key else None,
+                str(ChatTarget.parse(target)),
+                text,
+                json.dumps(options),
+                failure,
+                follow_ups,
+                PENDING,
+                now,
+                now,
+            )
+            for target in targets
+        ]
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO outbox (key, target, text, options, "
+                "on_failure, on_sent, status, next_attempt, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            queued = self._conn.total_changes - before
+        if queued and self._wakeup is not None:
+            self._wakeup.set()
+        return queued
+
+    def counts(self):
+        """{status: number of messages} for everything in the table"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM outbox GROUP BY status"
+            ).fetchall()
+        return {PENDING: 0, DEAD: 0, **dict(rows)}
+
+    def purge(self, before):
+        """Drop sent and dead messages last touched before ``before``.
+
+        Their dedupe keys go with them.
+        """
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "DELETE FROM outbox WHERE status != ? AND updated < ?",
+                (PENDING, before),
+            ).rowcount
+
+    # Sending ----------------------------------------------------------------
+
+    def start(self, bot):
+        """Start draining the outbox on the running event loop"""
+        self._wakeup = asyncio.Event()
+        self._running = True
+        self._task = asyncio.create_task(self._run(bot))
+
+    async def stop(self):
+        """Stop the sender; messages being sent are released for next time"""
+        if self._task is None:
+            return
+        # wait_for may swallow a cancel that races with the wakeup, so the
+        # loop also checks the flag
+        self._running = False
+        self._task.cancel()
+        sending = dict(self._sending)
+        for task in sending.values():
+            task.cancel()
+        await asyncio.gather(self._task, *sending.values(), return_exceptions=True)
+        self._task = None
+        self._update(
+            "UPDATE outbox SET claimed_until = 0 WHERE id = ? AND status = ?",
+            [(message_id, PENDING) for message_id in sending],
+        )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    async def _run(self, bot):
+        while self._running:
+            try:
+                for row in self._claim(self.batch_size - len(self._sending)):
+                    self._sending[row[0]] = asyncio.create_task(
+                        self._deliver(bot, *row)
+                    )
+            except sqlite3.Error as e:
+                print(f"Outbox claim failed: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def _claim(self, limit):
+        """Lease the oldest due message of up to ``limit`` chats"""
+        if limit <= 0:
+            return []
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE takes the write lock, so no other process can
+            # claim the same messages in between
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, key, target, text, options, on_failure, on_sent, "
+                    "attempts "
+                    "FROM outbox WHERE id IN (SELECT MIN(id) FROM outbox "
+                    "WHERE status = ? GROUP BY target) "
+                    "AND next_attempt <= ? AND claimed_until <= ? "
+                    "ORDER BY id LIMIT ?",
+                    (PENDING, now, now, limit),
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE outbox SET claimed_until = ? WHERE id = ?",
+                    [(now + self.lease, row[0]) for row in rows],
+                )
+                self._conn.commit()
+            except sqlite3.Error:
+                self._conn.rollback()
+                raise
+        return rows
+
+    async def _deliver(self, bot, message_id, *message):
+        try:
+            await self._send(bot, message_id, *message)
+        finally:
+            del self._sending[message_id]
+            self._wakeup.set()  # the chat's next message may go now
+
+    async def _send(
+        self, bot, message_id, key, target, text, options, on_failure, on_sent, attempts
+    ):
+        try:
+            result = await self.broadcaster.send_one(
+                bot, ChatTarget.parse(target), text, **json.loads(options)
+            )
+        except Exception as e:
+            # Not a Telegram error but a bug: backed off like one, so the
+            # message is dead-lettered in the end instead of retried forever
+            print(f"Outbox could not send message {message_id}: {e!r}")
+            result = BroadcastResult(target, False, 1, f"{type(e).__name__}: {e}", 0.0)
+        attempts += 1
+        now = time.time()
+        if result.ok:
+            self._finish(message_id, SENT, attempts, None, now)
+            self.outcomes[SENT] += 1
+            try:
+                for targets, follow_up, follow_up_key, follow_up_options in json.loads(
+                    on_sent or "[]"
+                ):
+                    self.enqueue(targets, follow_up, follow_up_key, **follow_up_options)
+            except Exception as e:
+                # The message itself went out, so it is not sent again
+                print(f"Outbox could not queue follow-ups of {message_id}: {e!r}")
+        elif result.retry_after is not None and attempts < self.max_attempts:
+            delay = min(self.max_backoff, self.backoff * 2 ** (attempts - 1))
+            retry_at = now + max(delay, result.retry_after)
+            self._update(
+                "UPDATE outbox SET attempts = ?, next_attempt = ?, claimed_until = 0, "
+                "error = ?, updated = ? WHERE id = ?",
+                [(attempts, retry_at, result.error, now, message_id)],
+            )
+            self.outcomes["retried"] += 1
+        else:
+            self._finish(message_id, DEAD, attempts, result.error, now)
+            self.outcomes[DEAD] += 1
+            print(
+                f"Outbox gave up on message {message_id} to {target} "
+                f"after {attempts} attempt(s): {result.error}"
+            )
+            if on_failure:
+                notice_target, notice = json.loads(on_failure)
+                self.enqueue([notice_target], notice)
+            if key and self.on_dead is not None:
+                try:
+                    await self.on_dead(key)
+                except Exception as e:
+                    print(f"Outbox dead-letter hook failed for {key}: {e}")
+
+    def _finish(self, message_id, status, attempts, error, now):
+        # Only sent messages keep their dedupe key
+        self._update(
+            "UPDATE outbox SET status = ?, attempts = ?, error = ?, updated = ?, "
+            "key = CASE WHEN ? = ? THEN key END WHERE id = ?",
+            [(status, attempts, error, now, status, SENT, message_id)],
+        )
+
+    def _update(self, sql, params):
+        try:
+            with self._lock, self._conn:
+                self._conn.executemany(sql, params)
+        except sqlite3.Error as e:
+            # The lease runs out and the message is tried again
+            print(f"Outbox update failed: {e}")
@@ -0,0 +1,315 @@
+import asyncio
+import bisect
+import heapq
+import time
+from collections import defaultdict
+from collections.abc import MutableMapping
+from datetime import datetime
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Ticket statuses. Customers who start the bot themselves get a pending
+# ticket; tickets an attendant registers start out registered. Either way
+# the ticket waits once it has both a plate and a customer, then becomes
+# ready when the car is done and collected when it is picked up. A ready
+# ticket whose customer could not be told goes back to waiting.
+PENDING = "pending"
+REGISTERED = "registered"
+WAITING = "waiting"
+READY = "ready"
+COLLECTED = "collected"
+TRANSITIONS = {
+    PENDING: (WAITING,),
+    REGISTERED: (WAITING,),
+    WAITING: (READY,),
+    READY: (COLLECTED, WAITING),
+    COLLECTED: (),
+}
+
+
+def created_at(data):
+    """Epoch seconds a ticket was created, from ``created_at`` or its timestamp"""
+    if data.get("created_at") is not None:
+        return data["created_at"]
+    try:
+        return datetime.strptime(data["timestamp"], TIMESTAMP_FORMAT).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return time.time()
+
+
+def sort_key(queue_number):
+    """Order queue numbers by day, then numerically (``-1000`` after ``-999``)"""
+    day, _, number = queue_number.rpartition("-")
+    try:
+        return (day, int(number), queue_number)
+    except ValueError:
+        return (queue_number, 0, queue_number)
+
+
+class TicketRegistry(MutableMapping):
+    """Ticket store keyed by queue number with hash indexes.
+
+    Keeps plate -> queue number, status -> queue numbers and
+    customer_chat -> queue numbers indexes in step with the tickets, so the
+    lookups done on every message are O(1) instead of a scan of all tickets.
+
+    Ticket dicts returned from the registry must not be mutated directly;
+    use ``update_ticket`` so the indexes stay correct and the change reaches
+    the backing store.
+
+    If a ``store`` (see storage.py) is given, its open tickets are loaded at
+    construction and every insert, update and delete is passed on to it.
+
+    Every ticket carries a numeric ``created_at`` and sits in a min-heap by
+    creation time, so ``expire`` removes old tickets oldest-first without
+    scanning the rest.
+
+    Queue numbers are also kept in a sorted list, so ``page`` can seek to a
+    cursor with a binary search and render one page in O(page size). Waiting
+    tickets get the same treatment by plate, which ``waiting_plates`` uses to
+    answer plate-prefix searches.
+    """
+
+    INDEXED_FIELDS = ("plate", "status", "customer_chat")
+
+    def __init__(self, store=None):
+        self._store = store
+        self._tickets = {}
+        self._by_plate = {}
+        # dicts used as insertion-ordered sets
+        self._by_status = defaultdict(dict)
+        self._by_customer = defaultdict(dict)
+        self._expiry = []  # heap of (created_at, queue_number)
+        self._order = []  # sorted sort_key(queue_number) of every ticket
+        self._waiting_plates = []  # sorted (plate, queue_number) of waiting tickets
+
+        if store is not None:
+            for queue_number, data in store.load_open().items():
+                self._insert(queue_number, data)
+
+    @property
+    def store(self):
+        return self._store
+
+    def __getitem__(self, queue_number):
+        return self._tickets[queue_number]
+
+    def __setitem__(self, queue_number, data):
+        data = self._insert(queue_number, dict(data))
+        if self._store is not None:
+            self._store.save(queue_number, data)
+
+    def __delitem__(self, queue_number):
+        self._remove(queue_number)
+        if self._store is not None:
+            self._store.delete(queue_number)
+
+    def __iter__(self):
+        return iter(self._tickets)
+
+    def __len__(self):
+        return len(self._tickets)
+
+    def __contains__(self, queue_number):
+        return queue_number in self._tickets
+
+    def update_ticket(self, queue_number, **fields):
+        """Update fields of an existing ticket and refresh its indexes"""
+        data = self._tickets[queue_number]
+        if any(
+            field in fields and fields[field] != data.get(field)
+            for field in self.INDEXED_FIELDS
+        ):
+            self._unindex(queue_number, data)
+            data.update(fields)
+            self._index(queue_number, data)
+        else:
+            data.update(fields)
+        if self._store is not None:
+            self._store.save(queue_number, data)
+        return data
+
+    async def transition(self, queue_number, status, expected=None, **fields):
+        """Compare-and-set a ticket's status, updating ``fields`` with it.
+
+        The ticket only moves if TRANSITIONS allows ``status`` from its
+        current status and, given ``expected``, that status is ``expected``.
+        A shared store makes the check against its own copy, in a thread, so
+        processes sharing it never both move a ticket; otherwise the check
+        is made in memory and the change is written behind. Returns the
+        updated ticket, or None if it is gone or did not move.
+        """
+        sources = [
+            source
+            for source, targets in TRANSITIONS.items()
+            if status in targets and expected in (None, source)
+        ]
+        if self._store is None or not self._store.shared:
+            current = self._tickets.get(queue_number)
+            if current is None or current.get("status") not in sources:
+                return None
+            return self.update_ticket(queue_number, status=status, **fields)
+        data = await asyncio.to_thread(
+            self._store.transition, queue_number, sources, status, fields
+        )
+        if data is None:
+            return None
+        return self._insert(queue_number, data)
+
+    async def publish(self):
+        """Write queued changes through now if other processes share the store"""
+        if self._store is not None and self._store.shared:
+            await asyncio.to_thread(self._store.flush)
+
+    def refresh(self):
+        """Pick up tickets other processes changed or deleted in the shared store.
+
+        Returns the number of tickets updated.
+        """
+        if self._store is None:
+            return 0
+        changed = self._store.load_changed()
+        for queue_number, data in changed.items():
+            if data is not None:
+                self._insert(queue_number, data)
+            elif queue_number in self._tickets:
+                self._remove(queue_number)
+        return len(changed)
+
+    def expire(self, cutoff, limit=None):
+        """Delete up to ``limit`` tickets created before ``cutoff`` (epoch)
+
+        Returns the number of tickets removed.
+        """
+        removed = 0
+        while self._expiry and self._expiry[0][0] < cutoff:
+            if limit is not None and removed >= limit:
+                break
+            stamp, queue_number = heapq.heappop(self._expiry)
+            data = self._tickets.get(queue_number)
+            # Skip heap entries left behind by replaced or deleted tickets
+            if data is None or data["created_at"] != stamp:
+                continue
+            del self[queue_number]
+            removed += 1
+        return removed
+
+    def page(self, after=None, before=None, limit=10, customer_chat=None):
+        """One page of (queue_number, data) pairs in queue-number order.
+
+        Starts after the ``after`` cursor, or ends before the ``before``
+        cursor, or starts at the beginning; cursors are queue numbers and may
+        belong to tickets that no longer exist. With ``customer_chat`` only
+        that customer's tickets are paged. Returns (items, has_prev, has_next).
+        """
+        if customer_chat is None:
+            keys = self._order
+        else:
+            keys = sorted(map(sort_key, self._by_customer.get(customer_chat, ())))
+
+        if before is not None:
+            end = bisect.bisect_left(keys, sort_key(before))
+            start = max(0, end - limit)
+        else:
+            start = bisect.bisect_right(keys, sort_key(after)) if after else 0
+            end = start + limit
+        items = [(key[-1], self._tickets[key[-1]]) for key in keys[start:end]]
+        return items, start > 0, end < len(keys)
+
+    def waiting_plates(self, prefix="", after=None, before=None, limit=10):
+        """One page of waiting (queue_number, data) pairs in plate order.
+
+        Only plates starting with ``prefix`` are included; ``after`` and
+        ``before`` are plate cursors as in ``page``. Returns
+        (items, has_prev, has_next).
+        """
+        plates = self._waiting_plates
+        low = bisect.bisect_left(plates, (prefix,))
+        high = bisect.bisect_left(plates, (prefix + "\uffff",))
+        if before is not None:
+            end = max(low, bisect.bisect_left(plates, (before,), low, high))
+            start = max(low, end - limit)
+        else:
+            start = low
+            if after is not None:
+                start = bisect.bisect_right(plates, (after, "\uffff"), low, high)
+            end = min(high, start + limit)
+        items = [(qn, self._tickets[qn]) for _, qn in plates[start:end]]
+        return items, start > low, end < high
+
+    def find_plate(self, plate):
+        """Return the queue number registered for a plate, or None"""
+        return self._by_plate.get(plate)
+
+    def count_by_status(self):
+        """Return {status: number of tickets}"""
+        # list() takes a snapshot, so this is safe to call from another thread
+        return {
+            status: len(members) for status, members in list(self._by_status.items())
+        }
+
+    def _insert(self, queue_number, data):
+        if queue_number in self._tickets:
+            self._unindex(queue_number, self._tickets[queue_number])
+        else:
+            bisect.insort(self._order, sort_key(queue_number))
+        data["created_at"] = created_at(data)
+        self._tickets[queue_number] = data
+        self._index(queue_number, data)
+        heapq.heappush(self._expiry, (data["created_at"], queue_number))
+        return data
+
+    def _remove(self, queue_number):
+        data = self._tickets.pop(queue_number)
+        self._unindex(queue_number, data)
+        key = sort_key(queue_number)
+        position = bisect.bisect_left(self._order, key)
+        if position < len(self._order) and self._order[position] == key:
+            del self._order[position]
+
+    def _index(self, queue_number, data):
+        plate = data.get("plate")
+        if plate:
+            self._by_plate[plate] = queue_number
+        status = data.get("status")
+        if status:
+            self._by_status[status][queue_number] = None
+        customer_chat = data.get("customer_chat")
+        if customer_chat:
+            self._by_customer[customer_chat][queue_number] = None
+        if self._is_waiting(data):
+            bisect.insort(self._waiting_plates, (plate, queue_number))
+
+    def _unindex(self, queue_number, data):
+        plate = data.get("plate")
+        if plate and self._by_plate.get(plate) == queue_number:
+            del self._by_plate[plate]
+        status = data.get("status")
+        if status:
+            self._discard(self._by_status, status, queue_number)
+        customer_chat = data.get("customer_chat")
+        if customer_chat:
+            self._discard(self._by_customer, customer_chat, queue_number)
+        if self._is_waiting(data):
+            entry = (plate, queue_number)
+            position = bisect.bisect_left(self._waiting_plates, entry)
+            if self._waiting_plates[position : position + 1] == [entry]:
+                del self._waiting_plates[position]
+
+    @staticmethod
+    def _is_waiting(data):
+        """Whether a ticket belongs in the /ready plate index"""
+        return bool(
+            data.get("status") == WAITING
+            and data.get("plate")
+            and data.get("customer_chat")
+        )
+
+    @staticmethod
+    def _discard(index, key, queue_number):
+        members = index.get(key)
+        if members is None:
+            return
+        members.pop(queue_number, None)
+        if not members:
+            del index[key]
@@ -0,0 +1,240 @@
+"""Multi-process mode: one front process fans updates out to worker processes.
+
+The front process only receives updates (long polling or webhook, through
+PTB's Updater) and hands each one to worker ``route(update, workers)``, a
+hash of its chat id. Every update of a chat therefore lands on the same
+worker and in arrival order, so conversation state never has to move between
+processes. Workers run the normal Application and share tickets through the
+SQLite store (see ``TicketRegistry.refresh``).
+"""
+
+import asyncio
+import multiprocessing
+import os
+import signal
+import time
+from collections import deque
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Update fields carrying a chat, checked in this order
+CHAT_FIELDS = (
+    "message",
+    "edited_message",
+    "channel_post",
+    "edited_channel_post",
+    "business_message",
+    "edited_business_message",
+    "my_chat_member",
+    "chat_member",
+    "chat_join_request",
+    "chat_boost",
+    "removed_chat_boost",
+    "message_reaction",
+    "message_reaction_count",
+)
+# Update fields with only a sender; routed by user id
+USER_FIELDS = (
+    "inline_query",
+    "chosen_inline_result",
+    "shipping_query",
+    "pre_checkout_query",
+    "poll_answer",
+)
+
+
+def chat_key(update):
+    """Chat id (or user id, for chat-less updates) of a raw update dict"""
+    for field in CHAT_FIELDS:
+        if field in update:
+            return update[field]["chat"]["id"]
+    query = update.get("callback_query")
+    if query:
+        message = query.get("message")
+        return message["chat"]["id"] if message else query["from"]["id"]
+    for field in USER_FIELDS:
+        if field in update:
+            return update[field].get("from", update[field].get("user", {})).get("id", 0)
+    return 0
+
+
+def route(update, workers):
+    """Index of the worker that handles a raw update"""
+    return hash(chat_key(update)) % workers
+
+
+def update_chat_id(update):
+    """Chat id of a parsed Update, falling back to the user id"""
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return None
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Process updates concurrently, except that each chat's run in order.
+
+    An update for a chat that is already being served is queued behind it
+    and returns at once; the running update then works through its chat's
+    queue in arrival order. A chat never sees its replies reordered, and a
+    burst from one chat occupies a single concurrency slot, so it cannot
+    starve the others.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._queues = {}  # chat_id -> updates waiting behind the running one
+
+    async def do_process_update(self, update, coroutine):
+        chat_id = update_chat_id(update) if isinstance(update, Update) else None
+        if chat_id is None:
+            await coroutine
+            return
+        queue = self._queues.get(chat_id)
+        if queue is not None:
+            queue.append(coroutine)
+            return
+        queue = self._queues[chat_id] = deque()
+        try:
+            while True:
+                try:
+                    await coroutine
+                except Exception as e:
+                    # The rest of the chat's queue still runs
+                    print(f"Processing an update of chat {chat_id} failed: {e!r}")
+                if not queue:
+                    break
+                coroutine = queue.popleft()
+        finally:
+            del self._queues[chat_id]
+            for coroutine in queue:  # only left over when cancelled
+                coroutine.close()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+def _run_worker(build_application, index, inbox, ready):
+    # Ctrl+C reaches the whole process group; the front process stops workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    os.environ["WORKER_INDEX"] = str(index)
+    asyncio.run(_serve(build_application(), index, inbox, ready))
+    print(f"Worker {index} stopped")
+
+
+async def _serve(application, index, inbox, ready):
+    """Feed updates from ``inbox`` into ``application`` until a None arrives"""
+    loop = asyncio.get_running_loop()
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    print(f"Worker {index} started")
+    ready.put(index)
+    try:
+        while True:
+            data = await loop.run_in_executor(None, inbox.get)
+            if data is None:
+                break
+            await application.update_queue.put(Update.de_json(data, application.bot))
+    finally:
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+class Router:
+    """Front process that receives updates and routes them to workers.
+
+    ``build_application`` must be a module-level function returning a fully
+    configured Application; each worker process calls it after a fresh
+    import (the spawn start method), so no connection or thread is shared
+    with the front process. Workers that die are restarted on the same
+    inbox, so queued updates for their chats are not lost.
+    """
+
+    def __init__(self, build_application, workers):
+        self.build_application = build_application
+        self.workers = workers
+        self._context = multiprocessing.get_context("spawn")
+        self._inboxes = [self._context.Queue() for _ in range(workers)]
+        self._processes = [None] * workers
+        self._ready = self._context.Queue()
+
+    def run_polling(self, **kwargs):
+        asyncio.run(self._front(lambda updater: updater.start_polling(**kwargs)))
+
+    def run_webhook(self, **kwargs):
+        asyncio.run(self._front(lambda updater: updater.start_webhook(**kwargs)))
+
+    def _start_worker(self, index):
+        process = self._context.Process(
+            target=_run_worker,
+            args=(self.build_application, index, self._inboxes[index], self._ready),
+            name=f"bot-worker-{index}",
+        )
+        process.start()
+        self._processes[index] = process
+
+    def _check_workers(self):
+        for index, process in enumerate(self._processes):
+            if not process.is_alive():
+                print(f"Worker {index} exited with {process.exitcode}, restarting")
+                self._start_worker(index)
+
+    def _stop_workers(self):
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for process in self._processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+    async def _front(self, start_updates):
+        for index in range(self.workers):
+            self._start_worker(index)
+        updater = None
+        # Workers are stopped however the front process exits, even when the
+        # updater fails to start (bad token, port in use, ...)
+        try:
+            # Don't take updates before every worker can handle them
+            loop = asyncio.get_running_loop()
+            for _ in range(self.workers):
+                await loop.run_in_executor(None, self._ready.get)
+
+            stop = asyncio.Event()
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(signum, stop.set)
+
+            # Only the Updater is used here; handlers run in the workers
+            application = self.build_application()
+            updater = application.updater
+            await updater.initialize()
+            await start_updates(updater)
+            print(f"Routing updates to {self.workers} workers")
+            next_check = time.monotonic() + 1
+            while not stop.is_set():
+                if time.monotonic() >= next_check:
+                    self._check_workers()
+                    next_check = time.monotonic() + 1
+                try:
+                    update = await asyncio.wait_for(application.update_queue.get(), 1)
+                except asyncio.TimeoutError:
+                    continue
+                data = update.to_dict()
+                self._inboxes[route(data, self.workers)].put(data)
+        finally:
+            if updater is not None:
+                if updater.running:
+                    await updater.stop()
+                await updater.shutdown()
+            self._stop_workers()
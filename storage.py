@@ -0,0 +1,524 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+# Statuses whose tickets are loaded back into memory at startup
+OPEN_STATUSES = ("pending", "registered", "waiting", "ready")
+
+
+class TicketStore:
+    """In-memory ticket store; the base for persistent backends.
+
+    Stores receive every write made through TicketRegistry. This base class
+    keeps nothing, so tickets only live as long as the process.
+
+    A ``shared`` store is used by several processes at once; TicketRegistry
+    then moves tickets with the store's ``transition`` instead of trusting
+    its own copy.
+    """
+
+    def __init__(self, shared=False):
+        self.shared = shared
+        self._sequences = {}  # day -> next unreserved queue number
+
+    def load_open(self):
+        """Return {queue_number: data} for tickets that are still open"""
+        return {}
+
+    def save(self, queue_number, data):
+        """Persist the current state of a ticket"""
+
+    def delete(self, queue_number):
+        """Remove a ticket from the store"""
+
+    def purge(self, before):
+        """Drop stored tickets whose timestamp is older than ``before``"""
+        return 0
+
+    def load_changed(self):
+        """Return {queue_number: data} for tickets other processes changed.
+
+        Tickets they deleted map to None.
+        """
+        return {}
+
+    def reserve_block(self, day, size):
+        """Atomically reserve ``size`` queue numbers for ``day``; returns the first"""
+        start = self._sequences.get(day, 1)
+        self._sequences[day] = start + size
+        return start
+
+    def get_meta(self, key, default=None):
+        """Read a stored setting"""
+        return default
+
+    def set_meta(self, key, value):
+        """Persist a setting"""
+
+    def flush(self):
+        """Write out any buffered changes"""
+
+    @property
+    def pending_writes(self):
+        """Number of changes buffered but not yet written"""
+        return 0
+
+    def close(self):
+        """Flush and release resources"""
+
+
+class SQLiteTicketStore(TicketStore):
+    """SQLite ticket store with write-behind batching.
+
+    Handlers only queue changes in memory; a background thread writes them in
+    a single transaction every ``flush_interval`` seconds (or as soon as
+    ``batch_size`` changes are waiting), so no handler ever waits on fsync.
+    The database runs in WAL mode with indexes on the looked-up columns.
+
+    Several processes may share one database file. Every flush stamps its
+    rows with the next ``version``, so ``load_changed`` can fetch just what
+    other processes wrote since the last call; ``PRAGMA data_version`` makes
+    the common nothing-changed case a single cheap query. Deleted tickets are
+    kept as versioned tombstones (until ``purge``), so the deletion reaches
+    the other processes too and a late write from one of them cannot bring
+    the ticket back. In a ``shared`` store, status changes skip the
+    write-behind queue: they are compare-and-set against the row in the
+    database (see ``transition``).
+    """
+
+    def __init__(self, path, flush_interval=0.5, batch_size=200, shared=False):
+        super().__init__(shared)
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._pending = {}  # queue_number -> row tuple, or None for delete
+        self._meta_pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._data_version = None
+        self._seen_version = 0  # highest row version already loaded
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn_lock = threading.Lock()
+        self._init_schema()
+
+        self._writer = threading.Thread(
+            target=self._run_writer, name="ticket-store-writer", daemon=True
+        )
+        self._writer.start()
+
+    def _init_schema(self):
+        with self._conn_lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS tickets (
+                    queue_number TEXT PRIMARY KEY,
+                    plate TEXT,
+                    status TEXT,
+                    customer_chat INTEGER,
+                    timestamp TEXT,
+                    data TEXT NOT NULL,
+                    version INTEGER NOT NULL DEFAULT 0,
+                    deleted INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(tickets)")]
+            if "version" not in columns:
+                self._conn.execute(
+                    "ALTER TABLE tickets ADD COLUMN version INTEGER NOT NULL DEFAULT 0"
+                )
+            if "deleted" not in columns:
+                self._conn.execute(
+                    "ALTER TABLE tickets ADD COLUMN deleted INTEGER NOT NULL DEFAULT 0"
+                )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_tickets_plate ON tickets(plate)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_tickets_status ON tickets(status)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_tickets_customer_chat "
+                "ON tickets(customer_chat)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_tickets_timestamp ON tickets(timestamp)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_tickets_version ON tickets(version)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sequences "
+                "(day TEXT PRIMARY KEY, next INTEGER NOT NULL)"
+            )
+
+    def load_open(self):
+        placeholders = ", ".join("?" for _ in OPEN_STATUSES)
+        with self._conn_lock:
+            (self._data_version,) = self._conn.execute("PRAGMA data_version").fetchone()
+            (self._seen_version,) = self._conn.execute(
+                "SELECT COALESCE(MAX(version), 0) FROM tickets"
+            ).fetchone()
+            rows = self._conn.execute(
+                f"SELECT queue_number, data FROM tickets "
+                f"WHERE status IN ({placeholders}) AND deleted = 0 ORDER BY rowid",
+                OPEN_STATUSES,
+            ).fetchall()
+        return {queue_number: json.loads(data) for queue_number, data in rows}
+
+    def load_changed(self):
+        with self._conn_lock:
+            # data_version only moves when another connection commits
+            (data_version,) = self._conn.execute("PRAGMA data_version").fetchone()
+            if data_version == self._data_version:
+                return {}
+            self._data_version = data_version
+            rows = self._conn.execute(
+                "SELECT queue_number, data, version, deleted FROM tickets "
+                "WHERE version > ? ORDER BY version",
+                (self._seen_version,),
+            ).fetchall()
+        if not rows:
+            return {}
+        self._seen_version = rows[-1][2]
+        with self._lock:
+            # Our own unflushed changes are newer than what is on disk
+            pending = set(self._pending)
+        return {
+            queue_number: None if deleted else json.loads(data)
+            for queue_number, data, _, deleted in rows
+            if queue_number not in pending
+        }
+
+    def save(self, queue_number, data):
+        row = (
+            queue_number,
+            data.get("plate"),
+            data.get("status"),
+            data.get("customer_chat"),
+            data.get("timestamp"),
+            json.dumps(data, ensure_ascii=False),
+        )
+        self._enqueue(queue_number, row)
+
+    def delete(self, queue_number):
+        self._enqueue(queue_number, None)
+
+    def transition(self, queue_number, sources, status, fields):
+        """Compare-and-set a ticket's status; returns the new data or None.
+
+        The ticket moves to ``status`` (with ``fields``) only if the row in
+        the database is in one of ``sources``: another process may have moved
+        it since this one last refreshed. This blocks on the database, so
+        callers on the event loop run it in a thread.
+        """
+        self.flush()  # our own queued changes go first
+        with self._conn_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT data FROM tickets WHERE queue_number = ? AND deleted = 0",
+                    (queue_number,),
+                ).fetchone()
+                data = json.loads(row[0]) if row else None
+                if data is None or data.get("status") not in sources:
+                    self._conn.rollback()
+                    return None
+                data.update(fields, status=status)
+                (version,) = self._conn.execute(
+                    "SELECT COALESCE(MAX(version), 0) + 1 FROM tickets"
+                ).fetchone()
+                self._conn.execute(
+                    "UPDATE tickets SET plate = ?, status = ?, customer_chat = ?, "
+                    "timestamp = ?, data = ?, version = ? WHERE queue_number = ?",
+                    (
+                        data.get("plate"),
+                        status,
+                        data.get("customer_chat"),
+                        data.get("timestamp"),
+                        json.dumps(data, ensure_ascii=False),
+                        version,
+                        queue_number,
+                    ),
+                )
+                self._conn.commit()
+            except sqlite3.Error:
+                self._conn.rollback()
+                raise
+        return data
+
+    def purge(self, before):
+        # Closed tickets are never loaded, so they are removed here instead
+        self.flush()
+        with self._conn_lock, self._conn:
+            return self._conn.execute(
+                "DELETE FROM tickets WHERE timestamp < ?", (before,)
+            ).rowcount
+
+    def reserve_block(self, day, size):
+        # BEGIN IMMEDIATE takes the write lock up front, so processes sharing
+        # the database file never hand out the same block
+        with self._conn_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO sequences (day, next) VALUES (?, 1)", (day,)
+                )
+                (start,) = self._conn.execute(
+                    "SELECT next FROM sequences WHERE day = ?", (day,)
+                ).fetchone()
+                self._conn.execute(
+                    "UPDATE sequences SET next = ? WHERE day = ?", (start + size, day)
+                )
+                self._conn.commit()
+            except sqlite3.Error:
+                self._conn.rollback()
+                raise
+        return start
+
+    def get_meta(self, key, default=None):
+        with self._lock:
+            if key in self._meta_pending:
+                return self._meta_pending[key]
+        with self._conn_lock:
+            row = self._conn.execute(
+                "SELECT value FROM meta WHERE key = ?", (key,)
+            ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        with self._lock:
+            self._meta_pending[key] = value
+        self._wakeup.set()
+
+    @property
+    def pending_writes(self):
+        return len(self._pending) + len(self._meta_pending)
+
+    def _enqueue(self, queue_number, row):
+        with self._lock:
+            self._pending[queue_number] = row
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def _run_writer(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"Ticket store flush failed: {e}")
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            meta, self._meta_pending = self._meta_pending, {}
+        if not pending and not meta:
+            return
+
+        upserts = [row for row in pending.values() if row is not None]
+        deletes = [qn for qn, row in pending.items() if row is None]
+        try:
+            with self._conn_lock, self._conn:
+                if upserts or deletes:
+                    # The write lock is held from here, so versions only grow
+                    self._conn.execute("BEGIN IMMEDIATE")
+                    (version,) = self._conn.execute(
+                        "SELECT COALESCE(MAX(version), 0) + 1 FROM tickets"
+                    ).fetchone()
+                if upserts:
+                    # Tombstones stay: a deleted ticket is never written back
+                    self._conn.executemany(
+                        "INSERT INTO tickets (queue_number, plate, status, "
+                        "customer_chat, timestamp, data, version) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT(queue_number) DO UPDATE SET "
+                        "plate = excluded.plate, status = excluded.status, "
+                        "customer_chat = excluded.customer_chat, "
+                        "timestamp = excluded.timestamp, data = excluded.data, "
+                        "version = excluded.version WHERE tickets.deleted = 0",
+                        [row + (version,) for row in upserts],
+                    )
+                if deletes:
+                    # The timestamp is kept, so purge drops the tombstone later
+                    self._conn.executemany(
+                        "UPDATE tickets SET deleted = 1, status = NULL, plate = NULL, "
+                        "customer_chat = NULL, data = '{}', version = ? "
+                        "WHERE queue_number = ?",
+                        [(version, qn) for qn in deletes],
+                    )
+                if meta:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                        [(k, json.dumps(v)) for k, v in meta.items()],
+                    )
+        except sqlite3.Error:
+            # Put the batch back, without clobbering anything newer
+            with self._lock:
+                self._pending = {**pending, **self._pending}
+                self._meta_pending = {**meta, **self._meta_pending}
+            raise
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._writer.join(timeout=5)
+        self.flush()
+        with self._conn_lock:
+            self._conn.close()
+
+
+class QueueAllocator:
+    """Hands out per-day queue numbers from blocks reserved in a TicketStore.
+
+    Numbers come from a persisted sequence per day, so they restart at 1 each
+    day and survive crashes. Each allocator reserves ``block_size`` numbers at
+    a time, so several processes sharing a store only contend once per block.
+    Numbers for which ``is_live`` returns True are skipped, never reused.
+    """
+
+    def __init__(self, store, block_size=20, is_live=None):
+        self.store = store
+        self.block_size = block_size
+        self.is_live = is_live
+        self._lock = threading.Lock()
+        self._day = None
+        self._blocks = []  # reserved [next, end) ranges of _day, oldest first
+
+    def allocate(self, day=None):
+        """Return the next free queue number, e.g. ``20250101-007``"""
+        day = day or datetime.now().strftime("%Y%m%d")
+        with self._lock:
+            while True:
+                self._reserve(day, 1)
+                block = self._blocks[0]
+                queue_number = f"{day}-{block[0]:03d}"
+                block[0] += 1
+                if block[0] >= block[1]:
+                    self._blocks.pop(0)
+                if self.is_live is None or not self.is_live(queue_number):
+                    return queue_number
+
+    def peek(self, count, day=None):
+        """The next ``count`` queue numbers ``allocate`` will try, without allocating.
+
+        Blocks are reserved as needed, so this also works before the first
+        number of the day is handed out; live numbers are left out.
+        """
+        day = day or datetime.now().strftime("%Y%m%d")
+        with self._lock:
+            self._reserve(day, count)
+            numbers = [
+                f"{day}-{n:03d}"
+                for start, end in self._blocks
+                for n in range(start, end)
+            ]
+        return [
+            queue_number
+            for queue_number in numbers[:count]
+            if self.is_live is None or not self.is_live(queue_number)
+        ]
+
+    def _reserve(self, day, count):
+        # Numbers left over from an earlier day are dropped
+        if day != self._day:
+            self._day = day
+            self._blocks = []
+        while sum(end - start for start, end in self._blocks) < count:
+            start = self.store.reserve_block(day, self.block_size)
+            self._blocks.append([start, start + self.block_size])
+
+
+def open_ticket_store(kind, path, shared=False):
+    """Create the ticket store backend named by ``kind``"""
+    if kind == "sqlite":
+        return SQLiteTicketStore(path, shared=shared)
+    if kind == "memory":
+        if shared:
+            raise ValueError("The memory ticket store cannot be shared")
+        return TicketStore()
+    raise ValueError(f"Unknown ticket store: {kind}")
+
+
+def write_json_atomic(path, data):
+    """Replace the JSON file at ``path`` in one step.
+
+    The data goes to a temporary file in the same directory, which is then
+    renamed over ``path``, so readers (other processes included) see either
+    the old file or the new one, never a partial write.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory
+    )
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class JsonFile:
+    """A JSON settings file, re-read only when its mtime changes.
+
+    ``changed`` stats the file at most every ``check_interval`` seconds, so
+    it is cheap enough to call on every lookup; ``write`` replaces the file
+    atomically and remembers its own change, so it is not read back.
+    """
+
+    def __init__(self, path, check_interval=2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._mtime = None
+        self._next_check = 0.0
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def changed(self, force=False):
+        """Whether the file differs from the last one read or written.
+
+        ``force`` stats it now instead of waiting out ``check_interval``.
+        """
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return False
+        self._next_check = now + self.check_interval
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return False
+        return mtime != self._mtime
+
+    def read(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self._mtime = mtime
+        return data
+
+    def write(self, data):
+        write_json_atomic(self.path, data)
+        self._mtime = os.stat(self.path).st_mtime_ns
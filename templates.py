@@ -0,0 +1,399 @@
+from string import Formatter
+
+KHMER = "km"
+ENGLISH = "en"
+BILINGUAL = "both"
+LANGUAGES = (KHMER, ENGLISH, BILINGUAL)
+
+# Message texts. Each entry has a Khmer and an English body, optionally a
+# header/footer shared by every language, and the separator placed between
+# the two bodies in bilingual messages. Fields use str.format syntax.
+MESSAGES = {
+    "admin_panel": {
+        "header": "👨‍🔧*Admin Panel - Speed Car Wash*\n\n",
+        "km": (
+            "ពាក្យបញ្ជាដែលអាចប្រើបាន:\n"
+            "/register - ចុះឈ្មោះអតិថិជនថ្មី\n"
+            "/ready - ជូនដំណឹងទៅអតិថិជនថារថយន្តរួចរាល់\n"
+            "/cancel - បោះបង់ប្រតិបត្តិការបច្ចុប្បន្ន"
+        ),
+        "en": (
+            "Available commands :\n"
+            "/register - Register a new customer\n"
+            "/ready - Notify customer their car is ready\n"
+            "/cancel - Cancel the current operation"
+        ),
+    },
+    "welcome": {
+        "km": (
+            "🚗 *សូមស្វាគមន៍មកកាន់ Speed Car Wash!*\n\n"
+            "សូមផ្ញើផ្លាកលេខរថយន្តរបស់អ្នក។\n"
+            "ឧទាហរណ៍៖ ABC-1234"
+        ),
+        "en": (
+            "🚗 *Welcome to Speed Car Wash!*\n\n"
+            "Please send your vehicle plate number.\n"
+            "Example: ABC-1234"
+        ),
+    },
+    "not_authorized": {
+        "km": "❌ អ្នកមិនមានសិទ្ធិប្រើបញ្ជានេះទេ។",
+        "en": "❌ You are not authorized to use this command.",
+        "sep": "\n",
+    },
+    "ask_plate": {
+        "km": "✅ សូមផ្ញើផ្លាកលេខរថយន្តរបស់អតិថិជន",
+        "en": "✅ Please send the vehicle plate number",
+        "sep": "\n",
+        "footer": "\n\nType /cancel to abort.",
+    },
+    "invalid_plate": {
+        "km": "❌ ទម្រង់ផ្លាកលេខមិនត្រឹមត្រូវ។ សូមព្យាយាមម្តងទៀត។",
+        "en": "❌ Invalid plate format. Please try again.",
+        "sep": "\n",
+        "footer": "\n\nType /cancel to abort.",
+    },
+    "duplicate_plate": {
+        "km": "⚠️ ផ្លាកលេខនេះបានចុះឈ្មោះរួចហើយ។ សូមបញ្ចូលលេខផ្សេង។",
+        "en": "⚠️ This plate number is already registered. Please send a different one.",
+        "sep": "\n",
+        "footer": "\n\nType /cancel to abort.",
+    },
+    "customer_registered": {
+        "km": (
+            "ការចុះឈ្មោះអតិថិជនបានដោយជោគជ័យ!\n\n"
+            "🛂 លេខសំបុត្រ# : {queue_number}\n"
+            "🚗 ផ្លាកលេខ : {plate}\n"
+            "👤 ឈ្មោះអតិថិជន : {customer_name}\n\n"
+            "អ្នកនឹងទទួលបានការជូនដំណឹងនៅពេលរថយន្តរបស់អ្នករួចរាល់។"
+        ),
+        "en": (
+            "Successful customer registration completed!\n\n"
+            "🛂 Ticket Number : {queue_number}\n"
+            "🚗 Plate : {plate}\n"
+            "👤 Customer Name : {customer_name}\n\n"
+            "You'll be notified when your car is ready."
+        ),
+    },
+    "qr_registered": {
+        "km": (
+            "អតិថិជនបានចុះឈ្មោះតាមរយៈ QR Code ដោយជោគជ័យ\n\n"
+            "🛂 លេខសំបុត្រ# : {queue_number}\n"
+            "🚗 ផ្លាកលេខ : {plate}\n"
+            "👤 ឈ្មោះអតិថិជន : {customer_name}\n"
+            "⏳ ស្ថានភាព៖ កំពុងរង់ចាំសេវាកម្ម"
+        ),
+        "en": (
+            "Customer has successfully registered through QR Code\n\n"
+            "🛂 Ticket number# : {queue_number}\n"
+            "🚗 Plate : {plate}\n"
+            "👤 Customer Name : {customer_name}\n"
+            "⏳ Status : Waiting for service"
+        ),
+    },
+    "self_registered": {
+        "km": (
+            "អតិថិជនបានចុះឈ្មោះដោយខ្លួនឯងដោយជោគជ័យ\n\n"
+            "🛂 លេខសំបុត្រ# : {queue_number}\n"
+            "🚗 ផ្លាកលេខ : {plate}\n"
+            "👤 ឈ្មោះអតិថិជន : {customer_name}\n"
+            "⏳ ស្ថានភាព៖ កំពុងរង់ចាំសេវាកម្ម"
+        ),
+        "en": (
+            "*Customer has self-registered successfully*\n\n"
+            "🛂 Ticket Number : {queue_number}\n"
+            "🚗 Plate : {plate}\n"
+            "👤 Customer Name : {customer_name}\n"
+            "⏳ Status : Waiting for service"
+        ),
+    },
+    "qr_caption": {
+        "km": (
+            "បានចុះឈ្មោះអតិថិជនថ្មីរួចរាល់ \n\n"
+            "🛂 លេខសំបុត្រ# : {queue_number}\n"
+            "🚗 ផ្លាកលេខ : {plate}\n\n"
+            "1. បង្ហាញកូដ QR នេះទៅអតិថិជន\n"
+            "2. អតិថិជនស្កែនវាតាមម៉ាស៊ីនថតទូរស័ព្ទ\n"
+            "3. ពួកគេនឹងត្រូវបានចុះឈ្មោះដោយស្វ័យប្រវត្តិ\n"
+            "ឬផ្ញើតំណផ្ទាល់នេះទៅពួកគេ:\n"
+            "{deep_link}"
+        ),
+        "en": (
+            "New customer registration completed\n\n"
+            "🛂 Ticket Number : {queue_number}\n"
+            "🚗 Plate : {plate}\n\n"
+            "1. Show this QR code to the customer\n"
+            "2. They scan it with their phone camera\n"
+            "3. They'll be automatically registered\n"
+            "Or send them this direct link:\n"
+            "{deep_link}"
+        ),
+    },
+    "staff_registered": {
+        "km": (
+            "*អតិថិជនថ្មីត្រូវបានចុះឈ្មោះដោយបុគ្គលិក*\n\n"
+            "🛂 លេខសំបុត្រ# : {queue_number}\n"
+            "🚗 ផ្លាកលេខ : {plate}\n"
+            "👤 ឈ្មោះអតិថិជន : {customer_name}\n"
+            "⏳ ស្ថានភាព៖ កំពុងរង់ចាំអតិថិជនបញ្ចូលតាម QR"
+        ),
+        "en": (
+            "*A new customer has been registered by staff*\n\n"
+            "🛂 Ticket Number : {queue_number}\n"
+            "🚗 Plate : {plate}\n"
+            "👤 Customer Name : {customer_name}\n"
+            "⏳ Status : Waiting for customer to scan QR"
+        ),
+    },
+    "no_waiting": {
+        "km": "🚫 គ្មានអតិថិជនណាកំពុងរង់ចាំការជូនដំណឹងទេ។",
+        "en": "🚫 No customers currently waiting for notification.",
+        "sep": "\n",
+    },
+    "pick_customer": {
+        "km": "📢 ជ្រើសរើសអតិថិជនដើម្បីជូនដំណឹង (លេខសំបុត្រ# - ផ្លាកលេខ):",
+        "en": "📢 Select customer to notify ( Ticket Number - Plate):",
+        "sep": "\n",
+    },
+    "ticket_status": {
+        "header": "👑 *Admin View - Ticket Status* 👑\n\n",
+        "km": (
+            "👤 *ឈ្មោះអតិថិជន*: {customer_name}\n"
+            "🛂 *លេខសំបុត្រ*: `{queue_number}`\n"
+            "🚗 *ផ្លាកលេខ*: {plate}\n"
+            "📊 *ស្ថានភាព*: {status}\n"
+            "🕒 *ពេលវេលាចុះឈ្មោះ*: {timestamp}"
+        ),
+        "en": (
+            "🛂 *Ticket Number*: `{queue_number}`\n"
+            "🚗 *Plate*: {plate}\n"
+            "📊 *Status*: {status}\n"
+            "🕒 *Registered at*: {timestamp}"
+        ),
+        "footer": "\n\n",
+    },
+    "ticket_forbidden": {
+        "km": "❌ អ្នកមិនមានសិទ្ធិមើលសំបុត្រនេះទេ។",
+        "en": "❌ You are not authorized to view this ticket.",
+        "sep": "\n",
+    },
+    "ticket_not_found": {
+        "km": "❌ រកមិនឃើញលេខសំបុត្រនេះទេ។",
+        "en": "❌ Ticket number not found.",
+        "sep": "\n",
+    },
+    "no_tickets": {
+        "km": "ℹ️ មិនមានសំបុត្រណាមួយទេ។",
+        "en": "ℹ️ No tickets found.",
+        "sep": "\n",
+    },
+    "car_ready": {
+        "km": (
+            "✨ *ជំរាបសួរ! រថយន្តរបស់លោកអ្នកត្រូវបានលាងសំអាតរួចរាល់ហើយ។ !* ✨\n\n"
+            "🛂 លេខសំបុត្រ# : {queue_number}\n"
+            "🚗 ផ្លាកលេខ : {plate}\n"
+            "👤 ឈ្មោះបុគ្គលិក : {staff_name}\n\n"
+            "សូមអរគុណសម្រាប់ការរង់ចាំ និងការជឿទុកចិត្តលើសេវាកម្មរបស់យើងខ្ញុំ។ 🚗✨"
+        ),
+        "en": (
+            "✨ *Dear valued customer! Your car has been washed and is now ready.* ✨\n\n"
+            "🛂 Ticket Number : {queue_number}\n"
+            "🚗 Plate : {plate}\n"
+            "👤 Staff Name : {staff_name}\n\n"
+            "Thank you for your patience and trust in our service."
+        ),
+    },
+    "customer_notified": {
+        "km": (
+            "📢 បានជូនដំណឹងអតិថិជនដោយជោគជ័យ\n\n"
+            "🛂 លេខសំបុត្រ# : {queue_number}\n"
+            "🚗 ផ្លាកលេខ : {plate}\n"
+            "👤 ឈ្មោះបុគ្គលិក : {staff_name}"
+        ),
+        "en": (
+            "📢 Successfully notified customer\n\n"
+            "🛂 Ticket Number : {queue_number}\n"
+            "🚗 Plate : {plate}\n"
+            "👤 Staff Name : {staff_name}"
+        ),
+    },
+    "wash_completed": {
+        "km": (
+            "ការលាងសំអាតរថយន្តអតិថិជនត្រូវបានបញ្ចប់ដោយជោគជ័យ។\n\n"
+            "🛂 លេខសំបុត្រ# : {queue_number}\n"
+            "🚗 ផ្លាកលេខ : {plate}\n"
+            "👤 ឈ្មោះបុគ្គលិក : {staff_name}"
+        ),
+        "en": (
+            "The customer's car wash has been successfully completed.\n\n"
+            "🛂 Ticket # : {queue_number}\n"
+            "🚗 Plate : {plate}\n"
+            "👤 Staff Name : {staff_name}"
+        ),
+    },
+    "notify_failed": {
+        "km": "❌ មិនអាចជូនដំណឹងអតិថិជនបានទេ។ សូមព្យាយាមម្តងទៀត។",
+        "en": "❌ Could not notify the customer for ticket {queue_number}. Please try again.",
+        "sep": "\n",
+    },
+    "marked_ready": {
+        "km": "✅ កំពុងផ្ញើសារជូនដំណឹងអតិថិជនសម្រាប់សំបុត្រ {queue_number}",
+        "en": "✅ Notifying the customer for ticket {queue_number}",
+        "sep": "\n",
+    },
+    "marked_collected": {
+        "km": "📦 អតិថិជនបានយករថយន្តសម្រាប់សំបុត្រ {queue_number}",
+        "en": "📦 Ticket {queue_number} marked as collected",
+        "sep": "\n",
+    },
+    "ticket_state": {
+        "km": "ℹ️ សំបុត្រ {queue_number}៖ {status}",
+        "en": "ℹ️ Ticket {queue_number} is already: {status}",
+        "sep": "\n",
+    },
+    "customer_not_found": {
+        "km": "❌ រកមិនឃើញអតិថិជនទេ",
+        "en": "❌ Could not find customer.",
+        "sep": "\n",
+    },
+    "cancelled": {
+        "km": "ប្រតិបត្តិការត្រូវបានបោះបង់។",
+        "en": "Operation cancelled.",
+        "sep": "\n",
+    },
+    "admin_help": {
+        "km": (
+            "ជំនួយសម្រាប់ប្រព័ន្ធលាងរថយន្ត Speed Car Wash\n"
+            "ពាក្យបញ្ជាសម្រាប់អ្នកគ្រប់គ្រង៖\n"
+            "/register - ចុះឈ្មោះអតិថិជនថ្មី\n"
+            "/ready - ជូនដំណឹងអតិថិជនថារថយន្តរួចរាល់\n"
+            "/ready <ផ្លាកលេខ> - ស្វែងរកអតិថិជនតាមផ្លាកលេខ\n"
+            "/cancel - បោះបង់ប្រតិបត្តិការបច្ចុប្បន្ន\n"
+            "/status - ពិនិត្យស្ថានភាព\n\n"
+            "ពាក្យបញ្ជាសម្រាប់អតិថិជន៖\n"
+            "/start - ចាប់ផ្តើមដំណើរការចុះឈ្មោះ\n\n"
+            "/language - ជ្រើសរើសភាសា (km, en, both)"
+        ),
+        "en": (
+            "🛠 *Speed Car Wash Bot Help* 🛠\n\n"
+            "*Admin Commands:*\n"
+            "/register - Register a new customer\n"
+            "/ready - Notify customer their car is ready\n"
+            "/ready <plate> - Find waiting customers by plate\n"
+            "/cancel - Cancel current operation\n"
+            "/status - Check your wash status\n\n"
+            "*Customer Commands:*\n"
+            "/start - Begin registration process\n\n"
+            "*General Commands:*\n"
+            "/help - Show this help message\n"
+            "/language - Choose your language (km, en, both)"
+        ),
+    },
+    "customer_help": {
+        "km": (
+            "សូមអរគុណសម្រាប់ការប្រើប្រាស់សេវាកម្មរបស់យើង។\n"
+            "ដើម្បីចុះឈ្មោះទទួលការជូនដំណឹង៖\n"
+            "1. បញ្ជូនពាក្យបញ្ជា /start\n"
+            "2. ផ្ញើផ្លាកលេខរថយន្តរបស់អ្នកនៅពេលស្នើសុំ\n"
+            "3. អ្នកនឹងទទួលបានការជូនដំណឹងនៅពេលរថយន្តរបស់អ្នករួចរាល់\n\n"
+            "/language - ជ្រើសរើសភាសា (km, en, both)"
+        ),
+        "en": (
+            "🚗 *Speed Car Wash Customer Help* 🚗\n\n"
+            "To register for car wash notifications:\n"
+            "1. Send /start command\n"
+            "2. Provide your vehicle plate number when asked\n"
+            "3. You'll be notified when your car is ready\n\n"
+            "/language - Choose your language (km, en, both)"
+        ),
+    },
+    "language_usage": {
+        "km": "ប្រើ៖ /language km | en | both",
+        "en": "Usage: /language km | en | both",
+        "sep": "\n",
+    },
+    "language_set": {
+        "km": "✅ ភាសាត្រូវបានកំណត់។",
+        "en": "✅ Language updated.",
+        "sep": "\n",
+    },
+}
+
+
+class Template:
+    """A message parsed once into literal text and field names.
+
+    Templates without fields keep their final text, so rendering static
+    messages such as help and the welcome text costs nothing.
+    """
+
+    __slots__ = ("parts", "static")
+
+    def __init__(self, source):
+        self.parts = [
+            (literal, field) for literal, field, _, _ in Formatter().parse(source)
+        ]
+        if all(field is None for _, field in self.parts):
+            self.static = "".join(literal for literal, _ in self.parts)
+        else:
+            self.static = None
+
+    def render(self, values):
+        if self.static is not None:
+            return self.static
+        return "".join(
+            literal if field is None else literal + str(values[field])
+            for literal, field in self.parts
+        )
+
+
+def _compile(messages):
+    compiled = {}
+    for name, entry in messages.items():
+        header = entry.get("header", "")
+        footer = entry.get("footer", "")
+        bodies = {
+            KHMER: entry["km"],
+            ENGLISH: entry["en"],
+            BILINGUAL: entry["km"] + entry.get("sep", "\n\n") + entry["en"],
+        }
+        for language, body in bodies.items():
+            compiled[name, language] = Template(header + body + footer)
+    return compiled
+
+
+TEMPLATES = _compile(MESSAGES)
+
+
+def render(name, language=BILINGUAL, **values):
+    """Render message ``name`` in ``language`` (km, en or both)"""
+    template = TEMPLATES.get((name, language)) or TEMPLATES[name, BILINGUAL]
+    return template.render(values)
+
+
+def pick_language(language_code=None, preference=None):
+    """Stored preference first, then the Telegram client language, else both"""
+    if preference in LANGUAGES:
+        return preference
+    if language_code:
+        code = language_code.split("-")[0].lower()
+        if code in (KHMER, ENGLISH):
+            return code
+    return BILINGUAL
+
+
+class LanguagePreferences:
+    """Per-user language choices, cached in memory and kept in a TicketStore"""
+
+    def __init__(self, store):
+        self.store = store
+        self._cache = {}
+
+    def get(self, user_id):
+        if user_id not in self._cache:
+            self._cache[user_id] = self.store.get_meta(f"lang:{user_id}")
+        return self._cache[user_id]
+
+    def set(self, user_id, language):
+        self._cache[user_id] = language
+        self.store.set_meta(f"lang:{user_id}", language)
@@ -0,0 +1,92 @@
+import asyncio
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import qrcode
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def _png_chunk(kind: bytes, payload: bytes) -> bytes:
+    return (
+        struct.pack(">I", len(payload))
+        + kind
+        + payload
+        + struct.pack(">I", zlib.crc32(kind + payload) & 0xFFFFFFFF)
+    )
+
+
+def encode_png_1bit(matrix, scale: int = 1) -> bytes:
+    """Encode a boolean matrix (True = dark module) as a 1-bit grayscale PNG"""
+    modules = np.asarray(matrix, dtype=bool)
+    if scale > 1:
+        modules = np.repeat(np.repeat(modules, scale, axis=0), scale, axis=1)
+    height, width = modules.shape
+
+    # In 1-bit grayscale 0 is black, so dark modules become 0 bits
+    rows = np.packbits(~modules, axis=1)
+    # Every scanline starts with filter type 0 (None)
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), rows]).tobytes()
+
+    header = struct.pack(">IIBBBBB", width, height, 1, 0, 0, 0, 0)
+    return (
+        PNG_SIGNATURE
+        + _png_chunk(b"IHDR", header)
+        + _png_chunk(b"IDAT", zlib.compress(raw, 9))
+        + _png_chunk(b"IEND", b"")
+    )
+
+
+def render_qr_png(data: str, box_size: int = 10, border: int = 4) -> bytes:
+    """Render ``data`` as a QR code PNG without going through PIL"""
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=box_size,
+        border=border,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    return encode_png_1bit(qr.get_matrix(), box_size)
+
+
+class QRRenderer:
+    """Render QR codes in a worker pool, optionally from a pre-rendered pool.
+
+    ``render`` never runs the QR encoder on the event loop. When
+    ``pool_size`` is set, ``prefill`` renders the QR codes for upcoming
+    deep links ahead of time so ``render`` can return them immediately.
+    """
+
+    def __init__(self, workers: int = 2, pool_size: int = 0):
+        self.pool_size = pool_size
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="qr-render"
+        )
+        self._pool = {}  # deep link -> Future[bytes]
+
+    async def render(self, data: str) -> bytes:
+        future = self._pool.pop(data, None)
+        if future is None:
+            future = self._executor.submit(render_qr_png, data)
+        return await asyncio.wrap_future(future)
+
+    def prefill(self, upcoming):
+        """Pre-render QR codes for the next deep links, dropping stale ones"""
+        if not self.pool_size:
+            return
+        upcoming = list(upcoming)[: self.pool_size]
+        for data in list(self._pool):
+            if data not in upcoming:
+                self._pool.pop(data).cancel()
+        for data in upcoming:
+            if data not in self._pool:
+                self._pool[data] = self._executor.submit(render_qr_png, data)
+
+    def shutdown(self):
+        for future in self._pool.values():
+            future.cancel()
+        self._pool.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
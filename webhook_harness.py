@@ -0,0 +1,217 @@
+"""Replay Telegram updates against the bot in webhook or polling mode.
+
+Starts the local Bot API stand-in (fake_telegram.py), runs bot.py against it
+in a subprocess and feeds it updates: in webhook mode they are POSTed to the
+bot's webhook endpoint with the secret token, in polling mode they are served
+through getUpdates. The time from handing an update over to the bot's first
+API call for the same chat is reported per mode, so the two can be compared
+without network access.
+
+    python webhook_harness.py [--mode webhook|polling|both] [--updates FILE]
+                              [--count N] [--concurrency N]
+
+``--updates`` reads recorded updates, one JSON object per line; without it
+``--count`` synthetic /help commands from different users are sent. Webhook
+mode needs the ``webhooks`` extra of python-telegram-bot (tornado).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from fake_telegram import FakeTelegram
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+TOKEN = "123456:HARNESS"
+SECRET = "harness-secret"
+REPLY_METHODS = ("sendMessage", "sendPhoto", "editMessageText", "deleteMessage")
+
+
+def synthetic_updates(count):
+    """``count`` /help commands, each from its own private chat"""
+    updates = []
+    for i in range(count):
+        user = {"id": 200000 + i, "is_bot": False, "first_name": f"Load{i}"}
+        updates.append(
+            {
+                "update_id": i + 1,
+                "message": {
+                    "message_id": i + 1,
+                    "date": int(time.time()),
+                    "chat": {"id": user["id"], "type": "private"},
+                    "from": user,
+                    "text": "/help",
+                    "entities": [{"type": "bot_command", "offset": 0, "length": 5}],
+                },
+            }
+        )
+    return updates
+
+
+def load_updates(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def update_chat(update):
+    """Chat id a reply to ``update`` would be sent to"""
+    for key in ("message", "edited_message", "channel_post"):
+        if key in update:
+            return update[key]["chat"]["id"]
+    if "callback_query" in update:
+        return update["callback_query"]["message"]["chat"]["id"]
+    if "my_chat_member" in update:
+        return update["my_chat_member"]["chat"]["id"]
+    return None
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_bot(fake, mode, port, concurrency, cwd=None, **extra_env):
+    """Run bot.py against ``fake``; ``cwd`` holds its admin and group files"""
+    env = dict(
+        os.environ,
+        TELEGRAM_TOKEN=TOKEN,
+        TELEGRAM_API_BASE=fake.base_url,
+        TICKET_STORE="memory",
+        CONCURRENT_UPDATES=str(concurrency),
+        WEBHOOK_SECRET=SECRET,
+        PORT=str(port),
+    )
+    env.update(extra_env)
+    env.pop("RENDER_EXTERNAL_URL", None)
+    if mode == "webhook":
+        env["WEBHOOK_URL"] = f"http://127.0.0.1:{port}"
+    else:
+        env.pop("WEBHOOK_URL", None)
+    return subprocess.Popen([sys.executable, BOT_SCRIPT], env=env, cwd=cwd)
+
+
+def first_replies(fake, since):
+    """Map chat id -> time of the first reply API call after ``since``"""
+    replies = {}
+    for call in list(fake.calls):
+        if call.method in REPLY_METHODS and call.status == 200 and call.at >= since:
+            chat_id = str(call.params.get("chat_id"))
+            replies.setdefault(chat_id, call.at)
+    return replies
+
+
+async def post_updates(url, updates, concurrency):
+    """POST every update to the webhook; returns {chat_id: sent_at}"""
+    sent = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+
+    async with httpx.AsyncClient(timeout=30) as client:
+        # A request without the secret must be turned away
+        response = await client.post(url, json=updates[0])
+        print(f"request without secret token: HTTP {response.status_code}")
+
+        async def post(update):
+            async with semaphore:
+                sent.setdefault(str(update_chat(update)), time.monotonic())
+                response = await client.post(url, json=update, headers=headers)
+                response.raise_for_status()
+
+        await asyncio.gather(*(post(update) for update in updates))
+    return sent
+
+
+def wait_until_ready(fake, bot, mode, port, timeout=30):
+    """Wait for the bot to start polling or to serve its webhook"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and bot.poll() is None:
+        if mode == "polling":
+            if fake.calls_to("getUpdates"):
+                return True
+        elif fake.calls_to("setWebhook"):
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                return True
+            except OSError:
+                pass
+        time.sleep(0.1)
+    return False
+
+
+def run(mode, updates, concurrency, timeout):
+    fake = FakeTelegram().start()
+    port = free_port()
+    bot = start_bot(fake, mode, port, concurrency)
+    try:
+        if not wait_until_ready(fake, bot, mode, port):
+            print(f"{mode}: bot did not come up")
+            return None
+
+        expected = {str(update_chat(u)) for u in updates if update_chat(u) is not None}
+        started = time.monotonic()
+        if mode == "webhook":
+            url = f"http://127.0.0.1:{port}/telegram"
+            sent = asyncio.run(post_updates(url, updates, concurrency))
+        else:
+            sent = {}
+            for update in updates:
+                sent.setdefault(str(update_chat(update)), time.monotonic())
+                fake.push_update(update)
+
+        fake.wait_for(
+            lambda calls: expected <= first_replies(fake, started).keys(), timeout
+        )
+        elapsed = time.monotonic() - started
+        replies = first_replies(fake, started)
+    finally:
+        bot.terminate()
+        try:
+            bot.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+        fake.stop()
+
+    latencies = [
+        (replies[chat] - sent[chat]) * 1000 for chat in expected if chat in replies
+    ]
+    missing = len(expected) - len(latencies)
+    print(
+        f"{mode:<8} {len(updates)} updates in {elapsed:.2f}s "
+        f"({len(updates) / elapsed:.0f}/s), {missing} without reply"
+    )
+    if latencies:
+        latencies.sort()
+        p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+        print(
+            f"{'':<8} latency ms: median {statistics.median(latencies):.1f}, "
+            f"p95 {p95:.1f}, max {latencies[-1]:.1f}"
+        )
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=("webhook", "polling", "both"), default="both")
+    parser.add_argument("--updates", help="recorded updates, one JSON per line")
+    parser.add_argument("--count", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    updates = load_updates(args.updates) if args.updates else synthetic_updates(args.count)
+    modes = ("polling", "webhook") if args.mode == "both" else (args.mode,)
+    for mode in modes:
+        run(mode, updates, args.concurrency, args.timeout)
+
+
+if __name__ == "__main__":
+    main()